@@ -0,0 +1,164 @@
+"""
+Batch evaluation of the classification rules over many documents at once,
+for documents whose text is already known (eg kept in the catalog).
+
+Every document is scanned once to build a boolean incidence matrix of
+documents x patterns, where a pattern is one of the conditions the banks use:
+a literal (or a set of literals) that has to be found in a single line. The
+banks' needs_one_of and simple_mappings then become OR / AND reductions over
+columns of that matrix, evaluated for all the documents in one go, with the
+same first-match-wins order as the parsers. Only documents that fall through
+to a bank's special cases run that bank's process() as usual.
+"""
+
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from parsing.metadata import DocumentMetadata, Filing
+
+# a condition: all the strings have to be contained in the same line
+Pattern = Tuple[str, ...]
+
+# lines are joined with a character that can't be part of any literal, so that
+# looking for a literal in the joined text is the same as looking in each line
+LINE_SEPARATOR = "\x00"
+
+NO_MATCH = -1
+
+
+def filing_patterns(filing: Filing) -> Optional[List[Pattern]]:
+    """conditions of a filing as patterns, None if it can never apply"""
+    if not filing.must_contain:
+        return None
+    if not isinstance(filing.must_contain, list):
+        return [(filing.must_contain,)]
+    return [
+        tuple(condition) if isinstance(condition, list) else (condition,)
+        for condition in filing.must_contain
+    ]
+
+
+@dataclass
+class BatchResult:
+    """Which bank and which of its simple_mappings decided every document.
+    bank is NO_MATCH when no bank claims the document, rule is NO_MATCH when
+    the bank claims it but none of its simple mappings applies"""
+
+    banks: np.ndarray
+    rules: np.ndarray
+    incidence: np.ndarray
+
+
+class BatchClassifier:
+    """Evaluates the rules of the given bank parsers (in priority order) over
+    lists of documents, each document being its list of lines"""
+
+    def __init__(self, bank_parsers: list):
+        self.bank_parsers = bank_parsers
+        self.patterns: List[Pattern] = []
+        self.pattern_index: Dict[Pattern, int] = {}
+        self.needs: List[np.ndarray] = []
+        self.rules: List[List[Optional[np.ndarray]]] = []
+        # the rules as they are now, in case the parsers are changed later
+        self.mappings = [list(parser.simple_mappings) for parser in bank_parsers]
+        for parser in bank_parsers:
+            self.needs.append(
+                np.array(
+                    [self._pattern((literal,)) for literal in parser.needs_one_of],
+                    dtype=np.intp,
+                )
+            )
+            rules = []
+            for filing in parser.simple_mappings:
+                patterns = filing_patterns(filing)
+                rules.append(
+                    None
+                    if patterns is None
+                    else np.array([self._pattern(p) for p in patterns], dtype=np.intp)
+                )
+            self.rules.append(rules)
+
+    def _pattern(self, pattern: Pattern) -> int:
+        if pattern not in self.pattern_index:
+            self.pattern_index[pattern] = len(self.patterns)
+            self.patterns.append(pattern)
+        return self.pattern_index[pattern]
+
+    def incidence(self, documents: List[List[str]]) -> np.ndarray:
+        """boolean matrix with a row per document and a column per pattern"""
+        singles = [
+            (index, pattern[0])
+            for index, pattern in enumerate(self.patterns)
+            if len(pattern) == 1
+        ]
+        multiples = [
+            (index, pattern)
+            for index, pattern in enumerate(self.patterns)
+            if len(pattern) > 1
+        ]
+        matrix = np.zeros((len(documents), len(self.patterns)), dtype=bool)
+        for row, lines in enumerate(documents):
+            text = LINE_SEPARATOR.join(lines)
+            matrix[row, [index for index, literal in singles if literal in text]] = True
+            for index, pattern in multiples:
+                # cheap rejection on the whole text before looking line by line
+                if all(literal in text for literal in pattern) and any(
+                    all(literal in line for literal in pattern) for line in lines
+                ):
+                    matrix[row, index] = True
+        return matrix
+
+    def evaluate(self, incidence: np.ndarray) -> BatchResult:
+        """decides bank and rule for every row of an incidence matrix"""
+        documents = incidence.shape[0]
+        banks = np.full(documents, NO_MATCH, dtype=np.int16)
+        rules = np.full(documents, NO_MATCH, dtype=np.int16)
+        undecided = np.ones(documents, dtype=bool)
+        for bank_number, (needs, bank_rules) in enumerate(zip(self.needs, self.rules)):
+            # the first bank whose markers are found takes the document
+            claimed = undecided & incidence[:, needs].any(axis=1)
+            banks[claimed] = bank_number
+            undecided &= ~claimed
+
+            pending = claimed.copy()
+            for rule_number, patterns in enumerate(bank_rules):
+                if patterns is None:
+                    continue
+                hits = pending & incidence[:, patterns].all(axis=1)
+                rules[hits] = rule_number
+                pending &= ~hits
+        return BatchResult(banks=banks, rules=rules, incidence=incidence)
+
+    def classify(
+        self, names: List[str], documents: List[List[str]]
+    ) -> Tuple[BatchResult, List[Optional[DocumentMetadata]], Dict[str, Exception]]:
+        """evaluates the rules for all the documents and builds their metadata.
+        Documents not decided by a simple mapping go through the bank's
+        process(). Documents that fail, like they would in a normal run, are
+        returned apart with their error and have no metadata"""
+        result = self.evaluate(self.incidence(documents))
+        metadata: List[Optional[DocumentMetadata]] = []
+        errors: Dict[str, Exception] = {}
+        for name, lines, bank_number, rule_number in zip(
+            names, documents, result.banks.tolist(), result.rules.tolist()
+        ):
+            if bank_number == NO_MATCH:
+                metadata.append(None)
+                continue
+            parser = self.bank_parsers[bank_number]
+            try:
+                if rule_number == NO_MATCH:
+                    metadata.append(parser.process(name, None, lines))
+                    continue
+                filing = self.mappings[bank_number][rule_number]
+                metadata.append(
+                    parser.simple_document(
+                        lines, filing.classification, filing.entity, filing.extra_info
+                    )
+                )
+            except Exception as exc:  # noqa: E0602
+                errors[name] = exc
+                metadata.append(None)
+        return result, metadata, errors
@@ -0,0 +1,163 @@
+"""
+Clustering of documents by template, to help writing the Filing rules for the
+documents that are not recognised yet. Documents are compared by the set of
+their lines (with digits masked, so dates and amounts don't matter) using
+MinHash signatures and locality sensitive hashing, which only compares
+documents that share at least one band of their signature: the cost grows
+almost linearly with the number of documents instead of quadratically.
+"""
+
+import random
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Set, Tuple
+
+from analysis.fingerprint import feature_hash
+
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+DIGITS = re.compile(r"\d")
+
+# documents of a big template all fall in the same buckets, comparing against a
+# few of them is enough to join the cluster and keeps adding documents linear
+BUCKET_REPRESENTATIVES = 8
+
+# minimum length for a line to be offered as a must_contain literal, shorter
+# ones ("de", "EUR", "Page") are too generic to identify a template
+MIN_LITERAL_LENGTH = 8
+
+
+def line_shingles(lines: List[str]) -> Set[str]:
+    """the template of a document as the set of its normalised lines"""
+    shingles = set()
+    for line in lines:
+        shingle = DIGITS.sub("0", " ".join(line.split()))
+        if shingle:
+            shingles.add(shingle)
+    return shingles
+
+
+class MinHasher:
+    """MinHash signatures: the fraction of equal positions between two
+    signatures estimates the Jaccard similarity of the two sets"""
+
+    def __init__(self, permutations: int = 64, seed: int = 1):
+        generator = random.Random(seed)
+        self.permutations = [
+            (
+                generator.randint(1, MERSENNE_PRIME - 1),
+                generator.randint(0, MERSENNE_PRIME - 1),
+            )
+            for _ in range(permutations)
+        ]
+
+    def signature(self, shingles: Set[str]) -> Tuple[int, ...]:
+        """ signature of a set of shingles """
+        values = [feature_hash(shingle) for shingle in shingles] or [0]
+        return tuple(
+            min(((a * value + b) % MERSENNE_PRIME) & MAX_HASH for value in values)
+            for a, b in self.permutations
+        )
+
+
+def similarity(first: Tuple[int, ...], second: Tuple[int, ...]) -> float:
+    """ estimated Jaccard similarity of the sets behind two signatures """
+    return sum(1 for a, b in zip(first, second) if a == b) / len(first)
+
+
+@dataclass
+class Cluster:
+    """ Documents that share a template """
+
+    members: List[str]
+    literals: List[Tuple[str, int, int]] = field(default_factory=list)
+
+
+class TemplateClusterer:
+    """Groups documents by template. Signatures are split in bands of rows,
+    documents with an identical band become candidates, and candidates whose
+    estimated similarity reaches the threshold end up in the same cluster"""
+
+    def __init__(self, permutations: int = 64, bands: int = 16, threshold=0.5):
+        if permutations % bands:
+            raise Exception(f"{permutations} permutations can't be split in {bands}")
+        self.hasher = MinHasher(permutations)
+        self.bands = bands
+        self.rows = permutations // bands
+        self.threshold = threshold
+        self.shingles: Dict[str, Set[str]] = {}
+        self.lines: Dict[str, List[str]] = {}
+        self.signatures: Dict[str, Tuple[int, ...]] = {}
+        self.parents: Dict[str, str] = {}
+        self.buckets: List[Dict[Tuple[int, ...], List[str]]] = [
+            {} for _ in range(bands)
+        ]
+
+    def _root(self, key: str) -> str:
+        while self.parents[key] != key:
+            self.parents[key] = self.parents[self.parents[key]]
+            key = self.parents[key]
+        return key
+
+    def add(self, key: str, lines: List[str]):
+        """adds a document, joining it to the clusters of the similar ones"""
+        shingles = line_shingles(lines)
+        signature = self.hasher.signature(shingles)
+        self.shingles[key] = shingles
+        self.lines[key] = lines
+        self.signatures[key] = signature
+        self.parents[key] = key
+        for band in range(self.bands):
+            value = signature[band * self.rows : (band + 1) * self.rows]
+            bucket = self.buckets[band].setdefault(value, [])
+            for other in bucket:
+                if self._root(other) == self._root(key):
+                    continue
+                if similarity(signature, self.signatures[other]) >= self.threshold:
+                    self.parents[self._root(other)] = self._root(key)
+            if len(bucket) < BUCKET_REPRESENTATIVES:
+                bucket.append(key)
+
+    def clusters(self, max_literals: int = 5) -> List[Cluster]:
+        """clusters found, biggest first, each one with the lines that best
+        tell its documents apart from the rest as candidate must_contain"""
+        groups: Dict[str, List[str]] = {}
+        for key in self.parents:
+            groups.setdefault(self._root(key), []).append(key)
+
+        # in how many documents each template line appears, overall
+        frequency: Dict[str, int] = {}
+        for shingles in self.shingles.values():
+            for shingle in shingles:
+                frequency[shingle] = frequency.get(shingle, 0) + 1
+
+        clusters = []
+        for members in groups.values():
+            literals = self._literals(members, frequency)[:max_literals]
+            clusters.append(Cluster(sorted(members), literals))
+        clusters.sort(key=lambda cluster: (-len(cluster.members), cluster.members[0]))
+        return clusters
+
+    def _literals(self, members: List[str], frequency: Dict[str, int]):
+        """lines ranked by how many of the members contain them minus how many
+        documents outside the cluster do. Only lines without digits are offered,
+        the rest are dates, amounts or references that change on every document"""
+        inside: Dict[str, int] = {}
+        originals: Dict[str, str] = {}
+        for member in members:
+            for line in self.lines[member]:
+                shingle = DIGITS.sub("0", " ".join(line.split()))
+                if shingle in originals or len(shingle) < MIN_LITERAL_LENGTH:
+                    continue
+                if DIGITS.search(line):
+                    continue
+                originals[shingle] = line
+            for shingle in self.shingles[member]:
+                inside[shingle] = inside.get(shingle, 0) + 1
+
+        ranked = []
+        for shingle, line in originals.items():
+            outside = frequency[shingle] - inside[shingle]
+            ranked.append((line, inside[shingle], outside))
+        ranked.sort(key=lambda literal: (literal[2] - literal[1], -len(literal[0])))
+        return ranked
@@ -0,0 +1,151 @@
+"""
+Dependencies between the classification rules and the documents they decided,
+to re-classify only the documents whose outcome can change after the rules of
+a bank are edited.
+
+Given how the rules are evaluated (banks in order, the first bank with one of
+its needs_one_of claims the document, then its simple_mappings in order, first
+match wins) a change in a bank's simple_mappings starting at position k can
+only affect the documents that bank decided with rule k or later, or that it
+claimed without any rule deciding them. New needs_one_of markers can only take
+documents no bank claimed or that a later bank claimed, removed markers only
+documents where they were found.
+"""
+
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from analysis.batch import NO_MATCH, BatchClassifier, BatchResult, filing_patterns
+from storage.decisions import Decision, DecisionStore
+
+Ruleset = Dict[str, Tuple[int, dict]]
+
+
+def current_rulesets(bank_parsers: list) -> Ruleset:
+    """the rules of the given parsers, in the form they are stored in snapshots"""
+    rulesets = {}
+    for position, parser in enumerate(bank_parsers):
+        rules = []
+        for filing in parser.simple_mappings:
+            patterns = filing_patterns(filing)
+            rules.append(
+                {
+                    "patterns": [list(p) for p in patterns] if patterns else None,
+                    "outcome": [
+                        filing.classification.value,
+                        filing.entity,
+                        filing.extra_info,
+                    ],
+                }
+            )
+        rulesets[parser.bank.value] = (
+            position,
+            {"needs": list(parser.needs_one_of), "rules": rules},
+        )
+    return rulesets
+
+
+def affected_documents(
+    decisions: Iterable[Decision], previous: Ruleset, current: Ruleset
+) -> Optional[Set[str]]:
+    """hashes of the documents whose classification can change from the
+    previous rules to the current ones. None if any of them can (banks added,
+    removed or tried in a different order)"""
+    if {bank: position for bank, (position, _) in previous.items()} != {
+        bank: position for bank, (position, _) in current.items()
+    }:
+        return None
+
+    decisions = list(decisions)
+    affected: Set[str] = set()
+    for bank, (position, definition) in current.items():
+        old_definition = previous[bank][1]
+
+        old_needs = set(old_definition["needs"])
+        new_needs = set(definition["needs"])
+        if new_needs - old_needs:
+            affected.update(
+                decision.hash
+                for decision in decisions
+                if decision.bank is None or current[decision.bank][0] > position
+            )
+        removed = {(literal,) for literal in old_needs - new_needs}
+        if removed:
+            affected.update(
+                decision.hash
+                for decision in decisions
+                if decision.bank == bank and removed.intersection(decision.hits)
+            )
+
+        old_rules = old_definition["rules"]
+        new_rules = definition["rules"]
+        first_change = next(
+            (
+                index
+                for index, (old, new) in enumerate(zip(old_rules, new_rules))
+                if old != new
+            ),
+            None,
+        )
+        if first_change is None and len(old_rules) != len(new_rules):
+            first_change = min(len(old_rules), len(new_rules))
+        if first_change is None:
+            continue
+
+        # documents of this bank decided from the first change on, or where the
+        # literals of the rules that changed were found
+        changed_literals = set()
+        for rule in old_rules[first_change:] + new_rules[first_change:]:
+            for pattern in rule["patterns"] or []:
+                changed_literals.add(tuple(pattern))
+        for decision in decisions:
+            if decision.bank != bank:
+                continue
+            if (
+                decision.rule is None
+                or decision.rule >= first_change
+                or changed_literals.intersection(decision.hits)
+            ):
+                affected.add(decision.hash)
+    return affected
+
+
+class RuleTracker:
+    """Records how each document is decided while documents are classified"""
+
+    def __init__(self, store: DecisionStore, bank_parsers: list):
+        self.store = store
+        self.bank_parsers = bank_parsers
+        self.classifier = BatchClassifier(bank_parsers)
+        # documents already in the store were decided with the rules of the
+        # snapshot, it's only saved if this is the first time
+        if not store.rulesets():
+            store.save_rulesets(current_rulesets(bank_parsers))
+
+    def decisions(self, names: List[str], result: BatchResult) -> List[Decision]:
+        """decisions for the documents of a batch evaluation"""
+        decisions = []
+        for row, name in enumerate(names):
+            bank_number = int(result.banks[row])
+            rule_number = int(result.rules[row])
+            decisions.append(
+                Decision(
+                    hash=name,
+                    bank=(
+                        None
+                        if bank_number == NO_MATCH
+                        else self.bank_parsers[bank_number].bank.value
+                    ),
+                    rule=None if rule_number == NO_MATCH else rule_number,
+                    hits=[
+                        self.classifier.patterns[index]
+                        for index in result.incidence[row].nonzero()[0]
+                    ],
+                )
+            )
+        return decisions
+
+    def record(self, content_hash: str, lines: List[str]):
+        """evaluates the rules for a single document and records its decision"""
+        result = self.classifier.evaluate(self.classifier.incidence([lines]))
+        for decision in self.decisions([content_hash], result):
+            self.store.add(decision)
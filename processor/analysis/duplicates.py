@@ -0,0 +1,114 @@
+"""
+Detection of documents that have already been seen: exact copies are found by
+content hash before parsing, so they are not classified again, near copies by
+the fingerprint of their text once parsed. Documents that would be renamed to
+the same file name are reported so each collision is resolved on purpose.
+"""
+
+import os
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from analysis.fingerprint import NearDuplicateIndex, hamming_distance
+from parsing.metadata import Bank, DocumentMetadata
+from storage.catalog import Catalog
+
+
+@dataclass
+class SeenDocument:
+    """ A document already classified, in this run or a previous one """
+
+    path: str
+    hash: str
+    metadata: Optional[DocumentMetadata]
+    file_name: Optional[str] = None
+    fingerprint: Optional[int] = None
+
+
+class DuplicateDetector:
+    """Keeps track of the documents of a run. If a catalog is given, documents
+    classified in previous runs are taken into account too"""
+
+    def __init__(
+        self, catalog: Catalog = None, use_catalog=True, max_distance: int = 3
+    ):
+        self.catalog = catalog if use_catalog else None
+        self.by_hash: Dict[str, SeenDocument] = {}
+        self.near = NearDuplicateIndex(max_distance)
+        self.near_groups: Dict[str, List[str]] = {}
+        self.by_file_name: Dict[str, List[SeenDocument]] = {}
+        self.fingerprints: Dict[str, int] = {}
+        if self.catalog:
+            for path, fingerprint in self.catalog.fingerprints():
+                self.near.add(path, fingerprint)
+
+    def find_copy(self, content_hash: str, path: str) -> Optional[SeenDocument]:
+        """returns the document with exactly the same contents, if already classified.
+        If the same file was classified in a previous run, that one is preferred"""
+        if content_hash in self.by_hash:
+            return self.by_hash[content_hash]
+        if self.catalog:
+            entries = self.catalog.find_by_hash(content_hash)
+            if entries:
+                path = os.path.abspath(path)
+                entry = next(
+                    (entry for entry in entries if entry.path == path), entries[0]
+                )
+                metadata = entry.metadata
+                if metadata.bank == Bank.UNKNOWN:
+                    metadata = None
+                return SeenDocument(
+                    entry.path, content_hash, metadata, None, entry.fingerprint
+                )
+        return None
+
+    def add(
+        self,
+        path: str,
+        content_hash: str,
+        metadata: Optional[DocumentMetadata],
+        file_name: Optional[str],
+        fingerprint: int = None,
+    ):
+        """records a document of this run. Copies are added without fingerprint"""
+        path = os.path.abspath(path)
+        document = SeenDocument(path, content_hash, metadata, file_name, fingerprint)
+        self.by_hash.setdefault(content_hash, document)
+        if file_name:
+            self.by_file_name.setdefault(file_name, []).append(document)
+        if fingerprint is not None:
+            self.fingerprints[content_hash] = fingerprint
+            similar = self.near.add(path, fingerprint)
+            if similar:
+                self.near_groups[path] = sorted(similar)
+
+    def report(self):
+        """prints the near duplicates found and the file name collisions"""
+        if self.near_groups:
+            print("===== Near duplicates (similar text, different file)")
+            for path, similar in sorted(self.near_groups.items()):
+                print(f"{path}\n    similar to: {', '.join(similar)}")
+
+        collisions = {
+            name: documents
+            for name, documents in self.by_file_name.items()
+            if len(documents) > 1
+        }
+        if collisions:
+            print("===== File name collisions")
+            for name, documents in sorted(collisions.items()):
+                hashes = sorted({document.hash for document in documents})
+                fingerprints = [self.fingerprints.get(value) for value in hashes]
+                if len(hashes) == 1:
+                    cause = "exact copies"
+                elif None not in fingerprints and all(
+                    hamming_distance(fingerprints[0], fingerprint)
+                    <= self.near.max_distance
+                    for fingerprint in fingerprints
+                ):
+                    cause = "near duplicates, probably re-issued"
+                else:
+                    cause = "different documents, the name needs more detail"
+                print(f"{name} ({cause}):")
+                for document in documents:
+                    print(f"    {document.path}")
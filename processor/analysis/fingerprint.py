@@ -0,0 +1,97 @@
+"""
+Content fingerprints of documents, used to find copies of the same statement
+that are not byte identical (downloaded again, re-issued, re-generated...)
+"""
+
+import hashlib
+from typing import Dict, Iterable, List, Set
+
+FINGERPRINT_BITS = 64
+SHINGLE_SIZE = 3
+
+
+def normalize_lines(lines: Iterable[str]) -> List[str]:
+    """lower case words of the document, ignoring layout (new lines, spacing).
+    Digits are kept on purpose: two months of the same statement only differ in them"""
+    words = []
+    for line in lines:
+        words += line.casefold().split()
+    return words
+
+
+def feature_hash(feature: str) -> int:
+    """stable 64 bit hash of a feature, python's hash() changes between runs"""
+    return int.from_bytes(
+        hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "big"
+    )
+
+
+def simhash(lines: Iterable[str]) -> int:
+    """64 bit SimHash of the shingles of consecutive words of the document:
+    similar documents produce fingerprints that differ in only a few bits"""
+    words = normalize_lines(lines)
+    if len(words) < SHINGLE_SIZE:
+        shingles = [" ".join(words)]
+    else:
+        shingles = [
+            " ".join(words[index : index + SHINGLE_SIZE])
+            for index in range(len(words) - SHINGLE_SIZE + 1)
+        ]
+    weights = [0] * FINGERPRINT_BITS
+    for shingle in shingles:
+        value = feature_hash(shingle)
+        for bit in range(FINGERPRINT_BITS):
+            if value & (1 << bit):
+                weights[bit] += 1
+            else:
+                weights[bit] -= 1
+    fingerprint = 0
+    for bit, weight in enumerate(weights):
+        if weight > 0:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+def hamming_distance(first: int, second: int) -> int:
+    """ number of bits that differ between two fingerprints """
+    return bin(first ^ second).count("1")
+
+
+class NearDuplicateIndex:
+    """Finds fingerprints within a maximum hamming distance without comparing
+    against every other one: the fingerprint is split in max_distance + 1 bands
+    and, by the pigeonhole principle, two fingerprints that close must have at
+    least one band identical, so only those sharing a band are compared"""
+
+    def __init__(self, max_distance: int = 3):
+        self.max_distance = max_distance
+        self.bands = max_distance + 1
+        self.band_bits = FINGERPRINT_BITS // self.bands
+        self.buckets: List[Dict[int, List[str]]] = [{} for _ in range(self.bands)]
+        self.fingerprints: Dict[str, int] = {}
+
+    def _band_values(self, fingerprint: int):
+        mask = (1 << self.band_bits) - 1
+        for band in range(self.bands):
+            yield band, (fingerprint >> (band * self.band_bits)) & mask
+
+    def similar(self, fingerprint: int) -> Set[str]:
+        """keys of the fingerprints indexed so far close enough to this one"""
+        candidates = set()
+        for band, value in self._band_values(fingerprint):
+            candidates.update(self.buckets[band].get(value, []))
+        return {
+            key
+            for key in candidates
+            if hamming_distance(fingerprint, self.fingerprints[key])
+            <= self.max_distance
+        }
+
+    def add(self, key: str, fingerprint: int) -> Set[str]:
+        """indexes a fingerprint, returning the keys already indexed that are similar"""
+        similar = self.similar(fingerprint)
+        similar.discard(key)
+        self.fingerprints[key] = fingerprint
+        for band, value in self._band_values(fingerprint):
+            self.buckets[band].setdefault(value, []).append(key)
+        return similar
@@ -0,0 +1,94 @@
+"""
+Scheduling of the documents of a parallel run. The cost of every document is
+estimated before parsing it, from its file size and its number of pages (read
+from the page tree of the PDF, without any layout analysis), so the biggest
+documents can be started first: a few long extracts left for the end would
+keep one worker busy while the rest are idle. Starting with the smallest ones
+gives results sooner instead, for interactive use.
+"""
+
+import heapq
+import os
+from dataclasses import dataclass
+from typing import List, Optional
+
+from pdfminer.pdfdocument import PDFDocument
+from pdfminer.pdfparser import PDFParser
+from pdfminer.pdftypes import resolve1
+
+# rough cost of the layout analysis, the report of every run shows the real one
+SECONDS_PER_PAGE = 0.2
+SECONDS_PER_MEGABYTE = 0.5
+
+ORDERS = ["largest", "smallest", "walk"]
+
+
+@dataclass
+class Job:
+    """ A document to classify and its estimated cost in seconds """
+
+    path: str
+    size: int
+    pages: Optional[int]
+    cost: float
+    seconds: float = 0.0
+
+
+def page_count(pdf_file: str) -> Optional[int]:
+    """number of pages from the page tree, None if it can't be read cheaply
+    (damaged or encrypted documents)"""
+    try:
+        with open(pdf_file, "rb") as pdf:
+            document = PDFDocument(PDFParser(pdf))
+            count = resolve1(resolve1(document.catalog["Pages"]).get("Count"))
+            return int(count) if count is not None else None
+    except Exception:  # noqa: E0602 pylint: disable=broad-except
+        return None
+
+
+def estimate(pdf_file: str) -> Job:
+    """ the job of a document with its estimated cost """
+    size = os.path.getsize(pdf_file)
+    pages = page_count(pdf_file)
+    # without pages, a page every 100KB
+    cost_pages = pages if pages is not None else max(1, size // 100_000)
+    cost = cost_pages * SECONDS_PER_PAGE + size / 1_000_000 * SECONDS_PER_MEGABYTE
+    return Job(pdf_file, size, pages, cost)
+
+
+def schedule(jobs: List[Job], order: str = "largest") -> List[Job]:
+    """the jobs in the order they should be dispatched. Ties keep the order
+    they were found in"""
+    if order == "largest":
+        return sorted(jobs, key=lambda job: -job.cost)
+    if order == "smallest":
+        return sorted(jobs, key=lambda job: job.cost)
+    if order == "walk":
+        return list(jobs)
+    raise Exception(f"unknown order {order}, use one of {', '.join(ORDERS)}")
+
+
+def makespan(costs: List[float], workers: int) -> float:
+    """time to finish all the jobs, dispatched in this order, each one to the
+    first worker that is free"""
+    finish_times = [0.0] * max(1, workers)
+    for cost in costs:
+        heapq.heappush(finish_times, heapq.heappop(finish_times) + cost)
+    return max(finish_times)
+
+
+def report(jobs: List[Job], workers: int, elapsed: float) -> str:
+    """predicted and actual makespan of a run, and what each page really took"""
+    pages = sum(job.pages or 0 for job in jobs)
+    busy = sum(job.seconds for job in jobs)
+    # no schedule can beat the total work split evenly, or the longest job
+    best = max(busy / max(1, workers), max((job.seconds for job in jobs), default=0))
+    predicted = makespan([job.cost for job in jobs], workers)
+    lines = [
+        f"===== Schedule: {len(jobs)} documents, {pages} pages, {workers} workers",
+        f"predicted makespan {predicted:.1f}s, actual {elapsed:.1f}s "
+        f"(best possible with the real times {best:.1f}s)",
+    ]
+    if pages:
+        lines.append(f"measured {busy / pages:.2f}s per page")
+    return "\n".join(lines)
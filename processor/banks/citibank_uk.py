@@ -7,8 +7,16 @@ from typing import List
 
 from pdfminer.layout import LTPage
 
+from banks.registry import markers
 from parsing.common import find_containing, parse_date_gb
-from parsing.metadata import Bank, DocType, DocumentMetadata, Filing
+from parsing.dates import MONTH_ABBREVIATIONS, DateEngine
+from parsing.metadata import (
+    Bank,
+    DocType,
+    DocumentMetadata,
+    Filing,
+    UnrecognisedDocument,
+)
 
 known_date_regexes = [
     # blahblah\01/07/2018 - 30/06/2019\nblah blabh
@@ -25,25 +33,21 @@ known_date_regexes = [
 ]
 
 
+date_engine = DateEngine(
+    known_date_regexes, parse_date_gb, needs_any=MONTH_ABBREVIATIONS + ["/"]
+)
+
+
 def find_date(lines):
     """finds the first string that matches a known pattern"""
-    index = 0
-    for line in lines:
-        try:
-            for date_regex in known_date_regexes:
-                matches = date_regex.match(line)
-                if matches:
-                    return parse_date_gb(matches.group("date"))
-        except ValueError:
-            pass
-
-        index += 1
-    return None
+    return date_engine.find_date(lines)
 
 
 class CitibankUKBankDocuments:
     """ Parsers for all the known PDF documents """
 
+    bank = Bank.CITIBANK_UK
+
     simple_mappings = [
         Filing(["Relationship report for"], DocType.STATEMENT, "current", "summary"),
         Filing(
@@ -54,6 +58,9 @@ class CitibankUKBankDocuments:
         ),
     ]
 
+    # the document belongs to the bank if it contains any of its markers
+    needs_one_of = markers(Bank.CITIBANK_UK)
+
     def process(
         self,
         file_name: str,  # pylint: disable=unused-argument
@@ -64,12 +71,8 @@ class CitibankUKBankDocuments:
         and return metadata, else None"""
 
         # first try to determine if the document belongs here or not - if not, None is returned
-        needs_one_of = [
-            "Summary of your Citi Relationship",
-            "SUMMARY OF YOUR CITIBANK ACCOUNT",
-        ]
         passes = False
-        for must_have in needs_one_of:
+        for must_have in self.needs_one_of:
             if find_containing(lines, must_have):
                 passes = True
                 break
@@ -82,7 +85,7 @@ class CitibankUKBankDocuments:
                     lines, filing.classification, filing.entity, filing.extra_info
                 )
 
-        raise Exception("Documents seems to belong to bank but isn't recognised")
+        raise UnrecognisedDocument(Bank.CITIBANK_UK)
 
     def simple_document(self, lines, classification, entity="", extra_info=""):
         """ a lot of documents follow a basic pattern and we only need the first date we find """
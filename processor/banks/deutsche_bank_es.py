@@ -2,139 +2,191 @@
 Parsing for the documents received from the entity Deutsche Bank ES
 """
 
+import os
 import re
 from datetime import datetime
-from typing import List
+from functools import lru_cache
+from typing import Iterator, List, Tuple
 
 import dateparser
 from pdfminer.layout import LTPage
 
+from banks.registry import markers
+from parsing.adjustments import AdjustmentTable
 from parsing.common import (
     find_containing,
     find_starting_with,
     parse_date_es_ca,
 )
-from parsing.metadata import Bank, DocType, DocumentMetadata, Adjustment, Filing
+from parsing.metadata import (
+    Bank,
+    DocType,
+    DocumentMetadata,
+    Filing,
+    UnrecognisedDocument,
+)
+
+
+# what makes a line a date candidate, in the order find_date tries them
+WRONG_DATE = "wrong date"
+DATE_NEXT_LINE = "date in the next line"
+DATE_SAME_LINE = "date in the same line"
+PERIOD = "period"
+DATE_AFTER_LABEL = "date after label"
+WORDS_IN_FIVE_LINES = "date in five lines"
+WORDS_IN_THREE_LINES = "date in three lines"
+MONTH_AND_YEAR = "month and year"
+FREE_TEXT = "free text"
+
+LEADING_DATE = re.compile(r"(\d{2}.\d{2}.\d{2,4}) .*")
+PERIOD_END = re.compile(r"Període de .* al (?P<date>.*)")
+DAY_MONTH_YEAR = re.compile(r"\d{1,2} \w+ \d{2,4}")
+MONTH_YEAR_LINE = re.compile(
+    r"^(Enero|Febrero|Marzo|Abril|Mayo|Junio|Julio|Agosto|Septiembre|Octubre|Noviembre|Diciembre) de \d{2,4}\n"  # pylint: disable=line-too-long
+)
+
+
+# dateparser takes what is not written in the line from the current date
+EXPLICIT_DAY = re.compile(r"\b\d{1,2}\b")
+EXPLICIT_YEAR = re.compile(r"\b\d{4}\b")
+
+
+@lru_cache(maxsize=4096)
+def _parse_dated_line(line):
+    return dateparser.parse(line, languages=["es", "ca"])
+
+
+def parse_free_text_date(line):
+    """last resort of find_date: any line with a " de " may contain a date in words.
+    The same legal text is found in many documents, so the results are kept, but
+    only for lines with the day and the year written: the others depend on the
+    current date, which changes while the service runs"""
+    if EXPLICIT_DAY.search(line) and EXPLICIT_YEAR.search(line):
+        return _parse_dated_line(line)
+    return dateparser.parse(line, languages=["es", "ca"])
+
+
+def date_candidates(lines: List[str]) -> Iterator[Tuple[int, str]]:
+    """the lines that may contain a date, in document order, with what makes
+    them a candidate. Lines are only looked at once, and as they are needed"""
+    for index, line in enumerate(lines):
+        if line.startswith("DATA\nF1./0./11/"):
+            yield index, WRONG_DATE
+        elif (
+            line.startswith("DATA \n")
+            or line.startswith("FECHA\n")
+            or line.startswith("FECHA \n")
+        ):
+            yield index, DATE_NEXT_LINE
+        elif line.startswith("DATA,") or line.startswith("DATA\n"):
+            yield index, DATE_SAME_LINE
+        elif line.startswith("Període de "):
+            yield index, PERIOD
+        elif line == "Fecha:":
+            yield index, DATE_AFTER_LABEL
+        elif (
+            len(lines) - index > 5
+            and lines[index + 1].strip() == "de"
+            and lines[index + 3] == "de"
+        ):
+            yield index, WORDS_IN_FIVE_LINES
+        # the pattern starts with a digit, no need to join the lines otherwise
+        elif (
+            len(lines) - index > 3
+            and line[:1].isdigit()
+            and DAY_MONTH_YEAR.match(f"{line} {lines[index+1]} {lines[index+2]}")
+        ):
+            yield index, WORDS_IN_THREE_LINES
+        elif MONTH_YEAR_LINE.match(line):
+            yield index, MONTH_AND_YEAR
+        elif " de " in line:
+            yield index, FREE_TEXT
+
+
+def candidate_date(lines: List[str], index: int, kind: str):
+    """the date of a candidate line, None if there's none"""
+    line = lines[index]
+    if kind == WRONG_DATE:
+        # the f'up one day and sent this, so here we are fixing it
+        return datetime(year=2010, month=12, day=13)
+    if kind == DATE_NEXT_LINE:
+        target = line.split("\n")[1]
+        # sometimes it still contains some extra stuff at the end
+        # hardcode the ones we find
+        matches = LEADING_DATE.match(target)
+        if matches:
+            target = matches.group(1)
+        return parse_date_es_ca(target)
+    if kind == DATE_SAME_LINE:
+        return parse_date_es_ca(line[5:15])
+    if kind == DATE_AFTER_LABEL:
+        return parse_date_es_ca(lines[index + 1])
+    if kind == FREE_TEXT:
+        return parse_free_text_date(line)
+
+    date = None
+    if kind == PERIOD:
+        # "Període de l'1 al 31 Desembre de 2017"
+        matches = PERIOD_END.match(line)
+        if matches:
+            date = dateparser.parse(matches.group("date"), languages=["ca"])
+    elif kind == WORDS_IN_FIVE_LINES:
+        # some documents have a series of strings separated by new lines forming a date:
+        # 16     index
+        # de     index+1
+        # gener  index+2
+        # de     index+3
+        # 2018   index+4
+        date = dateparser.parse(
+            " ".join(lines[index : index + 5]), languages=["ca", "es"]
+        )
+    elif kind == WORDS_IN_THREE_LINES:
+        # 16     index
+        # gener  index+1
+        # 2018   index+2
+        date = dateparser.parse(
+            " ".join(lines[index : index + 3]), languages=["ca", "es"]
+        )
+    elif kind == MONTH_AND_YEAR:
+        date = parse_date_es_ca(line.split("\n")[0])
+    if date:
+        return date
+    raise Exception(f"Confusing date:\n\n{line}\n\n - check and fix code!")
 
 
 def find_date(lines):
     """finds the first string that matches the pattern "DATA \n02.01.18"
     or "DATA,11/05/2018" or "FECHA\n11/05/2018" and returns a date object with the given date
     """
-    index = 0
-    for line in lines:
+    for index, kind in date_candidates(lines):
         try:
-            if line.startswith("DATA\nF1./0./11/"):
-                return datetime(
-                    year=2010, month=12, day=13
-                )  # the f'up one day and sent this, so here we are fixing it
-            elif (
-                line.startswith("DATA \n")
-                or line.startswith("FECHA\n")
-                or line.startswith("FECHA \n")
-            ):
-                target = line.split("\n")[1]
-                # sometimes it still contains some extra stuff at the end
-                # hardcode the ones we find
-                matches = re.match(r"(\d{2}.\d{2}.\d{2,4}) .*", target)
-                if matches:
-                    target = matches.group(1)
-                return parse_date_es_ca(target)
-            elif line.startswith("DATA,") or line.startswith("DATA\n"):
-                return parse_date_es_ca(line[5:15])
-            elif line.startswith("Període de "):
-                # "Període de l'1 al 31 Desembre de 2017"
-                matches = re.match(r"Període de .* al (?P<date>.*)", line)
-                if matches:
-                    date = dateparser.parse(matches.group("date"), languages=["ca"])
-                    if date:
-                        return date
-                raise Exception(f"Confusing date:\n\n{line}\n\n - check and fix code!")
-            elif line == "Fecha:":
-                return parse_date_es_ca(lines[index + 1])
-            elif (
-                len(lines) - index > 5
-                and lines[index + 1].strip() == "de"
-                and lines[index + 3] == "de"
-            ):
-                # some documents have a series of strings separated by new lines forming a date:
-                # 16     index
-                # de     index+1
-                # gener  index+2
-                # de     index+3
-                # 2018   index+4
-                date = dateparser.parse(
-                    " ".join(lines[index : index + 5]), languages=["ca", "es"]
-                )
-                if date:
-                    return date
-                raise Exception(f"Confusing date:\n\n{line}\n\n - check and fix code!")
-            elif len(lines) - index > 3 and re.match(
-                r"\d{1,2} \w+ \d{2,4}",
-                f"{lines[index]} {lines[index+1]} {lines[index+2]}",
-            ):
-                # 16     index
-                # gener  index+1
-                # 2018   index+2
-                date = dateparser.parse(
-                    " ".join(lines[index : index + 3]), languages=["ca", "es"]
-                )
-                if date:
-                    return date
-                raise Exception(f"Confusing date:\n\n{line}\n\n - check and fix code!")
-            elif re.match(
-                r"^(Enero|Febrero|Marzo|Abril|Mayo|Junio|Julio|Agosto|Septiembre|Octubre|Noviembre|Diciembre) de \d{2,4}\n",  # pylint: disable=line-too-long
-                line,
-            ):
-                date = parse_date_es_ca(line.split("\n")[0])
-                if date:
-                    return date
-                raise Exception(f"Confusing date:\n\n{line}\n\n - check and fix code!")
-            elif " de " in line:
-                date = dateparser.parse(line, languages=["es", "ca"])
-                if date:
-                    return date
-
+            date = candidate_date(lines, index, kind)
+            if date:
+                return date
         except ValueError:
             pass
-
-        index += 1
     return None
 
 
+# issuer and concept can be rather long so we generate shorter aliases purely
+# by convention, add new ones to this file (or to your own with --adjustments)
+ADJUSTMENTS_FILE = os.path.join(
+    os.path.dirname(__file__), "adjustments", "deutsche_bank_es.json"
+)
+adjustments = AdjustmentTable.load(ADJUSTMENTS_FILE)
+
+
 def adjust_names(metadata: DocumentMetadata):
     """issuer and concept can be rather long so we generate shorter aliases
     purely by convention"""
-
-    adjustments = [
-        Adjustment("CIENCIES", "CIENCIES", "graells", "ciencies"),
-        Adjustment("VANGUARDIA", None, "f.vanguardia", "ciencies"),
-        Adjustment("NUBIOLA", None, "piso", "borriana"),
-        Adjustment("MERNUBE", None, "piso", "borriana"),
-        Adjustment("DEUTSCHE BANK", "ZURICH", "deutsche", "seguro zurich unknown"),
-        Adjustment("ZURICH VIDA", "300002290", "zurich", "vida 300002290"),
-        Adjustment("ZURICH VIDA", "300002289", "zurich", "vida 300002289"),
-        Adjustment("AQUALOGY", None, "agua", "contador"),
-        Adjustment("ENDESA ENERGIA", "ELECTRICIDAD", "endesa", "electricidad"),
-        Adjustment("AIGUES DE BARCELONA", None, "agua", "suministro"),
-        Adjustment("AJUNTAMENT DE BARCELONA", "IBI", "ajuntament", "ibi ciencies"),
-        Adjustment(
-            "AJUNTAMENT DE BARCELONA",
-            ["IMPOST VEHICLES", "0005CVV"],
-            "ajuntament",
-            "ivtm coche c3",
-        ),
-        Adjustment("SPORT I RELAX S.L.", None, "gym", "niña"),
-    ]
-
-    for adjustment in adjustments:
-        if adjustment.adjust(metadata):
-            return
+    adjustments.adjust(metadata)
 
 
 class DeutscheBankDocuments:
     """ Parsers for all the PDF documents from Deutsche Bank ES known """
 
+    bank = Bank.DEUTSCHE_BANK
+
     simple_mappings = [
         Filing(
             ["RECLAMACIÓN ACUSE DE RECIBO CONTRATO", "CONTRATO FONDOS"],
@@ -316,6 +368,9 @@ class DeutscheBankDocuments:
         Filing(["EXTRACTE FISCAL DB", "az\nOsc"], DocType.FISCAL, "extracto", "2"),
     ]
 
+    # the document belongs to the bank if it contains any of its markers
+    needs_one_of = markers(Bank.DEUTSCHE_BANK)
+
     def process(
         self,
         file_name: str,  # pylint: disable=unused-argument
@@ -326,23 +381,8 @@ class DeutscheBankDocuments:
         and return metadata, else None"""
 
         # first try to determine if the document belongs here or not - if not, None is returned
-        needs_one_of = [
-            "DEUTSCHE BANK SOCIEDAD ANONIMA",
-            "Deutsche Bank, Sociedad Anónima",
-            "Servei Deutsche Bank Online",
-            "Servicio Deutsche Bank Online",
-            "Deutsche Bank Online: www.deutsche-bank.es",
-            "Deutsche Bank, S.A. Española",
-            "Deutsche Bank no será responsable",
-            "DEUTSCHE ASSET MANAGEMENT",
-            "A−80017403",
-            "A−08000614",
-            "BARNA-V.AUGUSTA",
-            "BARNA−V.AUGUSTA",
-            "OFICINA\nBARNA−V.AUGUSTA",
-        ]
         passes = False
-        for must_have in needs_one_of:
+        for must_have in self.needs_one_of:
             if find_containing(lines, must_have):
                 passes = True
                 break
@@ -375,7 +415,7 @@ class DeutscheBankDocuments:
         ) and find_containing(lines, "RECIBO\n"):
             return self.recibo(lines)
 
-        raise Exception("Documents seems to belong to bank but isn't recognised")
+        raise UnrecognisedDocument(Bank.DEUTSCHE_BANK)
 
     def simple_document(self, lines, classification, entity="", extra_info=""):
         """ a lot of documents follow a basic pattern and we only need the first date we find """
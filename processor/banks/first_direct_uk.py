@@ -7,8 +7,16 @@ from typing import List
 
 from pdfminer.layout import LTPage
 
+from banks.registry import markers
 from parsing.common import find_containing, parse_date_gb
-from parsing.metadata import Bank, DocType, DocumentMetadata, Filing
+from parsing.dates import MONTH_ABBREVIATIONS, DateEngine
+from parsing.metadata import (
+    Bank,
+    DocType,
+    DocumentMetadata,
+    Filing,
+    UnrecognisedDocument,
+)
 
 known_date_regexes = [
     # 'blahblahFrom 6 Apr 2018 to 5 Oct 2019blahblah
@@ -31,25 +39,21 @@ known_date_regexes = [
 ]
 
 
+date_engine = DateEngine(
+    known_date_regexes, parse_date_gb, needs_any=MONTH_ABBREVIATIONS
+)
+
+
 def find_date(lines):
     """finds the first string that matches a known pattern"""
-    index = 0
-    for line in lines:
-        try:
-            for date_regex in known_date_regexes:
-                matches = date_regex.match(line)
-                if matches:
-                    return parse_date_gb(matches.group("date"))
-        except ValueError:
-            pass
-
-        index += 1
-    return None
+    return date_engine.find_date(lines)
 
 
 class FirstDirectUKBankDocuments:
     """ Parsers for all the PDF documents """
 
+    bank = Bank.FIRST_DIRECT
+
     simple_mappings = [
         Filing(
             ["AccountSummary", "Your 1st Account details"], DocType.STATEMENT, "current"
@@ -95,6 +99,9 @@ class FirstDirectUKBankDocuments:
         ),
     ]
 
+    # the document belongs to the bank if it contains any of its markers
+    needs_one_of = markers(Bank.FIRST_DIRECT)
+
     def process(
         self,
         file_name: str,  # pylint: disable=unused-argument
@@ -105,9 +112,8 @@ class FirstDirectUKBankDocuments:
         and return metadata, else None"""
 
         # first try to determine if the document belongs here or not - if not, None is returned
-        needs_one_of = ["firstdirect.com", "is a division of HSBC UK Bank plc"]
         passes = False
-        for must_have in needs_one_of:
+        for must_have in self.needs_one_of:
             if find_containing(lines, must_have):
                 passes = True
                 break
@@ -120,7 +126,7 @@ class FirstDirectUKBankDocuments:
                     lines, filing.classification, filing.entity, filing.extra_info
                 )
 
-        raise Exception("Documents seems to belong to bank but isn't recognised")
+        raise UnrecognisedDocument(Bank.FIRST_DIRECT)
 
     def simple_document(self, lines, classification, entity="", extra_info=""):
         """ a lot of documents follow a basic pattern and we only need the first date we find """
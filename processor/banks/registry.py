@@ -0,0 +1,141 @@
+"""
+Registry of the bank parsers. Every bank is listed here with the module and
+class of its parser and the markers that tell its documents apart, so a
+document can be matched to its bank without importing any parser: the module
+of a bank (its rules, date parsing and adjustment tables) is imported and its
+parser built the first time a document has one of its markers. A new bank is
+a module in this folder and an entry in BANKS, in the order banks are tried.
+"""
+
+import importlib
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional
+
+from parsing.common import find_containing
+from parsing.metadata import Bank
+
+
+@dataclass
+class BankPlugin:
+    """ Where the parser of a bank is and the markers of its documents """
+
+    bank: Bank
+    module: str
+    class_name: str
+    # the document belongs to the bank if it contains any of these
+    needs_one_of: List[str]
+
+    def claims(self, lines: List[str]) -> bool:
+        """ whether a document with these lines belongs to the bank """
+        return any(find_containing(lines, must_have) for must_have in self.needs_one_of)
+
+    def load(self):
+        """ imports the module of the parser and builds it """
+        module = importlib.import_module(self.module)
+        return getattr(module, self.class_name)()
+
+
+BANKS = [
+    BankPlugin(
+        Bank.DEUTSCHE_BANK,
+        "banks.deutsche_bank_es",
+        "DeutscheBankDocuments",
+        [
+            "DEUTSCHE BANK SOCIEDAD ANONIMA",
+            "Deutsche Bank, Sociedad Anónima",
+            "Servei Deutsche Bank Online",
+            "Servicio Deutsche Bank Online",
+            "Deutsche Bank Online: www.deutsche-bank.es",
+            "Deutsche Bank, S.A. Española",
+            "Deutsche Bank no será responsable",
+            "DEUTSCHE ASSET MANAGEMENT",
+            "A−80017403",
+            "A−08000614",
+            "BARNA-V.AUGUSTA",
+            "BARNA−V.AUGUSTA",
+            "OFICINA\nBARNA−V.AUGUSTA",
+        ],
+    ),
+    BankPlugin(
+        Bank.SANTANDER_UK,
+        "banks.santander_uk",
+        "SantanderUKBankDocuments",
+        [
+            "BX0084",  # Individual Savings Account summary
+            "BX0179",  # Statement of fees
+            "BX0098",  # Account summary
+            "BX0158",  # Annual tax summary
+            "Santander, Cust Opers, PO Box 1109, Bradford, BD1 5XS",  # their generic address
+        ],
+    ),
+    BankPlugin(
+        Bank.CITIBANK_UK,
+        "banks.citibank_uk",
+        "CitibankUKBankDocuments",
+        [
+            "Summary of your Citi Relationship",
+            "SUMMARY OF YOUR CITIBANK ACCOUNT",
+        ],
+    ),
+    BankPlugin(
+        Bank.FIRST_DIRECT,
+        "banks.first_direct_uk",
+        "FirstDirectUKBankDocuments",
+        ["firstdirect.com", "is a division of HSBC UK Bank plc"],
+    ),
+]
+
+_by_bank = {plugin.bank: plugin for plugin in BANKS}
+
+
+def markers(bank: Bank) -> List[str]:
+    """ the needs_one_of of a bank's parser """
+    return _by_bank[bank].needs_one_of
+
+
+def parse_banks(text: str) -> List[Bank]:
+    """the banks in a comma separated list of bank names, like "db,citibank" """
+    banks = []
+    for name in text.split(","):
+        name = name.strip()
+        if name not in {plugin.bank.value for plugin in BANKS}:
+            known = ", ".join(plugin.bank.value for plugin in BANKS)
+            raise Exception(f"unknown bank {name}, the known ones are {known}")
+        banks.append(Bank(name))
+    return banks
+
+
+class BankRegistry:
+    """The banks a run classifies documents of (all of them unless told
+    otherwise), with their parsers built as they are needed"""
+
+    def __init__(self, banks: Optional[List[Bank]] = None):
+        self.banks = banks
+        self.plugins: List[BankPlugin] = []
+        self.parsers: Dict[Bank, object] = {}
+        self.select(banks)
+
+    def select(self, banks: Optional[List[Bank]]):
+        """ only the given banks are tried from now on, all of them with None """
+        self.banks = banks
+        self.plugins = [
+            plugin for plugin in BANKS if banks is None or plugin.bank in banks
+        ]
+
+    def parser(self, plugin: BankPlugin):
+        """ the parser of a bank, loaded the first time """
+        parser = self.parsers.get(plugin.bank)
+        if parser is None:
+            parser = self.parsers[plugin.bank] = plugin.load()
+        return parser
+
+    def all_parsers(self) -> list:
+        """ the parsers of every bank selected, in the order they are tried """
+        return [self.parser(plugin) for plugin in self.plugins]
+
+    def claiming(self, lines: List[str]) -> Iterator:
+        """the parsers of the banks whose markers are in the lines, in the
+        order they are tried, each one loaded when it's its turn"""
+        for plugin in self.plugins:
+            if plugin.claims(lines):
+                yield self.parser(plugin)
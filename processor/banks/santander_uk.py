@@ -7,8 +7,16 @@ from typing import List
 
 from pdfminer.layout import LTPage
 
+from banks.registry import markers
 from parsing.common import find_containing, parse_date_gb
-from parsing.metadata import Bank, DocType, DocumentMetadata, Filing
+from parsing.dates import MONTH_ABBREVIATIONS, DateEngine
+from parsing.metadata import (
+    Bank,
+    DocType,
+    DocumentMetadata,
+    Filing,
+    UnrecognisedDocument,
+)
 
 known_date_regexes = [
     # 5th Mar 2018 to 4th Apr 2018
@@ -38,25 +46,21 @@ known_date_regexes = [
 ]
 
 
+date_engine = DateEngine(
+    known_date_regexes, parse_date_gb, needs_any=MONTH_ABBREVIATIONS + ["/", "Date:"]
+)
+
+
 def find_date(lines):
     """finds the first string that matches a known pattern"""
-    index = 0
-    for line in lines:
-        try:
-            for date_regex in known_date_regexes:
-                matches = date_regex.match(line)
-                if matches:
-                    return parse_date_gb(matches.group("date"))
-        except ValueError:
-            pass
-
-        index += 1
-    return None
+    return date_engine.find_date(lines)
 
 
 class SantanderUKBankDocuments:
     """ Parsers for all the PDF documents """
 
+    bank = Bank.SANTANDER_UK
+
     simple_mappings = [
         Filing(
             ["BX0084", "Individual Savings"], DocType.STATEMENT, "cash isa", "summary"
@@ -101,6 +105,9 @@ class SantanderUKBankDocuments:
         ),
     ]
 
+    # the document belongs to the bank if it contains any of its markers
+    needs_one_of = markers(Bank.SANTANDER_UK)
+
     def process(
         self,
         file_name: str,  # pylint: disable=unused-argument
@@ -111,15 +118,8 @@ class SantanderUKBankDocuments:
         and return metadata, else None"""
 
         # first try to determine if the document belongs here or not - if not, None is returned
-        needs_one_of = [
-            "BX0084",  # Individual Savings Account summary
-            "BX0179",  # Statement of fees
-            "BX0098",  # Account summary
-            "BX0158",  # Annual tax summary
-            "Santander, Cust Opers, PO Box 1109, Bradford, BD1 5XS",  # their generic address
-        ]
         passes = False
-        for must_have in needs_one_of:
+        for must_have in self.needs_one_of:
             if find_containing(lines, must_have):
                 passes = True
                 break
@@ -132,7 +132,7 @@ class SantanderUKBankDocuments:
                     lines, filing.classification, filing.entity, filing.extra_info
                 )
 
-        raise Exception("Documents seems to belong to bank but isn't recognised")
+        raise UnrecognisedDocument(Bank.SANTANDER_UK)
 
     def simple_document(self, lines, classification, entity="", extra_info=""):
         """ a lot of documents follow a basic pattern and we only need the first date we find """
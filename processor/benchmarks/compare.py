@@ -0,0 +1,213 @@
+"""
+Performance regression gate. A run classifies a corpus several times and
+records the seconds of every stage (extracting the lines, analysing them),
+of the documents of every bank and of every rule and function measured by the
+instrumentation (see parsing.instrumentation). A run saved as a baseline is
+compared with later ones: a measurement is slower when the median of the new
+run is over the threshold and the difference is not noise, that is, when the
+lower end of the bootstrap confidence interval of the ratio of the medians is
+over the threshold too. Any slower measurement makes the command fail.
+
+    python -m benchmarks.compare ~/Downloads/statements --save baseline.json
+    # after changing the parsers
+    python -m benchmarks.compare ~/Downloads/statements --baseline baseline.json
+
+The recorded lines of benchmarks.fixtures can be used instead of the
+documents, then only the analysis is measured:
+
+    python -m benchmarks.compare --lines lines.json --save baseline.json
+"""
+
+import argparse
+import json
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from benchmarks.fixtures import load_lines
+from classify import analyse, bank_parsers, extract_lines, find_pdfs
+from parsing.instrumentation import Instrumentation
+
+Samples = Dict[str, List[float]]
+
+# measurements shorter than this (median, in seconds) are all noise
+MINIMUM_SECONDS = 0.001
+
+# resamples of the bootstrap and the confidence of its interval
+RESAMPLES = 2000
+CONFIDENCE = 0.95
+
+SLOWER = "SLOWER"
+FASTER = "faster"
+SAME = "same"
+NEW = "new"
+GONE = "gone"
+
+
+def measure_once(
+    pdf_files: List[str], recorded: Dict[str, List[str]], samples: Samples
+):
+    """classifies every document once, adding the seconds of each measurement
+    to the samples. Documents are extracted unless their lines are recorded"""
+    seconds: Dict[str, float] = {}
+
+    def add(name: str, value: float):
+        seconds[name] = seconds.get(name, 0.0) + value
+
+    with Instrumentation() as instrumentation:
+        instrumentation.install(bank_parsers())
+        for pdf_file in pdf_files or recorded:
+            lines = recorded.get(pdf_file)
+            if lines is None:
+                start = time.perf_counter()
+                lines = extract_lines(pdf_file)
+                add("stage extract", time.perf_counter() - start)
+            start = time.perf_counter()
+            try:
+                metadata = analyse(pdf_file, None, lines)
+                bank = metadata.bank.value if metadata else "none"
+            except Exception as exc:  # noqa: E0602 pylint: disable=broad-except
+                # documents of a bank not recognised by its templates
+                bank = getattr(getattr(exc, "bank", None), "value", "none")
+            elapsed = time.perf_counter() - start
+            add("stage analyse", elapsed)
+            add(f"bank {bank}", elapsed)
+        for label, counter in instrumentation.counters.items():
+            add(f"rule {label}", counter.seconds)
+    for name, value in seconds.items():
+        samples.setdefault(name, []).append(value)
+
+
+def run(pdf_files: List[str], recorded: Dict[str, List[str]], repeat: int) -> dict:
+    """the samples of every measurement over the given repeats"""
+    # the first time loads the parsers and the languages of the dates
+    measure_once(pdf_files, recorded, {})
+    samples: Samples = {}
+    for _ in range(repeat):
+        measure_once(pdf_files, recorded, samples)
+    return {
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "documents": len(pdf_files or recorded),
+        "repeat": repeat,
+        "samples": samples,
+    }
+
+
+def ratio_interval(
+    before: List[float], after: List[float], rng: np.random.Generator
+) -> Tuple[float, float]:
+    """bootstrap confidence interval of the ratio of the median after to the
+    median before"""
+    before_resampled = rng.choice(before, (RESAMPLES, len(before)))
+    after_resampled = rng.choice(after, (RESAMPLES, len(after)))
+    ratios = np.median(after_resampled, axis=1) / np.maximum(
+        np.median(before_resampled, axis=1), 1e-12
+    )
+    tail = (1 - CONFIDENCE) / 2 * 100
+    low, high = np.percentile(ratios, [tail, 100 - tail])
+    return float(low), float(high)
+
+
+def compare(
+    baseline: Samples, current: Samples, threshold: float, seed: int = 0
+) -> List[Tuple[str, str, Optional[float], Optional[float], Tuple[float, float]]]:
+    """verdict, medians before and after and ratio interval of every
+    measurement, the slower first"""
+    rng = np.random.default_rng(seed)
+    results = []
+    for name in sorted(set(baseline) | set(current)):
+        before = baseline.get(name)
+        after = current.get(name)
+        if not before or not after:
+            median = float(np.median(before or after))
+            verdict = GONE if before else NEW
+            results.append(
+                (
+                    name,
+                    verdict,
+                    median if before else None,
+                    None if before else median,
+                    (0.0, 0.0),
+                )
+            )
+            continue
+        median_before = float(np.median(before))
+        median_after = float(np.median(after))
+        interval = ratio_interval(before, after, rng)
+        verdict = SAME
+        if max(median_before, median_after) >= MINIMUM_SECONDS:
+            if interval[0] > 1 + threshold:
+                verdict = SLOWER
+            elif interval[1] < 1 - threshold:
+                verdict = FASTER
+        results.append((name, verdict, median_before, median_after, interval))
+    order = [SLOWER, FASTER, NEW, GONE, SAME]
+    return sorted(results, key=lambda result: (order.index(result[1]), result[0]))
+
+
+def report(results, show_all: bool = False) -> str:
+    """the measurements that changed, or all of them"""
+    lines = [f"{'':8} {'before':>10} {'after':>10} {'change':>8}  {'95% interval':>15}"]
+    for name, verdict, before, after, (low, high) in results:
+        if verdict == SAME and not show_all:
+            continue
+        shown_before = f"{before * 1000:8.1f}ms" if before is not None else f"{'':10}"
+        shown_after = f"{after * 1000:8.1f}ms" if after is not None else f"{'':10}"
+        change = (
+            f"{(after / max(before, 1e-12) - 1) * 100:+7.1f}%"
+            if before is not None and after is not None
+            else f"{'':8}"
+        )
+        interval = f"x{low:.2f} - x{high:.2f}" if high else ""
+        lines.append(
+            f"{verdict:<8} {shown_before} {shown_after} {change}  {interval:>15}  {name}"
+        )
+    slower = sum(1 for result in results if result[1] == SLOWER)
+    lines.append(f"===== {slower} slower of {len(results)} measurements")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="compare the speed of the classification with a baseline"
+    )
+    parser.add_argument("files", nargs="*", help="PDF filenames and/or directories")
+    parser.add_argument("--lines", help="JSON file recorded with benchmarks.fixtures")
+    parser.add_argument("--save", metavar="FILE", help="save the run as a baseline")
+    parser.add_argument("--baseline", metavar="FILE", help="compare with this run")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="how much slower a measurement can be, as a fraction (default 0.1)",
+    )
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument(
+        "--all", action="store_true", help="show the measurements that didn't change"
+    )
+    args = parser.parse_args()
+    if bool(args.files) == bool(args.lines):
+        parser.error("give either documents or --lines")
+    if not args.save and not args.baseline:
+        parser.error("give --save, --baseline or both")
+
+    documents = [
+        pdf_file
+        for file_or_folder in args.files
+        for pdf_file in find_pdfs(file_or_folder)
+    ]
+    measured = run(documents, load_lines(args.lines) if args.lines else {}, args.repeat)
+    if args.save:
+        with open(args.save, "w") as saved:
+            json.dump(measured, saved, indent=2, sort_keys=True)
+        print(f"baseline of {measured['documents']} documents saved to {args.save}")
+    if args.baseline:
+        with open(args.baseline) as saved:
+            previous = json.load(saved)
+        print(f"compared with the baseline of {previous['created']}")
+        compared = compare(previous["samples"], measured["samples"], args.threshold)
+        print(report(compared, args.all))
+        if any(result[1] == SLOWER for result in compared):
+            sys.exit(1)
@@ -0,0 +1,72 @@
+"""
+Micro-benchmark of the date extraction of the UK banks: the compiled engine
+against matching every regex on every line, as the parsers used to do, on
+recorded lines (see benchmarks.fixtures).
+
+    python -m benchmarks.dates lines.json
+"""
+
+import argparse
+import timeit
+from typing import List
+
+from banks import citibank_uk, first_direct_uk, santander_uk
+from benchmarks.fixtures import load_lines
+from parsing.common import parse_date_gb
+from parsing.dates import DateEngine
+
+MODULES = [santander_uk, first_direct_uk, citibank_uk]
+
+
+def match_each_regex(regexes: list, parse, lines: List[str]):
+    """the previous find_date of the UK banks, for reference"""
+    for line in lines:
+        try:
+            for date_regex in regexes:
+                matches = date_regex.match(line)
+                if matches:
+                    return parse(matches.group("date"))
+        except ValueError:
+            pass
+    return None
+
+
+def compare(module, documents: List[List[str]], repeat: int):
+    """times both ways of finding the text of the dates (not parsing it, that's
+    the same for both) and counts the documents where the dates differ"""
+    regexes = module.known_date_regexes
+    engine = module.date_engine
+    text_engine = DateEngine(regexes, str, engine.needs_any)
+
+    def before():
+        for lines in documents:
+            match_each_regex(regexes, str, lines)
+
+    def after():
+        for lines in documents:
+            text_engine.find_date(lines)
+
+    seconds_before = min(timeit.repeat(before, number=1, repeat=repeat))
+    seconds_after = min(timeit.repeat(after, number=1, repeat=repeat))
+    differences = sum(
+        1
+        for lines in documents
+        if match_each_regex(regexes, parse_date_gb, lines) != engine.find_date(lines)
+    )
+    print(
+        f"{module.__name__:<24} before {seconds_before * 1000:9.2f} ms   "
+        f"after {seconds_after * 1000:9.2f} ms   "
+        f"x{seconds_before / max(seconds_after, 1e-9):6.1f}   "
+        f"{differences} different dates"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="benchmark the date extraction")
+    parser.add_argument("lines", help="JSON file recorded with benchmarks.fixtures")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    recorded = list(load_lines(args.lines).values())
+    print(f"{len(recorded)} documents, {sum(len(lines) for lines in recorded)} lines")
+    for bank_module in MODULES:
+        compare(bank_module, recorded, args.repeat)
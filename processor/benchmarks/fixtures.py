@@ -0,0 +1,37 @@
+"""
+Recorded document lines for the benchmarks, so they measure the parsing code
+and not pdfminer. Record them once from real documents (they stay on your
+machine, they contain your statements):
+
+    python -m benchmarks.fixtures ~/Downloads/statements --output lines.json
+"""
+
+import argparse
+import json
+from typing import Dict, List
+
+from classify import document_lines, extract_pages, find_pdfs
+
+
+def record_lines(roots: List[str]) -> Dict[str, List[str]]:
+    """the lines of every PDF found, by file name"""
+    documents = {}
+    for root in roots:
+        for pdf_file in find_pdfs(root):
+            documents[pdf_file] = document_lines(extract_pages(pdf_file))
+    return documents
+
+
+def load_lines(path: str) -> Dict[str, List[str]]:
+    """ lines previously recorded in a JSON file """
+    with open(path) as recorded:
+        return json.load(recorded)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="record document lines")
+    parser.add_argument("files", nargs="+", help="PDF filenames and/or directories")
+    parser.add_argument("--output", required=True, help="JSON file to write")
+    args = parser.parse_args()
+    with open(args.output, "w") as output:
+        json.dump(record_lines(args.files), output, ensure_ascii=False)
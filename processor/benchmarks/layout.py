@@ -0,0 +1,111 @@
+"""
+Benchmark of the conversion of page layouts to lines of text: the iterative
+converter against the recursive one the classifier used before. The layouts
+are analysed once, before timing, so only the conversion is measured.
+
+    python -m benchmarks.layout ~/Downloads/statements
+"""
+
+import argparse
+import re
+import timeit
+from functools import reduce
+from typing import List
+
+from pdfminer.layout import (
+    LTAnno,
+    LTChar,
+    LTComponent,
+    LTContainer,
+    LTCurve,
+    LTImage,
+    LTLine,
+    LTRect,
+    LTTextBoxHorizontal,
+    LTTextBoxVertical,
+)
+
+from classify import extract_pages, find_pdfs
+from parsing.layout import convert_to_lines, positioned_lines
+
+
+def recursive_clean_line(line):
+    """the previous clean_line, for reference"""
+    line = re.sub(r"(  )+", "", line)
+    line = re.sub(r"(\n\n)+", "\n", line)
+    line = line.strip()
+    return line
+
+
+def recursive_convert_to_lines(page: LTComponent):
+    """the previous convert_to_lines, for reference"""
+    lines = []
+    ignorable_elements = [LTImage, LTRect, LTLine, LTCurve]
+    text_elements = [LTTextBoxHorizontal, LTChar, LTAnno, LTTextBoxVertical]
+    container_elements = [LTContainer]
+
+    for element in page:
+
+        def is_one_of(previous, element_class):
+            return previous or isinstance(
+                element, element_class  # pylint: disable=cell-var-from-loop
+            )
+
+        if reduce(is_one_of, text_elements, False):
+            lines.append(recursive_clean_line(element.get_text()))
+        elif reduce(is_one_of, container_elements, False):
+            lines += recursive_convert_to_lines(element)
+        elif reduce(is_one_of, ignorable_elements, False):
+            pass
+        else:
+            raise Exception(f"Type is {type(element)}")
+    return lines
+
+
+def compare(documents: List[list], repeat: int):
+    """times both converters over the same layouts and counts the pages whose
+    lines differ"""
+    pages = [page for document in documents for page in document]
+
+    def before():
+        for page in pages:
+            recursive_convert_to_lines(page)
+
+    def after():
+        for page in pages:
+            convert_to_lines(page)
+
+    def after_positioned():
+        for document in documents:
+            positioned_lines(document)
+
+    seconds_before = min(timeit.repeat(before, number=1, repeat=repeat))
+    seconds_after = min(timeit.repeat(after, number=1, repeat=repeat))
+    seconds_positioned = min(timeit.repeat(after_positioned, number=1, repeat=repeat))
+    differences = sum(
+        1
+        for page in pages
+        if recursive_convert_to_lines(page) != convert_to_lines(page)
+    )
+    print(
+        f"recursive  {seconds_before * 1000:9.2f} ms\n"
+        f"iterative  {seconds_after * 1000:9.2f} ms   "
+        f"x{seconds_before / max(seconds_after, 1e-9):6.1f}\n"
+        f"positioned {seconds_positioned * 1000:9.2f} ms   "
+        f"x{seconds_before / max(seconds_positioned, 1e-9):6.1f}\n"
+        f"{differences} pages with different lines"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="benchmark the layout conversion")
+    parser.add_argument("files", nargs="+", help="PDF filenames and/or directories")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    layouts = [
+        list(extract_pages(pdf_file))
+        for root in args.files
+        for pdf_file in find_pdfs(root)
+    ]
+    print(f"{len(layouts)} documents, {sum(len(pages) for pages in layouts)} pages")
+    compare(layouts, args.repeat)
@@ -0,0 +1,134 @@
+"""
+Tuning of the layout profiles of every bank (see parsing.profiles). The golden
+results are the classification of every document with the default profile;
+for every bank the settings are then changed one at a time, keeping a change
+when the documents of the bank are extracted faster and classified exactly
+the same, until no change helps. The profiles found are written in the format
+of banks/layout_profiles.json.
+
+    python -m benchmarks.profiles ~/Downloads/statements --output profiles.json
+"""
+
+import argparse
+import time
+from dataclasses import replace
+from typing import Dict, List, Optional, Tuple
+
+from classify import analyse, extract_lines, find_pdfs
+from parsing.metadata import Bank
+from parsing.profiles import DEFAULT_PROFILE, LayoutProfile, LayoutProfiles
+
+# values tried for every setting, the defaults among them
+CANDIDATES = {
+    "all_texts": [False, True],
+    "boxes_flow": [None, 0.5],
+    "line_margin": [0.5, 1.5, 3.0],
+    "char_margin": [1.0, 2.0, 4.0],
+    "line_overlap": [0.3, 0.5, 0.7],
+    "word_margin": [0.1, 0.2],
+}
+
+# a change has to save more than this to be kept, the rest is noise
+MINIMUM_GAIN = 0.03
+
+# the passes over all the settings, at most
+PASSES = 3
+
+
+def classify(
+    pdf_file: str, profiles: Optional[LayoutProfiles]
+) -> Tuple[str, Optional[Bank], float]:
+    """the result of a document as text, to compare, its bank and the seconds
+    it took"""
+    start = time.perf_counter()
+    try:
+        metadata = analyse(pdf_file, None, extract_lines(pdf_file, None, profiles))
+        result = repr(metadata)
+        bank = metadata.bank if metadata else None
+    except Exception as exc:  # noqa: E0602 pylint: disable=broad-except
+        result = f"{type(exc).__name__}: {exc}"
+        # documents of a bank not recognised by its templates
+        bank = getattr(exc, "bank", None)
+    return result, bank, time.perf_counter() - start
+
+
+def measure(
+    bank: Bank,
+    profile: LayoutProfile,
+    golden: Dict[str, str],
+    repeat: int,
+) -> Tuple[float, int]:
+    """seconds to classify the documents of a bank with a profile (the best of
+    the repeats) and the number of documents whose result changes"""
+    profiles = LayoutProfiles({bank: profile})
+    best = None
+    different = 0
+    for _ in range(repeat):
+        seconds = 0.0
+        different = 0
+        for pdf_file, expected in golden.items():
+            result, _, document_seconds = classify(pdf_file, profiles)
+            seconds += document_seconds
+            different += result != expected
+            if different:
+                # a profile that changes results is not used, no need to go on
+                return seconds, different
+        best = seconds if best is None else min(best, seconds)
+    return best, different
+
+
+def tune(bank: Bank, golden: Dict[str, str], repeat: int):
+    """the fastest profile found for a bank that keeps its results, with its
+    time and the time of the default profile"""
+    best = DEFAULT_PROFILE
+    default_seconds, _ = measure(bank, best, golden, repeat)
+    best_seconds = default_seconds
+    for _ in range(PASSES):
+        improved = False
+        for setting, values in CANDIDATES.items():
+            for value in values:
+                if getattr(best, setting) == value:
+                    continue
+                candidate = replace(best, **{setting: value})
+                seconds, different = measure(bank, candidate, golden, repeat)
+                if not different and seconds < best_seconds * (1 - MINIMUM_GAIN):
+                    best, best_seconds, improved = candidate, seconds, True
+        if not improved:
+            break
+    return best, best_seconds, default_seconds
+
+
+def golden_results(roots: List[str]) -> Dict[Bank, Dict[str, str]]:
+    """the result of every document with the default profile, by bank.
+    Documents of no known bank can't have a profile"""
+    by_bank: Dict[Bank, Dict[str, str]] = {}
+    for root in roots:
+        for pdf_file in find_pdfs(root):
+            result, bank, _ = classify(pdf_file, None)
+            if bank:
+                by_bank.setdefault(bank, {})[pdf_file] = result
+    return by_bank
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="tune the layout profiles")
+    parser.add_argument("files", nargs="+", help="PDF filenames and/or directories")
+    parser.add_argument("--output", help="JSON file to write the profiles to")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    tuned = {}
+    for bank, documents in sorted(
+        golden_results(args.files).items(), key=lambda item: item[0].value
+    ):
+        profile, seconds, default_seconds = tune(bank, documents, args.repeat)
+        print(
+            f"{bank.value:<12} {len(documents):5} documents   "
+            f"default {default_seconds:8.2f} s   tuned {seconds:8.2f} s   "
+            f"x{default_seconds / max(seconds, 1e-9):5.2f}   {profile.changes()}"
+        )
+        if profile != DEFAULT_PROFILE:
+            tuned[bank] = profile
+    if args.output:
+        LayoutProfiles(tuned).save(args.output)
+        print(f"profiles written to {args.output}")
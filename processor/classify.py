@@ -8,116 +8,98 @@ makes them easier to classify
 
 import argparse
 import os
-import re
-from functools import reduce
-from typing import List
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import ExitStack
+from dataclasses import dataclass
+from typing import Dict, List, Optional
 
 from pdfminer.converter import PDFPageAggregator
-from pdfminer.layout import (
-    LAParams,
-    LTAnno,
-    LTChar,
-    LTComponent,
-    LTContainer,
-    LTCurve,
-    LTImage,
-    LTLine,
-    LTPage,
-    LTRect,
-    LTTextBoxHorizontal,
-    LTTextBoxVertical,
-)
-from pdfminer.pdfdevice import PDFDevice
+from pdfminer.layout import LTPage
 from pdfminer.pdfdocument import PDFDocument
 from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
 from pdfminer.pdfpage import PDFPage
 from pdfminer.pdfparser import PDFParser
 from unidecode import unidecode
 
-from banks.deutsche_bank_es import DeutscheBankDocuments
-from banks.santander_uk import SantanderUKBankDocuments
-from banks.citibank_uk import CitibankUKBankDocuments
-from banks.first_direct_uk import FirstDirectUKBankDocuments
-from parsing.metadata import DocumentMetadata
+from analysis.batch import BatchClassifier
+from analysis.clustering import TemplateClusterer
+from analysis.dependencies import RuleTracker, affected_documents, current_rulesets
+from analysis.duplicates import DuplicateDetector, SeenDocument
+from analysis.fingerprint import simhash
+from analysis.scheduling import ORDERS, estimate, schedule
+from analysis.scheduling import report as schedule_report
+from banks.registry import BankRegistry, parse_banks
+from parsing.adaptive import AdaptiveRules
+from parsing.adjustments import load_adjustments
+from parsing.instrumentation import Instrumentation
+from parsing.layout import convert_to_lines
+from parsing.ledger import CSV_HEADER, extract_ledger, has_ledger
+from parsing.memory import MemoryAccounting
+from parsing.metadata import Bank, DocType, DocumentMetadata, UnrecognisedDocument
+from parsing.pages import DEFAULT_SIZE as DEFAULT_PAGE_CACHE
+from parsing.pages import PageCache, page_digest
+from parsing.profiles import DEFAULT_PROFILE, LayoutProfiles, detect_bank
+from pipeline import PROCESS, THREAD, Pipeline, Stage
+from pipeline import report as pipeline_report
+from parsing.pages import report as page_cache_report
+from storage.catalog import Catalog
+from storage.columns import GROUP_KEYS, ResultColumns
+from storage.common import file_hash
+from storage.decisions import DecisionStore
+from storage.discovery import Discovery, read_patterns
+from storage.fulltext import FullTextIndex, quote_terms
+from storage.manifest import (
+    SHARD_BY,
+    ManifestWriter,
+    Shard,
+    merge_manifests,
+    write_merged,
+)
+from storage.moves import Journal, MovePlan, apply_moves, undo_moves
 
 # PDFMINER guide in
 # https://www.unixuser.org/~euske/python/pdfminer/programming.html
 
 
-def find_pdfs(root):
-    """finds al pdf files from a directory - accepts also file names"""
-    if os.path.isfile(root):
-        if root.endswith(".pdf"):
-            yield root
-        return
+def find_pdfs(root, discovery: Discovery = None):
+    """finds all the PDF documents in a directory - accepts also file names"""
+    yield from (discovery or Discovery()).find(root)
 
-    for (dirpath, _, files) in os.walk(root):
-        for file_name in files:
-            if file_name.endswith(".pdf"):
-                yield os.path.join(dirpath, file_name)
 
+# various well known document patterns
 
-def clean_line(line):
-    """returns the given text with any excess whitespace and newlines
-    removed
-    """
-    line = re.sub(r"(  )+", "", line)
-    line = re.sub(r"(\n\n)+", "\n", line)
-    line = line.strip()
-    return line
 
+# --------------------------------------------------------------------------------------------
 
-def convert_to_lines(page: LTComponent):
-    """converts a container form pdfminer into a set of lines of text"""
-    lines = []
-    ignorable_elements = [LTImage, LTRect, LTLine, LTCurve]
-    text_elements = [LTTextBoxHorizontal, LTChar, LTAnno, LTTextBoxVertical]
-    container_elements = [LTContainer]
+# parsing of specific well known pdf document templates
 
-    for element in page:
 
-        def is_one_of(previous, element_class):
-            return previous or isinstance(
-                element, element_class  # pylint: disable=cell-var-from-loop
-            )
+def document_lines(pages) -> List[str]:
+    """joins the lines of text of all the pages of a document"""
+    return [line for page in pages for line in convert_to_lines(page)]
 
-        if reduce(is_one_of, text_elements, False):
-            lines.append(clean_line(element.get_text()))
-        elif reduce(is_one_of, container_elements, False):
-            lines += convert_to_lines(element)
-        elif reduce(is_one_of, ignorable_elements, False):
-            pass
-        else:
-            raise Exception(f"Type is {type(element)}")
-    return lines
 
+# the banks tried, their parsers are only loaded when a document needs them
+bank_registry = BankRegistry()
 
-# various well known document patterns
 
+def bank_parsers() -> list:
+    """the parsers of all the banks tried, in the order they are tried"""
+    return bank_registry.all_parsers()
 
-# --------------------------------------------------------------------------------------------
 
-# parsing of specific well known pdf document templates
+def analyse(pdf_file_name: str, pages, lines: List[str] = None) -> DocumentMetadata:
+    """Given a PDF document that has been parsed into Page entities, produce
+    classification metadata. The lines of text are obtained from the pages
+    unless the caller already has them"""
 
+    if lines is None:
+        lines = document_lines(pages)
 
-def analyse(pdf_file_name: str, pages) -> DocumentMetadata:
-    """Given a PDF document that has been parsed into Page entities, produce
-    classification metadata"""
-
-    bank_parsers = [
-        DeutscheBankDocuments(),
-        SantanderUKBankDocuments(),
-        CitibankUKBankDocuments(),
-        FirstDirectUKBankDocuments(),
-    ]
-
-    # join all the pages of the document
-    lines = []
-    for subset in [convert_to_lines(page) for page in pages]:
-        for element in subset:
-            lines.append(element)
-
-    for bank_parser in bank_parsers:
+    # only the banks whose markers are in the document would look at it
+    for bank_parser in bank_registry.claiming(lines):
         metadata = bank_parser.process(pdf_file_name, pages, lines)
         if metadata:
             return metadata
@@ -138,21 +120,9 @@ def extract_pages(pdf_file_name: str) -> List[LTPage]:
         # Create a PDF resource manager object that stores shared resources.
         rsrcmgr = PDFResourceManager()
 
-        device = PDFDevice(rsrcmgr)
-
         # we will be performing layout analysis
         # https://pdfminersix.readthedocs.io/en/latest/reference/composable.html
-        laparams = LAParams(
-            line_overlap=0.5,
-            # char_margin=2.0,
-            line_margin=1.5,
-            # word_margin=0.1,
-            # boxes_flow=None,
-            # detect_vertical=True,
-            all_texts=True,
-        )
-
-        device = PDFPageAggregator(rsrcmgr, laparams=laparams)
+        device = PDFPageAggregator(rsrcmgr, laparams=DEFAULT_PROFILE.params())
 
         interpreter = PDFPageInterpreter(rsrcmgr, device)
 
@@ -164,66 +134,1042 @@ def extract_pages(pdf_file_name: str) -> List[LTPage]:
             yield layout
 
 
-def get_arguments():
+LAYOUT_PROFILES_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "banks", "layout_profiles.json"
+)
+
+# pages laid out in this process, see parsing.pages
+page_cache = PageCache()
+# layout settings of every bank, see parsing.profiles
+layout_profiles = LayoutProfiles.load(LAYOUT_PROFILES_FILE)
+
+# --order that streams the documents through a pipeline (see pipeline.py)
+STREAM = "stream"
+
+# documents read and hashed at the same time when streaming
+HASH_THREADS = 4
+
+# --adjustments files added to the Deutsche Bank parser of this process
+adjustment_files: List[str] = []
+
+
+def configure_extraction(
+    page_cache_size: int,
+    profiles: LayoutProfiles,
+    banks: List[Bank] = None,
+    adjustments: List[str] = None,
+):
+    """pages kept by the page cache of this process (0 to keep none), the
+    layout profiles to use, the banks to try (all of them with None) and the
+    files with more Deutsche Bank adjustments. Workers are configured with it
+    too, they don't inherit the parent's settings when they are spawned"""
+    page_cache.size = page_cache_size
+    layout_profiles.profiles = dict(profiles.profiles)
+    bank_registry.select(banks)
+    # forked workers already have them
+    if adjustments and adjustments != adjustment_files:
+        # loads the Deutsche Bank parser, the adjustments are its own
+        from banks.deutsche_bank_es import adjustments as table
+
+        for path in reversed(adjustments):
+            table.add_first(load_adjustments(path))
+        adjustment_files[:] = adjustments
+
+
+def extract_lines(
+    pdf_file_name: str, cache: PageCache = None, profiles: LayoutProfiles = None
+) -> List[str]:
+    """the lines of text of a document, like document_lines(extract_pages()).
+    With profiles, pages are laid out with the profile of the bank as soon as
+    the bank is known, with a cache the lines of the pages in it are reused"""
+    with open(pdf_file_name, "rb") as pdf_file:
+        document = PDFDocument(PDFParser(pdf_file))
+        rsrcmgr = PDFResourceManager()
+        interpreters = {}
+        profile = DEFAULT_PROFILE
+        plugins = bank_registry.plugins if profiles else []
+        # the objects shared by the pages of the document are digested once
+        memo = {}
+        lines = []
+        for page in PDFPage.create_pages(document):
+            digest = None
+            page_lines = None
+            if cache is not None and cache.size:
+                digest = page_digest(page, memo, profile.key())
+                page_lines = cache.get(digest)
+            if page_lines is None:
+                if profile not in interpreters:
+                    device = PDFPageAggregator(rsrcmgr, laparams=profile.params())
+                    interpreters[profile] = (
+                        PDFPageInterpreter(rsrcmgr, device),
+                        device,
+                    )
+                interpreter, device = interpreters[profile]
+                interpreter.process_page(page)
+                page_lines = convert_to_lines(device.get_result())
+                if digest:
+                    cache.put(digest, page_lines)
+            lines += page_lines
+            if plugins:
+                bank = detect_bank(lines, plugins)
+                if bank:
+                    profile = profiles.for_bank(bank)
+                    # the bank found is kept for the rest of the document
+                    plugins = []
+        return lines
+
+
+COMMANDS = [
+    "run",
+    "query",
+    "search",
+    "unknowns",
+    "reclassify",
+    "merge",
+    "undo",
+    "ledger",
+]
+
+
+def get_arguments(argv=None):
     """ parse provided command line arguments"""
+    argv = sys.argv[1:] if argv is None else argv
+    # classifying is the default command, so "classify.py folder" keeps working
+    if not argv or argv[0] not in COMMANDS + ["-h", "--help"]:
+        argv = ["run"] + argv
+
     parser = argparse.ArgumentParser()
-    parser.add_argument(
+    commands = parser.add_subparsers(dest="command")
+
+    run = commands.add_parser("run", help="classify PDF documents (default)")
+    run.add_argument(
         "files",
         nargs="+",
         help="PDF filenames and/or directories to traverse " "looking for them",
     )
-    return parser.parse_args()
+    run.add_argument(
+        "--catalog",
+        help="SQLite database where the metadata of every document is recorded",
+    )
+    run.add_argument(
+        "--exclude",
+        action="append",
+        default=[],
+        metavar="PATTERN",
+        help="skip files and folders matching this .gitignore style pattern "
+        "(can be repeated, a .classifyignore file in the folders is read too)",
+    )
+    run.add_argument(
+        "--exclude-from",
+        action="append",
+        default=[],
+        metavar="FILE",
+        help="read exclude patterns from this file",
+    )
+    run.add_argument(
+        "--trust-extension",
+        action="store_true",
+        help="take files ending in .pdf (in any case) without reading their header",
+    )
+    run.add_argument(
+        "--scan-threads",
+        type=int,
+        default=4,
+        help="folders read at the same time when looking for documents",
+    )
+    run.add_argument(
+        "--index-text",
+        action="store_true",
+        help="also keep the text of the documents in the catalog for full text search",
+    )
+    run.add_argument(
+        "--force",
+        action="store_true",
+        help="classify again documents whose contents are already in the catalog",
+    )
+    run.add_argument(
+        "--near-distance",
+        type=int,
+        default=3,
+        help="max bits of difference between text fingerprints of near duplicates",
+    )
+    run.add_argument(
+        "--profile",
+        metavar="REPORT",
+        help="measure every rule, find_date and process call and save the counters "
+        "as JSON in this file",
+    )
+    run.add_argument(
+        "--memory",
+        metavar="REPORT",
+        help="measure the peak RSS of every document and the memory allocated "
+        "laying out, converting and analysing it, and save it as JSON in this file",
+    )
+    run.add_argument(
+        "--memory-top",
+        type=int,
+        default=10,
+        help="documents and allocation sites shown in the memory report",
+    )
+    run.add_argument(
+        "--adjustments",
+        action="append",
+        default=[],
+        metavar="FILE",
+        help="JSON or TOML file with more Deutsche Bank payee adjustments, tried "
+        "before the known ones (can be repeated)",
+    )
+    run.add_argument(
+        "--banks",
+        metavar="BANKS",
+        help="only classify the documents of these banks, a comma separated list "
+        "like db,firstdirect (the rest are left unknown)",
+    )
+    run.add_argument(
+        "--adaptive-rules",
+        metavar="STATE",
+        help="try the rules that match most often first, learning and keeping "
+        "their statistics in this JSON file",
+    )
+    run.add_argument(
+        "--shard",
+        metavar="I/N",
+        help="only classify the documents of shard I of N, to split a run "
+        "between several machines or processes",
+    )
+    run.add_argument(
+        "--shard-by",
+        choices=SHARD_BY,
+        default="path",
+        help="split by the path relative to the folders given (default) or by "
+        "the contents, so copies of a document end in the same shard",
+    )
+    run.add_argument(
+        "--manifest",
+        metavar="FILE",
+        help="write the result of every document to this JSON lines file",
+    )
+    run.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="documents parsed at the same time, in separate processes",
+    )
+    run.add_argument(
+        "--order",
+        choices=ORDERS + [STREAM],
+        default="largest",
+        help="with several jobs, start with the documents estimated to take "
+        "longest (default, finishes sooner), the smallest (first results sooner) "
+        "or in the order they are found. With stream documents are hashed, "
+        "parsed and recorded while the folders are still being walked",
+    )
+    run.add_argument(
+        "--page-cache",
+        type=int,
+        default=DEFAULT_PAGE_CACHE,
+        metavar="PAGES",
+        help="pages whose lines are kept to reuse when the same page (like "
+        "terms and conditions) is found again, 0 to lay out every page",
+    )
+    run.add_argument(
+        "--layout-profiles",
+        metavar="FILE",
+        help="layout settings of every bank, like the ones written by "
+        "benchmarks.profiles (default banks/layout_profiles.json)",
+    )
+    run.add_argument(
+        "--apply",
+        metavar="DIR",
+        help="move the documents recognised into DIR/<year>/<bank>/<type>, "
+        "with their new names, once all are classified",
+    )
+    run.add_argument(
+        "--journal",
+        metavar="FILE",
+        help="where to record the moves of --apply, to undo them later "
+        "(default DIR/.classify-journal-<date and time>.jsonl)",
+    )
+    run.set_defaults(func=run_command)
+
+    query = commands.add_parser("query", help="look up documents in a catalog")
+    query.add_argument("--catalog", required=True, help="SQLite catalog to query")
+    query.add_argument("--bank", choices=[bank.value for bank in Bank])
+    query.add_argument("--year", type=int)
+    query.add_argument(
+        "--type", dest="classification", choices=[doc.value for doc in DocType]
+    )
+    query.add_argument("--entity", help="text contained in the entity or extra info")
+    query.add_argument(
+        "--summary",
+        nargs="*",
+        choices=GROUP_KEYS,
+        help="count the documents by these columns instead of listing them "
+        "(year, bank and type if none given)",
+    )
+    query.add_argument("--csv", metavar="FILE", help="export the documents to CSV")
+    query.set_defaults(func=query_command)
+
+    search = commands.add_parser("search", help="full text search in a catalog")
+    search.add_argument("--catalog", required=True, help="SQLite catalog to search")
+    search.add_argument("--limit", type=int, default=20)
+    search.add_argument(
+        "--raw",
+        action="store_true",
+        help="use the terms as an FTS5 query (phrases, OR, NEAR...) instead of plain words",
+    )
+    search.add_argument("terms", nargs="+", help="words to look for")
+    search.set_defaults(func=search_command)
+
+    unknowns = commands.add_parser(
+        "unknowns", help="group the documents not recognised by template"
+    )
+    unknowns.add_argument("files", nargs="+", help="PDF filenames and/or directories")
+    unknowns.add_argument(
+        "--catalog", help="catalog with indexed text, to avoid parsing the PDFs again"
+    )
+    unknowns.add_argument(
+        "--threshold",
+        type=float,
+        default=0.5,
+        help="minimum share of lines in common for two documents to share a template",
+    )
+    unknowns.add_argument(
+        "--literals", type=int, default=5, help="candidate literals shown per group"
+    )
+    unknowns.set_defaults(func=unknowns_command)
+
+    reclassify = commands.add_parser(
+        "reclassify",
+        help="evaluate the rules again over the text kept in a catalog, in batches",
+    )
+    reclassify.add_argument(
+        "--catalog", required=True, help="catalog with indexed text"
+    )
+    reclassify.add_argument(
+        "--batch-size", type=int, default=5000, help="documents evaluated at once"
+    )
+    reclassify.add_argument(
+        "--dry-run", action="store_true", help="report changes without recording them"
+    )
+    reclassify.add_argument(
+        "--all",
+        action="store_true",
+        help="evaluate every document, not only the ones the rule changes can affect",
+    )
+    reclassify.set_defaults(func=reclassify_command)
+
+    merge = commands.add_parser(
+        "merge", help="combine the manifests of the shards of a run"
+    )
+    merge.add_argument("manifests", nargs="+", help="manifests of every shard")
+    merge.add_argument("--output", required=True, help="merged manifest to write")
+    merge.set_defaults(func=merge_command)
 
+    undo = commands.add_parser("undo", help="move back the documents of an --apply")
+    undo.add_argument("journal", help="journal written by the run")
+    undo.add_argument("--catalog", help="SQLite catalog to update")
+    undo.set_defaults(func=undo_command)
 
-def main(files):
+    ledger = commands.add_parser(
+        "ledger", help="extract the movements of account statements"
+    )
+    ledger.add_argument("files", nargs="+", help="PDF filenames and/or directories")
+    ledger.add_argument("--csv", help="write all the movements to this CSV file")
+    ledger.set_defaults(func=ledger_command)
+
+    return parser.parse_args(argv)
+
+
+def target_file_name(metadata: DocumentMetadata) -> str:
+    """name the document is renamed to, built from its metadata"""
+    file_name = (
+        f"{metadata.period_start_date.strftime('%Y.%m.%d')} {metadata.bank.value} "
+        f"{metadata.classification.value}"
+    )
+    if metadata.entity:
+        file_name += f" {metadata.entity}"
+    if metadata.extra_info:
+        file_name += f" {unidecode(metadata.extra_info.lower())}"
+    file_name += ".pdf"
+    # replace non ascii chars
+    file_name = (
+        unidecode(file_name)
+        .replace("/", ".")
+        .replace(":", " ")
+        .replace("(", " ")
+        .replace(")", " ")
+        .replace(",", " ")
+        .replace("..", ".")
+        .strip()
+    )
+    return " ".join(file_name.split())  # removes multiple spaces
+
+
+def parse_document(pdf_file: str):
+    """extracts and classifies a document, returns its lines, its metadata, the
+    fingerprint of its text, the seconds it took and its pages reused from the
+    page cache and laid out"""
+    start = time.perf_counter()
+    hits, misses = page_cache.hits, page_cache.misses
+    lines = extract_lines(pdf_file, page_cache, layout_profiles)
+    # the parsers only look at the lines
+    metadata = analyse(pdf_file, None, lines)
+    pages = (page_cache.hits - hits, page_cache.misses - misses)
+    return lines, metadata, simhash(lines), time.perf_counter() - start, pages
+
+
+def main(
+    files,
+    catalog: Catalog = None,
+    text_index: FullTextIndex = None,
+    duplicates: DuplicateDetector = None,
+    tracker: RuleTracker = None,
+    shard: Shard = None,
+    manifest: ManifestWriter = None,
+    jobs: int = 1,
+    order: str = "largest",
+    discovery: Discovery = None,
+    plan: MovePlan = None,
+):
     """scan for PDF files inside the list of files or folders provided
-    and rename them into a structure
+    and rename them into a structure. With a shard only the documents that
+    belong to it are looked at, with more than one job they are parsed in
+    parallel. With a plan the documents recognised are added to it, to be
+    moved afterwards
     """
     errors = []
-    last_folder = ""
-    for file_or_folder in files:
-        for pdf_file in find_pdfs(file_or_folder):
+    if not duplicates:
+        duplicates = DuplicateDetector(catalog)
+
+    def record_copy(pdf_file, content_hash, copy) -> str:
+        """records a document classified before, returns how it's shown"""
+        metadata = copy.metadata
+        file_name = target_file_name(metadata) if metadata else None
+        duplicates.add(pdf_file, content_hash, metadata, file_name)
+        if catalog:
+            catalog.add(pdf_file, content_hash, metadata, copy.fingerprint)
+        if manifest:
+            manifest.add(pdf_file, content_hash, metadata, file_name)
+        if plan:
+            plan.add(pdf_file, metadata, file_name)
+        if copy.path == os.path.abspath(pdf_file):
+            return f"{file_name or '--> UNKNOWN'} (already classified)"
+        return f"{file_name or '--> UNKNOWN'} (copy of {copy.path})"
+
+    def record_parsed(pdf_file, content_hash, lines, metadata, fingerprint) -> str:
+        """records a document just classified, returns how it's shown"""
+        file_name = target_file_name(metadata) if metadata else None
+        duplicates.add(pdf_file, content_hash, metadata, file_name, fingerprint)
+        if catalog:
+            catalog.add(pdf_file, content_hash, metadata, fingerprint)
+            if text_index:
+                text_index.add(content_hash, lines)
+        if tracker:
+            tracker.record(content_hash, lines)
+        if manifest:
+            manifest.add(pdf_file, content_hash, metadata, file_name)
+        if plan:
+            plan.add(pdf_file, metadata, file_name)
+        return file_name or "--> UNKNOWN"
+
+    pdf_files = (
+        pdf_file
+        for file_or_folder in files
+        for pdf_file in find_pdfs(file_or_folder, discovery)
+        if not shard or shard.contains(pdf_file, file_or_folder)
+    )
+    # shards split by contents already hashed their documents
+    hash_file = shard.content_hash if shard else file_hash
+    # pages reused from the page cache and laid out
+    pages = [0, 0]
+    if order == STREAM:
+        pages = classify_streaming(
+            pdf_files, jobs, duplicates, record_copy, record_parsed, hash_file
+        )
+    elif jobs > 1:
+        pages = classify_in_parallel(
+            list(pdf_files),
+            jobs,
+            order,
+            duplicates,
+            record_copy,
+            record_parsed,
+            hash_file,
+        )
+    else:
+        last_folder = ""
+        for pdf_file in pdf_files:
             try:
-                pages = extract_pages(pdf_file)
                 if last_folder != os.path.dirname(pdf_file):
                     last_folder = os.path.dirname(pdf_file)
                     print(f"\nin {last_folder}:\n")
                 print(f"{os.path.basename(pdf_file)} = ", end="")
-                metadata = analyse(pdf_file, pages)
 
-                if not metadata:
-                    print("--> UNKNOWN")
+                # exact copies of something already classified are not parsed again
+                content_hash = hash_file(pdf_file)
+                copy = duplicates.find_copy(content_hash, pdf_file)
+                if copy:
+                    print(record_copy(pdf_file, content_hash, copy))
                     continue
 
-                file_name = (
-                    f"{metadata.period_start_date.strftime('%Y.%m.%d')} {metadata.bank.value} "
-                    f"{metadata.classification.value}"
+                lines, metadata, fingerprint, _, (hits, misses) = parse_document(
+                    pdf_file
                 )
-                if metadata.entity:
-                    file_name += f" {metadata.entity}"
-                if metadata.extra_info:
-                    file_name += f" {unidecode(metadata.extra_info.lower())}"
-                file_name += ".pdf"
-                # replace non ascii chars
-                file_name = (
-                    unidecode(file_name)
-                    .replace("/", ".")
-                    .replace(":", " ")
-                    .replace("(", " ")
-                    .replace(")", " ")
-                    .replace(",", " ")
-                    .replace("..", ".")
-                    .strip()
+                pages = [pages[0] + hits, pages[1] + misses]
+                print(
+                    record_parsed(pdf_file, content_hash, lines, metadata, fingerprint)
                 )
-                file_name = " ".join(file_name.split())  # removes multiple spaces
-                print(f"{file_name}")
             except Exception as exc:  # noqa: E0602
                 errors.append(f"{pdf_file}: {exc}")
                 raise exc
 
+    duplicates.report()
+    if page_cache.size and sum(pages):
+        print(page_cache_report(pages[0], sum(pages)))
+    print(f"===== Finished\nErrors: {errors}")
+
+
+def classify_in_parallel(
+    pdf_files: List[str],
+    jobs: int,
+    order: str,
+    duplicates: DuplicateDetector,
+    record_copy,
+    record_parsed,
+    hash_file=file_hash,
+) -> List[int]:
+    """parses the documents in a pool of processes, dispatched in the given
+    order of estimated cost. Results are recorded here as they arrive, copies
+    of documents of the same run once the first one is done. Returns the pages
+    reused from the page caches of the workers and the pages laid out"""
+    to_parse = {}
+    copies = []
+    first_with_hash = set()
+    for pdf_file in pdf_files:
+        content_hash = hash_file(pdf_file)
+        copy = duplicates.find_copy(content_hash, pdf_file)
+        if copy:
+            print(f"{pdf_file} = {record_copy(pdf_file, content_hash, copy)}")
+        elif content_hash in first_with_hash:
+            copies.append((pdf_file, content_hash))
+        else:
+            first_with_hash.add(content_hash)
+            to_parse[pdf_file] = content_hash
+
+    scheduled = schedule([estimate(pdf_file) for pdf_file in to_parse], order)
+    start = time.perf_counter()
+    pages = [0, 0]
+    with ProcessPoolExecutor(
+        jobs,
+        initializer=configure_extraction,
+        initargs=(
+            page_cache.size,
+            layout_profiles,
+            bank_registry.banks,
+            adjustment_files,
+        ),
+    ) as executor:
+        futures = {executor.submit(parse_document, job.path): job for job in scheduled}
+        try:
+            for future in as_completed(futures):
+                job = futures[future]
+                lines, metadata, fingerprint, job.seconds, (hits, misses) = (
+                    future.result()
+                )
+                pages = [pages[0] + hits, pages[1] + misses]
+                shown = record_parsed(
+                    job.path, to_parse[job.path], lines, metadata, fingerprint
+                )
+                print(f"{job.path} = {shown}")
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+    elapsed = time.perf_counter() - start
+
+    for pdf_file, content_hash in copies:
+        copy = duplicates.find_copy(content_hash, pdf_file)
+        print(f"{pdf_file} = {record_copy(pdf_file, content_hash, copy)}")
+    print(schedule_report(scheduled, jobs, elapsed))
+    return pages
+
+
+@dataclass
+class StreamedDocument:
+    """A document going through the streaming pipeline: its contents hash,
+    the copy classified before if any, whether a copy of it found earlier in
+    the same run is still being parsed, and the result of parse_document"""
+
+    path: str
+    content_hash: str
+    copy: Optional[SeenDocument] = None
+    pending: bool = False
+    parsed: Optional[tuple] = None
+
+
+def parse_streamed(document: StreamedDocument) -> StreamedDocument:
+    """ parses a document, in a process of the pipeline """
+    document.parsed = parse_document(document.path)
+    return document
+
+
+def classify_streaming(
+    pdf_files,
+    jobs: int,
+    duplicates: DuplicateDetector,
+    record_copy,
+    record_parsed,
+    hash_file=file_hash,
+) -> List[int]:
+    """classifies the documents as they are found: they are hashed in threads,
+    looked up among the documents classified before, parsed in a pool of
+    processes and recorded here, each step connected to the next by a bounded
+    queue so the folders aren't walked much further than the parsing goes.
+    Returns the pages reused from the page caches and the pages laid out"""
+    first_with_hash = set()
+    # copies of documents of the same run that were not recorded yet, by hash
+    waiting: Dict[str, List[str]] = {}
+    pages = [0, 0]
+
+    def hash_document(pdf_file: str) -> StreamedDocument:
+        # in a thread of the pipeline
+        return StreamedDocument(pdf_file, hash_file(pdf_file))
+
+    def lookup(document: StreamedDocument) -> StreamedDocument:
+        # in the thread of the pipeline, the catalog's connection belongs to it
+        document.copy = duplicates.find_copy(document.content_hash, document.path)
+        if not document.copy:
+            document.pending = document.content_hash in first_with_hash
+            first_with_hash.add(document.content_hash)
+        return document
+
+    def record_copy_of(pdf_file: str, content_hash: str):
+        copy = duplicates.find_copy(content_hash, pdf_file)
+        print(f"{pdf_file} = {record_copy(pdf_file, content_hash, copy)}")
+
+    def record(document: StreamedDocument):
+        if document.copy:
+            shown = record_copy(document.path, document.content_hash, document.copy)
+            print(f"{document.path} = {shown}")
+        elif document.pending:
+            if duplicates.find_copy(document.content_hash, document.path):
+                record_copy_of(document.path, document.content_hash)
+            else:
+                waiting.setdefault(document.content_hash, []).append(document.path)
+        else:
+            lines, metadata, fingerprint, _, (hits, misses) = document.parsed
+            pages[0] += hits
+            pages[1] += misses
+            shown = record_parsed(
+                document.path, document.content_hash, lines, metadata, fingerprint
+            )
+            print(f"{document.path} = {shown}")
+            for pdf_file in waiting.pop(document.content_hash, []):
+                record_copy_of(pdf_file, document.content_hash)
+
+    pipeline = Pipeline(
+        pdf_files,
+        [
+            Stage("hash", hash_document, THREAD, HASH_THREADS),
+            Stage("lookup", lookup),
+            Stage(
+                "parse",
+                parse_streamed,
+                PROCESS,
+                max(1, jobs),
+                applies=lambda document: not document.copy and not document.pending,
+                initializer=configure_extraction,
+                initargs=(
+                    page_cache.size,
+                    layout_profiles,
+                    bank_registry.banks,
+                    adjustment_files,
+                ),
+            ),
+        ],
+        record,
+    )
+    start = time.perf_counter()
+    stats = pipeline.run()
+    print(pipeline_report(stats, time.perf_counter() - start))
+    return pages
+
+
+def check_in_process(args, option: str):
+    """options whose counters live in this process can't be used when the
+    documents are parsed in other processes, their counters would stay there"""
+    if args.jobs > 1 or args.order == STREAM:
+        raise Exception(
+            f"{option} measures the documents parsed in this process, it can't "
+            "be used with --jobs or --order stream"
+        )
+
+
+def run_command(args):
+    """classifies the given files, measuring the rules and the memory of every
+    document if requested"""
+    with ExitStack() as stack:
+        if args.profile:
+            check_in_process(args, "--profile")
+            instrumentation = stack.enter_context(Instrumentation())
+            instrumentation.install(bank_parsers())
+            stack.callback(instrumentation.save, args.profile)
+            stack.callback(lambda: print(instrumentation.report()))
+        if args.memory:
+            check_in_process(args, "--memory")
+            memory = stack.enter_context(MemoryAccounting(args.memory_top))
+            # this module is __main__ when run as a script
+            memory.install(sys.modules[__name__])
+            stack.callback(memory.save, args.memory)
+            stack.callback(lambda: print(memory.report()))
+        classify_files(args)
+
+
+def discovery_of(args) -> Discovery:
+    """how to find the documents, from the command line options"""
+    excludes = list(args.exclude)
+    for path in args.exclude_from:
+        excludes += read_patterns(path)
+    return Discovery(excludes, args.trust_extension, args.scan_threads)
+
+
+def classify_files(args):
+    """classifies the given files, recording them in the catalog if requested"""
+    if args.index_text and not args.catalog:
+        raise Exception("--index-text needs a --catalog to store the text")
+    if args.adaptive_rules:
+        check_in_process(args, "--adaptive-rules")
+    banks = None
+    if args.banks:
+        if args.catalog:
+            raise Exception(
+                "--banks can't be used with --catalog, the documents of the other "
+                "banks would be recorded as unknown"
+            )
+        banks = parse_banks(args.banks)
+    profiles = layout_profiles
+    if args.layout_profiles:
+        profiles = LayoutProfiles.load(args.layout_profiles)
+    configure_extraction(args.page_cache, profiles, banks, args.adjustments)
+    with ExitStack() as stack:
+        catalog = None
+        text_index = None
+        tracker = None
+        if args.catalog:
+            catalog = stack.enter_context(Catalog(args.catalog))
+            store = stack.enter_context(DecisionStore(args.catalog))
+            tracker = RuleTracker(store, bank_parsers())
+            if args.index_text:
+                text_index = stack.enter_context(FullTextIndex(args.catalog))
+        duplicates = DuplicateDetector(
+            catalog, use_catalog=not args.force, max_distance=args.near_distance
+        )
+        shard = Shard.parse(args.shard, args.shard_by) if args.shard else None
+        manifest = None
+        if args.manifest:
+            manifest = stack.enter_context(
+                ManifestWriter(args.manifest, shard, args.files)
+            )
+        # after the tracker has taken note of the rules in their written order
+        if args.adaptive_rules:
+            stack.enter_context(AdaptiveRules(args.adaptive_rules, bank_parsers()))
+        plan = MovePlan(args.apply) if args.apply else None
+        main(
+            args.files,
+            catalog,
+            text_index,
+            duplicates,
+            tracker,
+            shard,
+            manifest,
+            args.jobs,
+            args.order,
+            discovery_of(args),
+            plan,
+        )
+        if plan:
+            apply_plan(plan, args.journal, catalog)
+
+
+def apply_plan(plan: MovePlan, journal_path: str, catalog: Catalog = None):
+    """does the moves of a run, journaled so they can be undone"""
+    moves, in_place, duplicates = plan.plan()
+    if duplicates:
+        print("===== Left where they are (the same document is at the target)")
+        for duplicate in duplicates:
+            print(f"{duplicate.source}\n    same as: {duplicate.target}")
+    if not moves:
+        print(
+            f"===== Nothing to move, {len(in_place)} documents already in place, "
+            f"{len(duplicates)} left where they are"
+        )
+        return
+    if not journal_path:
+        started = time.strftime("%Y%m%d-%H%M%S")
+        journal_path = os.path.join(plan.root, f".classify-journal-{started}.jsonl")
+    os.makedirs(plan.root, exist_ok=True)
+    journal = Journal(journal_path, plan.root)
+    try:
+        moved = apply_moves(moves, journal, catalog)
+    finally:
+        journal.close()
+    print(
+        f"===== Moved {moved} documents into {plan.root}, "
+        f"{len(in_place)} already in place, {len(duplicates)} left where they are\n"
+        f"undo with: classify.py undo {journal_path}"
+    )
+
+
+def query_command(args):
+    """prints the documents in the catalog matching the criteria given, or a
+    summary of them"""
+    with Catalog(args.catalog) as catalog:
+        entries = catalog.query(
+            bank=Bank(args.bank) if args.bank else None,
+            year=args.year,
+            classification=(
+                DocType(args.classification) if args.classification else None
+            ),
+            entity=args.entity,
+        )
+        if args.summary is not None or args.csv:
+            group_by = args.summary
+            if group_by is not None and not group_by:
+                group_by = ["year", "bank", "type"]
+            summarise(entries, group_by, args.csv)
+            return
+        for entry in entries:
+            metadata = entry.metadata
+            date = (
+                metadata.period_start_date.strftime("%Y.%m.%d")
+                if metadata.period_start_date
+                else "----.--.--"
+            )
+            print(
+                f"{date} {metadata.bank.value} {metadata.classification.value} "
+                f"{metadata.entity} {metadata.extra_info}\t{entry.path}"
+            )
+
+
+def summarise(entries, group_by: List[str], csv_file: str):
+    """loads the entries in columns to count them by the given keys and/or
+    export them to CSV, so even huge archives fit in memory"""
+    results = ResultColumns()
+    for entry in entries:
+        results.append(entry.metadata, entry.path)
+    if csv_file:
+        results.to_csv(csv_file)
+        print(f"{len(results)} documents written to {csv_file}")
+    if group_by:
+        counts = results.group_by(*group_by)
+        for group in sorted(counts, key=lambda values: [str(v) for v in values]):
+            values = " ".join("-" if value is None else str(value) for value in group)
+            print(f"{counts[group]:8} {values}")
+        print(f"{len(results):8} documents")
+
+
+def search_command(args):
+    """prints the documents whose text matches the search terms, best first"""
+    terms = " ".join(args.terms)
+    query = terms if args.raw else quote_terms(terms)
+    with Catalog(args.catalog) as catalog, FullTextIndex(args.catalog) as text_index:
+        for result in text_index.search(query, args.limit):
+            for entry in catalog.find_by_hash(result.hash):
+                print(entry.path)
+            print(f"    {result.snippet}\n")
+
+
+def unknowns_command(args):
+    """classifies the documents again and groups the ones that are not recognised
+    by template, listing the lines that could identify each template in a Filing"""
+    clusterer = TemplateClusterer(threshold=args.threshold)
+    banks = {}
+    errors = []
+    text_index = FullTextIndex(args.catalog) if args.catalog else None
+    for file_or_folder in args.files:
+        for pdf_file in find_pdfs(file_or_folder):
+            try:
+                lines = None
+                if text_index:
+                    lines = text_index.lines(file_hash(pdf_file))
+                if lines is None:
+                    lines = extract_lines(pdf_file, page_cache, layout_profiles)
+                if analyse(pdf_file, None, lines):
+                    continue
+                banks[pdf_file] = Bank.UNKNOWN
+            except UnrecognisedDocument as exc:
+                banks[pdf_file] = exc.bank
+            except Exception as exc:  # noqa: E0602
+                errors.append(f"{pdf_file}: {exc}")
+                continue
+            clusterer.add(pdf_file, lines)
+    if text_index:
+        text_index.close()
+
+    clusters = clusterer.clusters(args.literals)
+    for number, cluster in enumerate(clusters, start=1):
+        counts = {}
+        for member in cluster.members:
+            counts[banks[member].value] = counts.get(banks[member].value, 0) + 1
+        summary = ", ".join(
+            f"{bank}: {count}" for bank, count in sorted(counts.items())
+        )
+        print(f"===== Template {number}: {len(cluster.members)} documents ({summary})")
+        for member in cluster.members:
+            print(f"    {member}")
+        print("  candidate must_contain:")
+        for literal, inside, outside in cluster.literals:
+            print(f"    {literal!r}  (in {inside} here, {outside} elsewhere)")
+    print(f"===== Finished\n{len(banks)} not recognised\nErrors: {errors}")
+
+
+def reclassify_command(args):
+    """applies the current rules to the documents of the catalog that have their
+    text indexed, reporting and recording the ones whose metadata changes. Only
+    the documents that the rule changes since the last time can affect are
+    evaluated, unless all of them are requested. Documents without indexed
+    text or that fail are kept pending for the next time"""
+    parsers = bank_parsers()
+    changed = 0
+    missing = 0
+    errors = []
+    # documents that could change but weren't classified again
+    skipped = []
+    with Catalog(args.catalog) as catalog, FullTextIndex(
+        args.catalog
+    ) as text_index, DecisionStore(args.catalog) as store:
+        tracker = RuleTracker(store, parsers)
+        classifier = tracker.classifier
+        by_hash = {}
+        for entry in catalog.query():
+            by_hash.setdefault(entry.hash, []).append(entry)
+        hashes = sorted(by_hash)
+
+        rulesets = current_rulesets(parsers)
+        if not args.all:
+            affected = affected_documents(store.decisions(), store.rulesets(), rulesets)
+            if affected is not None:
+                # documents never evaluated before are always included
+                decided = {decision.hash for decision in store.decisions()}
+                hashes = [
+                    value
+                    for value in hashes
+                    if value in affected or value not in decided
+                ]
+        print(f"evaluating {len(hashes)} of {len(by_hash)} documents")
+
+        for start in range(0, len(hashes), args.batch_size):
+            names = []
+            documents = []
+            for content_hash in hashes[start : start + args.batch_size]:
+                lines = text_index.lines(content_hash)
+                if lines is None:
+                    missing += len(by_hash[content_hash])
+                    skipped.append(content_hash)
+                    continue
+                names.append(content_hash)
+                documents.append(lines)
+            result, results, failures = classifier.classify(names, documents)
+            skipped += list(failures)
+            if not args.dry_run:
+                for decision in tracker.decisions(names, result):
+                    store.add(decision)
+            for content_hash, metadata in zip(names, results):
+                for entry in by_hash[content_hash]:
+                    if content_hash in failures:
+                        errors.append(f"{entry.path}: {failures[content_hash]}")
+                        continue
+                    previous = entry.metadata
+                    if previous.bank == Bank.UNKNOWN:
+                        previous = None
+                    if previous == metadata:
+                        continue
+                    changed += 1
+                    before = target_file_name(previous) if previous else "UNKNOWN"
+                    after = target_file_name(metadata) if metadata else "UNKNOWN"
+                    print(f"{entry.path}\n    {before} --> {after}")
+                    if not args.dry_run:
+                        catalog.add(
+                            entry.path, content_hash, metadata, entry.fingerprint
+                        )
+        if not args.dry_run:
+            # the snapshot moves on, the documents skipped must not look decided
+            store.forget(skipped)
+            store.save_rulesets(rulesets)
+    print(
+        f"===== Finished\n{changed} changed, {missing} without indexed text\n"
+        f"Errors: {errors}"
+    )
+
+
+def merge_command(args):
+    """merges the manifests of a sharded run, reporting missing shards,
+    documents in more than one shard and conflicting results"""
+    merged = merge_manifests(args.manifests)
+    write_merged(merged, args.output)
+    print(f"{len(merged.documents)} documents written to {args.output}")
+    problems = 0
+    for title, lines in [
+        ("Missing shards", merged.missing_shards),
+        ("Documents in more than one shard", merged.overlaps),
+        ("Conflicting results", merged.conflicts),
+    ]:
+        if lines:
+            problems += len(lines)
+            print(f"===== {title}:")
+            for line in lines:
+                print(f"  {line}")
+    if problems:
+        sys.exit(1)
+
+
+def undo_command(args):
+    """moves the documents of a journal back where they were"""
+    with ExitStack() as stack:
+        catalog = stack.enter_context(Catalog(args.catalog)) if args.catalog else None
+        undone, skipped = undo_moves(args.journal, catalog)
+    print(f"===== Moved back {undone} documents")
+    if skipped:
+        print("===== Not moved back:")
+        for line in skipped:
+            print(f"  {line}")
+
+
+def ledger_command(args):
+    """extracts the movements of the statements found, checking their balances"""
+    if args.csv:
+        with open(args.csv, "w", newline="", encoding="utf-8") as output:
+            output.write(",".join(CSV_HEADER) + "\n")
+    errors = []
+    for file_or_folder in args.files:
+        for pdf_file in find_pdfs(file_or_folder):
+            try:
+                pages = list(extract_pages(pdf_file))
+                metadata = analyse(pdf_file, pages)
+            except Exception as exc:  # noqa: E0602
+                errors.append(f"{pdf_file}: {exc}")
+                continue
+            if not has_ledger(metadata):
+                continue
+            ledger = extract_ledger(pages, metadata)
+            checked, wrong = ledger.balance_errors()
+            money_in, money_out = ledger.totals()
+            print(
+                f"{pdf_file}: {len(ledger)} movements, in {money_in / 100:.2f}, "
+                f"out {money_out / 100:.2f}, {checked} balances checked, "
+                f"{len(wrong)} wrong"
+            )
+            for row in wrong:
+                print(
+                    f"    {ledger.dates[row]} {ledger.descriptions[row]}: "
+                    f"balance {ledger.balances[row] / 100:.2f}"
+                )
+            if args.csv:
+                ledger.to_csv(args.csv, pdf_file)
     print(f"===== Finished\nErrors: {errors}")
 
 
 if __name__ == "__main__":
     args = get_arguments()
-    main(args.files)
+    args.func(args)
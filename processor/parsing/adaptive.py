@@ -0,0 +1,227 @@
+"""
+Adaptive evaluation order for the simple_mappings of the banks. Rules that
+match more often are tried earlier and, inside each rule, the conditions that
+fail more often are checked first, using statistics learned in previous runs
+and kept up to date during the run.
+
+The result must be the same as evaluating the rules in the order they are
+written (first match wins), so a rule only moves ahead of the rules it can't
+conflict with: rules with the same outcome (it doesn't matter which one of
+them matches) and rules that can never be the first match because an earlier
+rule always matches when they do. Rules only require literals to be present,
+so two rules with different outcomes can always match the same document and
+keep their relative order. Reordering the conditions inside a rule is always
+safe.
+"""
+
+import hashlib
+import json
+import os
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from parsing.common import find_containing
+from parsing.metadata import Filing
+
+# the order is recalculated after this many documents are decided
+REORDER_EVERY = 200
+
+
+def conditions_of(filing: Filing) -> list:
+    """conditions of a filing, each one a string or a list of strings that must
+    be found in a single line"""
+    if not filing.must_contain:
+        return []
+    if isinstance(filing.must_contain, list):
+        return list(filing.must_contain)
+    return [filing.must_contain]
+
+
+def condition_key(condition) -> str:
+    """ stable identifier of a condition """
+    return json.dumps(condition, ensure_ascii=False)
+
+
+def rule_key(filing: Filing) -> str:
+    """stable identifier of a rule, from its contents, so statistics of rules
+    that are edited are discarded"""
+    definition = json.dumps(
+        [
+            filing.must_contain,
+            filing.classification.value,
+            filing.entity,
+            filing.extra_info,
+        ],
+        ensure_ascii=False,
+    )
+    return hashlib.sha1(definition.encode("utf-8")).hexdigest()[:16]
+
+
+def _literals(condition) -> list:
+    return condition if isinstance(condition, list) else [condition]
+
+
+def implies(condition, other) -> bool:
+    """true if any line satisfying condition also satisfies other: every literal
+    of other is contained in some literal of condition"""
+    return all(
+        any(literal in longer for longer in _literals(condition))
+        for literal in _literals(other)
+    )
+
+
+def shadowed(filings: List[Filing], index: int) -> bool:
+    """true if the rule can never be the first to match: it has no conditions,
+    or an earlier rule matches whenever it does"""
+    conditions = conditions_of(filings[index])
+    if not conditions:
+        return True
+    for earlier in filings[:index]:
+        earlier_conditions = conditions_of(earlier)
+        if earlier_conditions and all(
+            any(implies(condition, needed) for condition in conditions)
+            for needed in earlier_conditions
+        ):
+            return True
+    return False
+
+
+def same_outcome(first: Filing, second: Filing) -> bool:
+    """ true if both rules produce the same metadata """
+    return (first.classification, first.entity, first.extra_info) == (
+        second.classification,
+        second.entity,
+        second.extra_info,
+    )
+
+
+def evaluation_order(filings: List[Filing], hits: Dict[str, int]) -> List[int]:
+    """positions of the rules in the order they should be tried: most hits first,
+    as long as every rule stays behind the earlier rules it can conflict with"""
+    never_first = [shadowed(filings, index) for index in range(len(filings))]
+    blockers = [
+        {
+            earlier
+            for earlier in range(index)
+            if not never_first[earlier]
+            and not same_outcome(filings[earlier], filings[index])
+        }
+        for index in range(len(filings))
+    ]
+    order = []
+    remaining = set(range(len(filings)))
+    while remaining:
+        available = [index for index in remaining if not blockers[index] & remaining]
+        chosen = min(
+            available, key=lambda index: (-hits.get(rule_key(filings[index]), 0), index)
+        )
+        order.append(chosen)
+        remaining.remove(chosen)
+    return order
+
+
+@dataclass
+class AdaptiveFiling(Filing):
+    """A filing that checks its conditions in the learned order and keeps
+    count of its evaluations, hits and which conditions fail"""
+
+    original: Optional[Filing] = None
+    statistics: Optional[dict] = None
+    rules: Optional["AdaptiveRules"] = None
+
+    def applies(self, lines):
+        """ checks if the conditions for this filing action apply """
+        self.statistics["evaluations"] += 1
+        failures = self.statistics["conditions"]
+        for condition in conditions_of(self):
+            if not find_containing(lines, condition):
+                key = condition_key(condition)
+                failures[key] = failures.get(key, 0) + 1
+                return False
+        if not self.must_contain:
+            return False
+        self.statistics["hits"] += 1
+        self.rules.decided()
+        return True
+
+
+class AdaptiveRules:
+    """Replaces the simple_mappings of the given bank parsers with an adaptive
+    order while installed. The statistics are loaded from and saved to a JSON
+    file so the order learned is kept between runs"""
+
+    def __init__(self, state_file: str, bank_parsers: list):
+        self.state_file = state_file
+        self.parser_classes = [type(parser) for parser in bank_parsers]
+        self.originals: Dict[type, List[Filing]] = {}
+        self.statistics: Dict[str, Dict[str, dict]] = {}
+        self.decisions = 0
+        if os.path.exists(state_file):
+            with open(state_file) as state:
+                self.statistics = json.load(state)
+
+    def _rule_statistics(self, parser_class, filing: Filing) -> dict:
+        bank = self.statistics.setdefault(parser_class.bank.value, {})
+        return bank.setdefault(
+            rule_key(filing), {"evaluations": 0, "hits": 0, "conditions": {}}
+        )
+
+    def _adaptive(self, parser_class, filing: Filing) -> AdaptiveFiling:
+        statistics = self._rule_statistics(parser_class, filing)
+        failures = statistics["conditions"]
+        must_contain = filing.must_contain
+        if isinstance(must_contain, list):
+            must_contain = sorted(
+                must_contain,
+                key=lambda condition: -failures.get(condition_key(condition), 0),
+            )
+        return AdaptiveFiling(
+            must_contain,
+            filing.classification,
+            filing.entity,
+            filing.extra_info,
+            original=filing,
+            statistics=statistics,
+            rules=self,
+        )
+
+    def reorder(self):
+        """sorts again the rules of every bank with the statistics so far"""
+        for parser_class, filings in self.originals.items():
+            hits = {
+                key: statistics["hits"]
+                for key, statistics in self.statistics.get(
+                    parser_class.bank.value, {}
+                ).items()
+            }
+            parser_class.simple_mappings = [
+                self._adaptive(parser_class, filings[index])
+                for index in evaluation_order(filings, hits)
+            ]
+
+    def decided(self):
+        """called when a rule matches, reorders every REORDER_EVERY of them"""
+        self.decisions += 1
+        if self.decisions % REORDER_EVERY == 0:
+            self.reorder()
+
+    def install(self):
+        """starts evaluating the rules in adaptive order"""
+        for parser_class in self.parser_classes:
+            self.originals[parser_class] = parser_class.simple_mappings
+        self.reorder()
+
+    def uninstall(self):
+        """restores the written order and saves the statistics"""
+        for parser_class, filings in self.originals.items():
+            parser_class.simple_mappings = filings
+        self.originals = {}
+        with open(self.state_file, "w") as state:
+            json.dump(self.statistics, state, indent=1, ensure_ascii=False)
+
+    def __enter__(self):
+        self.install()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.uninstall()
@@ -0,0 +1,134 @@
+"""
+Tables of Adjustments, loaded from JSON or TOML files so new payees don't need
+code changes. A table is compiled once into an index so only the adjustments
+that can apply to an entity are checked, and the adjustment chosen for every
+entity and extra_info pair is remembered.
+
+An adjustment applies when its entity strings are contained anywhere in the
+entity of the document, not only as whole words, so the index is keyed on
+character grams: a string contained in the entity has all its grams among the
+grams of the entity.
+"""
+
+import json
+from typing import Dict, List, Optional, Set, Tuple
+
+from parsing.metadata import Adjustment, DocumentMetadata
+
+try:
+    import tomllib
+except ImportError:  # before python 3.11
+    tomllib = None
+
+GRAM_LENGTH = 4
+
+FIELDS = ["entity", "extra_info", "new_entity", "new_extra_info"]
+
+
+def grams(text: str) -> Set[str]:
+    """ all the substrings of GRAM_LENGTH characters """
+    return {
+        text[start : start + GRAM_LENGTH]
+        for start in range(len(text) - GRAM_LENGTH + 1)
+    }
+
+
+def load_adjustments(path: str) -> List[Adjustment]:
+    """Adjustments in a JSON file (a list of objects) or a TOML file (an array
+    of [[adjustment]] tables), with the fields of Adjustment. entity and
+    extra_info can be a string or a list of strings that must all be found"""
+    if path.endswith(".toml"):
+        if tomllib is None:
+            raise Exception(f"TOML needs python 3.11 or later, use JSON for {path}")
+        with open(path, "rb") as table_file:
+            entries = tomllib.load(table_file).get("adjustment", [])
+    else:
+        with open(path, encoding="utf-8") as table_file:
+            entries = json.load(table_file)
+    adjustments = []
+    for entry in entries:
+        unknown = set(entry) - set(FIELDS)
+        if unknown:
+            raise Exception(f"unknown fields {sorted(unknown)} in {path}: {entry}")
+        adjustments.append(Adjustment(**entry))
+    return adjustments
+
+
+class AdjustmentTable:
+    """Adjustments tried in order, the first one that applies wins"""
+
+    def __init__(self, adjustments: List[Adjustment]):
+        self.adjustments: List[Adjustment] = []
+        self.index: Dict[str, List[int]] = {}
+        self.always: List[int] = []
+        self.chosen: Dict[Tuple[str, object], Optional[int]] = {}
+        self.add_first(adjustments)
+
+    @classmethod
+    def load(cls, *paths: str) -> "AdjustmentTable":
+        """ table with the adjustments of the given files, in order """
+        adjustments = []
+        for path in paths:
+            adjustments.extend(load_adjustments(path))
+        return cls(adjustments)
+
+    def add_first(self, adjustments: List[Adjustment]):
+        """adds adjustments to be tried before the ones in the table"""
+        self.adjustments = list(adjustments) + self.adjustments
+        self._compile()
+
+    def _compile(self):
+        literals = []
+        for adjustment in self.adjustments:
+            entity = adjustment.entity
+            literals.append(entity if isinstance(entity, list) else [entity])
+
+        # keyed on the rarest gram of each adjustment, so few share a key
+        frequency: Dict[str, int] = {}
+        for strings in literals:
+            for gram in set().union(*(grams(text or "") for text in strings)):
+                frequency[gram] = frequency.get(gram, 0) + 1
+
+        self.index = {}
+        self.always = []
+        self.chosen = {}
+        for position, (adjustment, strings) in enumerate(
+            zip(self.adjustments, literals)
+        ):
+            if not adjustment.entity:
+                # never applies
+                continue
+            keys = set().union(*(grams(text) for text in strings))
+            if not keys:
+                # too short to have a gram, checked for every entity
+                self.always.append(position)
+                continue
+            key = min(keys, key=lambda gram: (frequency[gram], gram))
+            self.index.setdefault(key, []).append(position)
+
+    def candidates(self, entity: str) -> List[int]:
+        """positions of the adjustments that may apply to an entity, in order"""
+        positions = set(self.always)
+        for gram in grams(entity):
+            positions.update(self.index.get(gram, []))
+        return sorted(positions)
+
+    def adjust(self, metadata: DocumentMetadata) -> bool:
+        """modifies in-place the metadata with the first adjustment that
+        applies, returns if there was one"""
+        key = (metadata.entity, _hashable(metadata.extra_info))
+        if key not in self.chosen:
+            self.chosen[key] = None
+            for position in self.candidates(metadata.entity):
+                if self.adjustments[position].adjust(metadata):
+                    self.chosen[key] = position
+                    return True
+            return False
+        position = self.chosen[key]
+        if position is None:
+            return False
+        return self.adjustments[position].adjust(metadata)
+
+
+def _hashable(value):
+    return tuple(value) if isinstance(value, list) else value
@@ -0,0 +1,99 @@
+"""
+Date extraction shared by the bank parsers. The known date regexes of a bank
+are compiled into a single alternation that is searched once per line, instead
+of matching every regex (each one starting with a backtracking ".*") against
+every line. Lines that don't contain any of the literals a date needs (month
+names, separators) are skipped before running the regex at all.
+
+The alternation only tells which lines can't have a date: it finds the first
+occurrence of any of the regexes, while the regexes themselves take the last
+one (the leading ".*" is greedy) and have a priority. The lines it finds
+something in are matched with the regexes as they are, in their order.
+"""
+
+import re
+from typing import Callable, List, Optional
+
+# also found in the full month names, "Jan" in "January"
+MONTH_ABBREVIATIONS = [
+    "Jan",
+    "Feb",
+    "Mar",
+    "Apr",
+    "May",
+    "Jun",
+    "Jul",
+    "Aug",
+    "Sep",
+    "Oct",
+    "Nov",
+    "Dec",
+]
+
+# the regexes are written to be used with match(), a search doesn't need these
+LEADING_ANY = ".*"
+TRAILING_ANY = ".*"
+
+
+def _inline_flags(flags: int) -> str:
+    return ("s" if flags & re.DOTALL else "") + ("m" if flags & re.MULTILINE else "")
+
+
+def _alternative(number: int, regex) -> str:
+    """the regex as an alternative of the combined one, with its own flags and
+    its date group renamed so the names don't clash"""
+    pattern = regex.pattern
+    if pattern.startswith(LEADING_ANY):
+        pattern = pattern[len(LEADING_ANY) :]
+    else:
+        # match() only looks at the start of the text
+        pattern = r"\A(?:" + pattern + ")"
+    if pattern.endswith(TRAILING_ANY) and not pattern.endswith("\\" + TRAILING_ANY):
+        pattern = pattern[: -len(TRAILING_ANY)]
+    pattern = pattern.replace("(?P<date>", f"(?P<date{number}>")
+    flags = _inline_flags(regex.flags)
+    return f"(?{flags}:{pattern})" if flags else f"(?:{pattern})"
+
+
+class DateEngine:
+    """Finds the first date in a list of lines given the regexes of a bank
+    (each one with a group named "date") and the function that parses the
+    text of that group. Only lines with at least one of the needs_any literals
+    are searched"""
+
+    def __init__(
+        self,
+        regexes: list,
+        parse: Callable[[str], object],
+        needs_any: Optional[List[str]] = None,
+    ):
+        self.parse = parse
+        self.needs_any = needs_any
+        self.regexes = regexes
+        self.regex = re.compile(
+            "|".join(
+                _alternative(number, regex) for number, regex in enumerate(regexes)
+            )
+        )
+        self.prefilter = (
+            re.compile("|".join(re.escape(literal) for literal in needs_any))
+            if needs_any
+            else None
+        )
+
+    def find_date(self, lines: List[str]):
+        """the first date found, in document order, or None"""
+        for line in lines:
+            if self.prefilter and not self.prefilter.search(line):
+                continue
+            if not self.regex.search(line):
+                continue
+            try:
+                for date_regex in self.regexes:
+                    matches = date_regex.match(line)
+                    if matches:
+                        return self.parse(matches.group("date"))
+            except ValueError:
+                # a date that does not parse skips the line, as it always did
+                pass
+        return None
@@ -0,0 +1,147 @@
+"""
+Opt-in instrumentation of the classification rules: how many times each
+Filing, Adjustment, bank process and find_date function is evaluated, how
+many times it matches and how long it takes in total. Nothing is measured
+unless installed, the functions are wrapped at install time and restored
+afterwards.
+"""
+
+import functools
+import json
+import sys
+from dataclasses import asdict, dataclass
+from time import perf_counter
+from typing import Callable, Dict, List, Tuple
+
+from parsing.metadata import Adjustment, Filing
+
+
+@dataclass
+class RuleCounter:
+    """ Measurements of a single rule or function """
+
+    evaluations: int = 0
+    hits: int = 0
+    seconds: float = 0.0
+
+
+class Instrumentation:
+    """Counters for the rules of a set of bank parsers"""
+
+    def __init__(self):
+        self.counters: Dict[str, RuleCounter] = {}
+        self.originals: List[Tuple[object, str, Callable]] = []
+        self.filing_labels: Dict[int, str] = {}
+
+    def counter(self, label: str) -> RuleCounter:
+        """ the counter for a label, created empty if needed """
+        if label not in self.counters:
+            self.counters[label] = RuleCounter()
+        return self.counters[label]
+
+    def _wrap(self, owner, name: str, label_of: Callable[..., str]):
+        """replaces owner.name with a version that counts its calls"""
+        original = getattr(owner, name)
+        counter = self.counter
+
+        @functools.wraps(original)
+        def measured(*args, **kwargs):
+            start = perf_counter()
+            result = None
+            try:
+                result = original(*args, **kwargs)
+                return result
+            finally:
+                measurement = counter(label_of(*args))
+                measurement.evaluations += 1
+                measurement.seconds += perf_counter() - start
+                if result:
+                    measurement.hits += 1
+
+        setattr(owner, name, measured)
+        self.originals.append((owner, name, original))
+
+    def install(self, bank_parsers: list):
+        """starts measuring the rules of the given parsers"""
+        for parser in bank_parsers:
+            bank = parser.bank.value
+            for index, filing in enumerate(parser.simple_mappings):
+                label = (
+                    f"{bank} rule {index:02} {filing.classification.value}"
+                    f" {filing.entity} {filing.extra_info}".strip()
+                )
+                self.filing_labels[id(filing)] = label
+                # so rules that are never reached show up in the report
+                self.counter(label)
+
+            parser_class = type(parser)
+            self._wrap(parser_class, "process", lambda *_, bank=bank: f"{bank} process")
+            module = sys.modules[parser_class.__module__]
+            for function in ["find_date", "parse_free_text_date"]:
+                if hasattr(module, function):
+                    self._wrap(
+                        module,
+                        function,
+                        lambda *_, name=f"{bank} {function}": name,
+                    )
+
+        # subclasses with their own evaluation (like the adaptive ones) too
+        for filing_class in [Filing] + Filing.__subclasses__():
+            if "applies" in vars(filing_class):
+                self._wrap(filing_class, "applies", self._filing_label)
+        self._wrap(Adjustment, "adjust", self._adjustment_label)
+
+    def _filing_label(self, filing: Filing, *_):
+        original = getattr(filing, "original", None) or filing
+        return self.filing_labels.get(id(original), f"rule {filing.must_contain}")
+
+    @staticmethod
+    def _adjustment_label(adjustment: Adjustment, *_):
+        # adjustments can come from several tables, they are told apart by contents
+        return f"adjustment {adjustment.entity} {adjustment.extra_info}"
+
+    def uninstall(self):
+        """restores the original functions"""
+        for owner, name, original in reversed(self.originals):
+            setattr(owner, name, original)
+        self.originals = []
+
+    def report(self, top: int = 10) -> str:
+        """ranking of the rules evaluated most often, of the ones that take the
+        most time and list of the ones that never match"""
+        counters = list(self.counters.items())
+        hottest = sorted(counters, key=lambda item: -item[1].evaluations)[:top]
+        slowest = sorted(counters, key=lambda item: -item[1].seconds)[:top]
+
+        lines = ["===== Most evaluated"]
+        for label, counter in hottest:
+            lines.append(
+                f"{counter.evaluations:>8} evaluations {counter.hits:>6} hits  {label}"
+            )
+        lines.append("===== Slowest (total time)")
+        for label, counter in slowest:
+            average = counter.seconds / max(counter.evaluations, 1) * 1000
+            lines.append(
+                f"{counter.seconds:>8.3f}s total {average:>8.3f}ms average  {label}"
+            )
+        lines.append("===== Never matching")
+        for label, counter in sorted(counters):
+            if not counter.hits:
+                lines.append(f"{counter.evaluations:>8} evaluations  {label}")
+        return "\n".join(lines)
+
+    def save(self, file_name: str):
+        """writes all the counters as JSON"""
+        with open(file_name, "w") as output:
+            json.dump(
+                {label: asdict(counter) for label, counter in self.counters.items()},
+                output,
+                indent=2,
+                sort_keys=True,
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.uninstall()
@@ -0,0 +1,118 @@
+"""
+Text of the layout pdfminer produces for every page. Each text box (or loose
+character) becomes a line of text, in the order they are in the layout.
+
+The layout tree is walked with a stack of iterators instead of recursion, the
+kind of every element is looked up by its type in a table (filled the first
+time a type is seen) instead of isinstance checks against lists of classes,
+and the whitespace clean up only runs when there is whitespace to clean. The
+text of a text box is joined from its characters in one go, pdfminer's
+get_text() goes through a generator and type checks for every character.
+"""
+
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from pdfminer.layout import (
+    LTAnno,
+    LTChar,
+    LTComponent,
+    LTContainer,
+    LTCurve,
+    LTImage,
+    LTLine,
+    LTRect,
+    LTTextBoxHorizontal,
+    LTTextBoxVertical,
+)
+
+TEXT_BOX = "text box"
+TEXT = "text"
+CONTAINER = "container"
+IGNORED = "ignored"
+
+# checked in this order, text boxes are containers too
+KINDS = [
+    (TEXT_BOX, (LTTextBoxHorizontal, LTTextBoxVertical)),
+    (TEXT, (LTChar, LTAnno)),
+    (CONTAINER, (LTContainer,)),
+    (IGNORED, (LTImage, LTRect, LTLine, LTCurve)),
+]
+
+_kinds: Dict[type, str] = {}
+
+BLANK_LINES = re.compile(r"(\n\n)+")
+
+
+@dataclass
+class TextLine:
+    """A line of text, the page it is in (from 1) and its bounding box (x0,
+    y0, x1, y1), None for the spaces pdfminer adds between characters"""
+
+    text: str
+    page: int
+    bbox: Optional[Tuple[float, float, float, float]]
+
+
+def kind_of(element_type: type) -> str:
+    """ whether elements of a type are text, containers or ignored """
+    kind = _kinds.get(element_type)
+    if kind is None:
+        for kind, classes in KINDS:
+            if issubclass(element_type, classes):
+                break
+        else:
+            raise Exception(f"Type is {element_type}")
+        _kinds[element_type] = kind
+    return kind
+
+
+def clean_line(line: str) -> str:
+    """returns the given text with any excess whitespace and newlines
+    removed
+    """
+    # removing pairs of spaces left to right, like re.sub(r"(  )+", "", line)
+    if "  " in line:
+        line = line.replace("  ", "")
+    if "\n\n" in line:
+        line = BLANK_LINES.sub("\n", line)
+    return line.strip()
+
+
+def text_elements(page: LTComponent) -> List[Tuple[str, LTComponent]]:
+    """the elements of a page that are text, in layout order, with their
+    text as it is in the document"""
+    elements = []
+    kinds = _kinds
+    pending = [iter(page)]
+    while pending:
+        for element in pending[-1]:
+            kind = kinds.get(type(element)) or kind_of(type(element))
+            if kind == TEXT_BOX:
+                # boxes are made of text lines, and lines of characters
+                text = "".join([item.get_text() for line in element for item in line])
+                elements.append((text, element))
+            elif kind == TEXT:
+                elements.append((element.get_text(), element))
+            elif kind == CONTAINER:
+                pending.append(iter(element))
+                break
+        else:
+            pending.pop()
+    return elements
+
+
+def convert_to_lines(page: LTComponent) -> List[str]:
+    """converts a container form pdfminer into a set of lines of text"""
+    return [clean_line(text) for text, _ in text_elements(page)]
+
+
+def positioned_lines(pages) -> List[TextLine]:
+    """the lines of text of all the pages, like convert_to_lines, with the
+    page and bounding box of each one"""
+    return [
+        TextLine(clean_line(text), number, getattr(element, "bbox", None))
+        for number, page in enumerate(pages, 1)
+        for text, element in text_elements(page)
+    ]
@@ -0,0 +1,432 @@
+"""
+Transaction tables of account statements (DocType.MOVEMENTS and STATEMENT),
+rebuilt from the position of every line of text in the pages: lines at the
+same height make a row, and amounts are put in columns by their right edge,
+as numbers are right aligned. A row starting with a date (or following one,
+when the date is only shown on the first movement of the day) and with an
+amount is a movement, rows with only text continue the description of the
+previous one.
+
+Dates and amounts are found in the text one cell at a time, and converted in
+bulk: amounts, in European (1.234,56) or UK (1,234.56) format, always have two
+decimals, so the digits of the text are the amount in cents and are read from
+the bytes of all of them at once; dates are composed from arrays of days,
+months and years. Amounts are kept as integer cents so balances can be checked
+exactly.
+"""
+
+import csv
+import re
+from dataclasses import dataclass
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+import numpy as np
+from pdfminer.layout import LTChar, LTContainer, LTTextLine
+
+from parsing.dates import MONTH_ABBREVIATIONS
+from parsing.metadata import Bank, DocType, DocumentMetadata
+
+# the cells of a row are not always exactly aligned, their vertical centers
+# are within this many points
+ROW_TOLERANCE = 3.0
+# the right edges of the amounts of a column are within this many points
+COLUMN_TOLERANCE = 12.0
+
+EUROPEAN = "european"
+UK = "uk"
+NUMBER_FORMATS = {Bank.DEUTSCHE_BANK: EUROPEAN}
+
+LEDGER_TYPES = [DocType.MOVEMENTS, DocType.STATEMENT]
+
+# Deutsche Bank writes negative amounts with a minus sign (U+2212)
+MINUS = "\u2212"
+SIGN = rf"[-+{MINUS}]?"
+# overdrawn balances can end in D (first direct) or DR
+NEGATIVE_SUFFIX = rf"(?:\s?(?:-|{MINUS}|DR|CR|D))?"
+AMOUNT_REGEXES = {
+    EUROPEAN: re.compile(
+        rf"(?<!\S)[€£$]?\s?{SIGN}(?:\d{{1,3}}(?:\.\d{{3}})+|\d+),\d{{2}}"
+        rf"{NEGATIVE_SUFFIX}(?:\s?(?:€|EUR))?(?!\S)"
+    ),
+    UK: re.compile(
+        rf"(?<!\S)[€£$]?\s?{SIGN}(?:\d{{1,3}}(?:,\d{{3}})+|\d+)\.\d{{2}}"
+        rf"{NEGATIVE_SUFFIX}(?!\S)"
+    ),
+}
+
+MONTHS = {name.lower(): number for number, name in enumerate(MONTH_ABBREVIATIONS, 1)}
+DATE = re.compile(
+    r"(?P<day>\d{1,2})[./-](?P<month>\d{1,2})(?:[./-](?P<year>\d{4}|\d{2}))?(?!\d)"
+    r"|(?P<text_day>\d{1,2})\s?(?P<text_month>"
+    + "|".join(MONTH_ABBREVIATIONS)
+    + r")[a-z]*\.?(?:\s?(?P<text_year>\d{4}|\d{2})(?!\d))?",
+    re.IGNORECASE,
+)
+
+
+@dataclass
+class Cell:
+    """ A line of text of a page and where it is """
+
+    page: int
+    x0: float
+    x1: float
+    y: float
+    text: str
+    line: Optional[LTTextLine] = None
+
+
+@dataclass
+class Ledger:
+    """The movements of a statement in the order they happened, one array per
+    column. Amounts and balances are in cents, negative for money going out;
+    has_balance tells the rows that show the balance after them"""
+
+    dates: np.ndarray
+    descriptions: List[str]
+    amounts: np.ndarray
+    balances: np.ndarray
+    has_balance: np.ndarray
+    pages: np.ndarray
+
+    def __len__(self):
+        return len(self.amounts)
+
+    def totals(self) -> Tuple[int, int]:
+        """ money in and money out, in cents """
+        return (
+            int(self.amounts[self.amounts > 0].sum()),
+            int(-self.amounts[self.amounts < 0].sum()),
+        )
+
+    def balance_errors(self) -> Tuple[int, np.ndarray]:
+        """number of balances checked and the rows whose balance isn't the
+        previous balance shown plus the movements since"""
+        shown = np.flatnonzero(self.has_balance)
+        if len(shown) < 2:
+            return 0, np.array([], dtype=np.int64)
+        running = np.cumsum(self.amounts)
+        expected = self.balances[shown[:-1]] + running[shown[1:]] - running[shown[:-1]]
+        wrong = expected != self.balances[shown[1:]]
+        return len(shown) - 1, shown[1:][wrong]
+
+    def to_csv(self, path: str, document: str = ""):
+        """ appends the movements to a CSV file, with the document they are from """
+        with open(path, "a", newline="", encoding="utf-8") as output:
+            writer = csv.writer(output)
+            for row in range(len(self)):
+                writer.writerow(
+                    [
+                        document,
+                        str(self.dates[row]) if not np.isnat(self.dates[row]) else "",
+                        self.descriptions[row],
+                        f"{self.amounts[row] / 100:.2f}",
+                        (
+                            f"{self.balances[row] / 100:.2f}"
+                            if self.has_balance[row]
+                            else ""
+                        ),
+                    ]
+                )
+
+
+CSV_HEADER = ["document", "date", "description", "amount", "balance"]
+
+
+def text_cells(pages) -> List[Cell]:
+    """the lines of text of all the pages, walking the layout without
+    recursion. The text is as in the document, only stripped"""
+    cells = []
+    for page_number, page in enumerate(pages, 1):
+        pending = [page]
+        while pending:
+            element = pending.pop()
+            if isinstance(element, LTTextLine):
+                text = element.get_text().strip()
+                if text:
+                    cells.append(
+                        Cell(
+                            page_number,
+                            element.x0,
+                            element.x1,
+                            (element.y0 + element.y1) / 2,
+                            text,
+                            element,
+                        )
+                    )
+            elif isinstance(element, LTContainer):
+                pending.extend(element)
+    return cells
+
+
+def group_rows(cells: List[Cell]) -> List[List[Cell]]:
+    """cells at the same height of the same page, top to bottom and each row
+    left to right"""
+    if not cells:
+        return []
+    pages = np.array([cell.page for cell in cells])
+    heights = np.array([cell.y for cell in cells])
+    order = np.lexsort((-heights, pages))
+    new_row = np.empty(len(cells), dtype=bool)
+    new_row[0] = True
+    new_row[1:] = (np.diff(pages[order]) != 0) | (
+        -np.diff(heights[order]) > ROW_TOLERANCE
+    )
+    starts = np.flatnonzero(new_row)
+    ends = np.append(starts[1:], len(cells))
+    return [
+        sorted((cells[index] for index in order[start:end]), key=lambda c: c.x0)
+        for start, end in zip(starts, ends)
+    ]
+
+
+def _right_edges(cell: Cell) -> List[float]:
+    """right edge of every character of the text of a cell, spaces take the
+    edge of the character before them. Empty if the characters are unknown"""
+    if cell.line is None:
+        return []
+    edges = []
+    last = cell.x0
+    for item in cell.line:
+        if isinstance(item, LTChar):
+            last = item.x1
+        edges.extend([last] * len(item.get_text()))
+    # the text of the cell was stripped
+    full_text = cell.line.get_text()
+    leading = len(full_text) - len(full_text.lstrip())
+    return edges[leading : leading + len(cell.text)]
+
+
+def split_amounts(cell: Cell, amount_regex) -> Tuple[str, List[Tuple[str, float]]]:
+    """the text of a cell without its amounts, and the amounts with their
+    right edge. Cells that are just an amount don't need to look at the
+    characters"""
+    if amount_regex.fullmatch(cell.text):
+        return "", [(cell.text, cell.x1)]
+    matches = list(amount_regex.finditer(cell.text))
+    if not matches:
+        return cell.text, []
+    edges = _right_edges(cell)
+    amounts = [
+        (match.group().strip(), edges[match.end() - 1] if edges else cell.x1)
+        for match in matches
+    ]
+    text = amount_regex.sub("", cell.text)
+    return " ".join(text.split()), amounts
+
+
+def parse_amounts(texts: List[str]) -> np.ndarray:
+    """amounts in cents, from texts with exactly two decimals: the digits are
+    taken from the bytes of all the texts at once, whatever the separators"""
+    if not texts:
+        return np.array([], dtype=np.int64)
+    raw = np.array(
+        [text.replace(MINUS, "-").encode("ascii", "ignore") for text in texts]
+    )
+    width = raw.dtype.itemsize
+    codes = raw.view(np.uint8).reshape(len(raw), width)
+    digits = (codes >= ord("0")) & (codes <= ord("9"))
+    # number of digits to the right of every position
+    to_the_right = np.cumsum(digits[:, ::-1], axis=1)[:, ::-1] - digits
+    values = np.where(
+        digits,
+        (codes.astype(np.int64) - ord("0")) * 10 ** to_the_right.astype(np.int64),
+        0,
+    ).sum(axis=1)
+    negative = (
+        (codes == ord("-")).any(axis=1)
+        | np.char.endswith(raw, b"DR")
+        | np.char.endswith(raw, b"D")
+    )
+    return np.where(negative, -values, values)
+
+
+def parse_dates(days: np.ndarray, months: np.ndarray, years: np.ndarray) -> np.ndarray:
+    """dates from arrays of their parts, NaT where the day doesn't exist in
+    the month or the year is unknown (0)"""
+    dates = (years - 1970).astype("datetime64[Y]") + (months - 1).astype(
+        "timedelta64[M]"
+    )
+    dates = dates.astype("datetime64[D]") + (days - 1).astype("timedelta64[D]")
+    # an impossible day, like 31/02, ends in the next month
+    month_of_date = dates.astype("datetime64[M]").astype(np.int64) % 12 + 1
+    valid = (years > 0) & (days >= 1) & (month_of_date == months)
+    return np.where(valid, dates, np.datetime64("NaT"))
+
+
+def _date_parts(match) -> Tuple[int, int, Optional[str]]:
+    if match.group("day"):
+        return int(match.group("day")), int(match.group("month")), match.group("year")
+    month = MONTHS[match.group("text_month")[:3].lower()]
+    return int(match.group("text_day")), month, match.group("text_year")
+
+
+@dataclass
+class _Movement:
+    page: int
+    date: Optional[Tuple[int, int, Optional[str]]]
+    description: List[str]
+    description_x0: float
+    amounts: List[Tuple[str, float]]
+
+
+def _movements(rows: List[List[Cell]], amount_regex) -> List[_Movement]:
+    movements = []
+    seen_date = False
+    for row in rows:
+        first = row[0]
+        date_match = DATE.match(first.text)
+        if date_match:
+            # the rest of the first cell, and any other date (eg value date)
+            rest = first.text[date_match.end() :].strip()
+            cells = (
+                [Cell(first.page, first.x0, first.x1, first.y, rest)] if rest else []
+            )
+            cells += [
+                cell
+                for cell in row[1:]
+                if amount_regex.fullmatch(cell.text) or not DATE.fullmatch(cell.text)
+            ]
+        else:
+            cells = row
+        description = []
+        description_x0 = None
+        amounts = []
+        for cell in cells:
+            text, cell_amounts = split_amounts(cell, amount_regex)
+            if text:
+                description.append(text)
+                if description_x0 is None:
+                    description_x0 = cell.x0
+            amounts += cell_amounts
+
+        if date_match and amounts:
+            seen_date = True
+            movements.append(
+                _Movement(
+                    first.page,
+                    _date_parts(date_match),
+                    description,
+                    description_x0 or first.x1,
+                    amounts,
+                )
+            )
+        elif seen_date and amounts:
+            # the date is only shown on the first movement of the day
+            movements.append(
+                _Movement(
+                    first.page, None, description, description_x0 or first.x0, amounts
+                )
+            )
+        elif (
+            movements
+            and not amounts
+            and not date_match
+            and movements[-1].page == first.page
+            and first.x0 >= movements[-1].description_x0 - COLUMN_TOLERANCE
+        ):
+            movements[-1].description += description
+    return movements
+
+
+def _columns(edges: np.ndarray) -> np.ndarray:
+    """the column of every amount, from 0 for the leftmost one, grouping the
+    right edges that are close"""
+    distinct = np.unique(edges)
+    starts = distinct[np.append(True, np.diff(distinct) > COLUMN_TOLERANCE)]
+    return np.searchsorted(starts, edges, side="right") - 1
+
+
+def build_ledger(
+    movements: List[_Movement], reference_date: Optional[datetime] = None
+) -> Ledger:
+    """the ledger of the movements found. Amounts are in the columns found:
+    one column of signed amounts, signed amounts and balance, or (the last
+    three) money out, money in and balance. Dates without year take it from
+    the reference date, the end of the statement"""
+    count = len(movements)
+    if not count:
+        return Ledger(
+            np.array([], dtype="datetime64[D]"),
+            [],
+            np.array([], dtype=np.int64),
+            np.array([], dtype=np.int64),
+            np.array([], dtype=bool),
+            np.array([], dtype=np.int32),
+        )
+    texts = [text for movement in movements for text, _ in movement.amounts]
+    edges = np.array([edge for movement in movements for _, edge in movement.amounts])
+    rows = np.repeat(
+        np.arange(count), [len(movement.amounts) for movement in movements]
+    )
+    values = parse_amounts(texts)
+    columns = _columns(edges)
+    column_count = int(columns.max()) + 1
+
+    amounts = np.zeros(count, dtype=np.int64)
+    balances = np.zeros(count, dtype=np.int64)
+    has_balance = np.zeros(count, dtype=bool)
+    if column_count == 1:
+        np.add.at(amounts, rows, values)
+    else:
+        balance_column = column_count - 1
+        is_balance = columns == balance_column
+        balances[rows[is_balance]] = values[is_balance]
+        has_balance[rows[is_balance]] = True
+        if column_count >= 3:
+            paid_out = columns == column_count - 3
+            paid_in = columns == column_count - 2
+            np.add.at(amounts, rows[paid_out], -np.abs(values[paid_out]))
+            np.add.at(amounts, rows[paid_in], np.abs(values[paid_in]))
+        else:
+            np.add.at(amounts, rows[~is_balance], values[~is_balance])
+
+    # dates, the ones not shown are the ones of the previous movement
+    shown = np.array([movement.date is not None for movement in movements])
+    parts = [movement.date or (0, 0, None) for movement in movements]
+    days = np.array([day for day, _, _ in parts], dtype=np.int64)
+    months = np.array([month for _, month, _ in parts], dtype=np.int64)
+    years = np.array([int(year) if year else 0 for _, _, year in parts])
+    years = np.where((years > 0) & (years < 100), years + 2000, years)
+    if reference_date:
+        # a statement ending in January has the December movements of the year before
+        without_year = shown & (years == 0)
+        years[without_year] = np.where(
+            months[without_year] > reference_date.month,
+            reference_date.year - 1,
+            reference_date.year,
+        )
+    dates = parse_dates(days, months, years)
+    last_shown = np.maximum.accumulate(np.where(shown, np.arange(count), 0))
+    dates = dates[last_shown]
+
+    pages = np.array([movement.page for movement in movements], dtype=np.int32)
+    descriptions = [" ".join(movement.description) for movement in movements]
+    ledger = Ledger(dates, descriptions, amounts, balances, has_balance, pages)
+    if count > 1 and dates[0] > dates[-1]:
+        # newest first, like some online extracts
+        ledger = Ledger(
+            dates[::-1],
+            descriptions[::-1],
+            amounts[::-1],
+            balances[::-1],
+            has_balance[::-1],
+            pages[::-1],
+        )
+    return ledger
+
+
+def has_ledger(metadata: Optional[DocumentMetadata]) -> bool:
+    """ true for the types of documents that list movements """
+    return bool(metadata) and metadata.classification in LEDGER_TYPES
+
+
+def extract_ledger(pages, metadata: Optional[DocumentMetadata] = None) -> Ledger:
+    """the movements of a statement, from the layout of its pages"""
+    number_format = NUMBER_FORMATS.get(metadata.bank if metadata else None, UK)
+    reference_date = None
+    if metadata:
+        reference_date = metadata.period_end_date or metadata.period_start_date
+    rows = group_rows(text_cells(pages))
+    return build_ledger(_movements(rows, AMOUNT_REGEXES[number_format]), reference_date)
@@ -0,0 +1,195 @@
+"""
+Opt-in memory accounting of every document classified: the peak RSS of the
+process while the document is parsed and, with tracemalloc, the peak of the
+memory allocated by Python in each phase (laying out the pages with pdfminer,
+converting the layouts to lines, analysing the lines) and where the memory
+held at the end of the phase was allocated. Like the instrumentation of the
+rules, the functions are wrapped at install time and restored afterwards.
+
+The peak RSS of a document is only its own on Linux, where the peak of the
+process can be reset between documents; elsewhere it is the peak so far.
+"""
+
+import functools
+import json
+import resource
+import sys
+import tracemalloc
+from dataclasses import asdict, dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+from pdfminer.pdfinterp import PDFPageInterpreter
+
+EXTRACT = "extract"
+CONVERT = "convert"
+ANALYSE = "analyse"
+PHASES = [EXTRACT, CONVERT, ANALYSE]
+
+MB = 1024 * 1024
+
+# frames kept by tracemalloc for every allocation
+FRAMES = 1
+
+
+@dataclass
+class DocumentMemory:
+    """ Memory used by a document, in bytes """
+
+    path: str
+    peak_rss: int = 0
+    # peak allocated above what was allocated when the phase started
+    peaks: Dict[str, int] = field(default_factory=dict)
+    # sites of the memory held at the end of a phase, when most was held
+    sites: Dict[str, List[Tuple[str, int]]] = field(default_factory=dict)
+
+
+def reset_peak_rss() -> bool:
+    """makes the peak RSS of the process the current RSS, where possible"""
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss() -> int:
+    """ the peak RSS of the process, in bytes """
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # kilobytes in Linux, bytes in macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class MemoryAccounting:
+    """Memory used by every document, see install"""
+
+    def __init__(self, top: int = 10):
+        self.top = top
+        self.documents: List[DocumentMemory] = []
+        self.current: Optional[DocumentMemory] = None
+        self.originals: List[Tuple[object, str, Callable]] = []
+        # what was allocated when the document started and the most held at
+        # the end of each phase, to take snapshots only when there is more
+        self.start_snapshot: Optional[tracemalloc.Snapshot] = None
+        self.held: Dict[str, int] = {}
+
+    def _wrap(self, owner, name: str, measure: Callable):
+        original = getattr(owner, name)
+
+        @functools.wraps(original)
+        def measured(*args, **kwargs):
+            return measure(original, *args, **kwargs)
+
+        setattr(owner, name, measured)
+        self.originals.append((owner, name, original))
+
+    def install(self, classify_module):
+        """starts measuring the documents parsed with parse_document in the
+        given module (classify, or __main__ when it runs as a script)"""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(FRAMES)
+        self._wrap(classify_module, "parse_document", self._document)
+        self._wrap(PDFPageInterpreter, "process_page", self._phase(EXTRACT))
+        self._wrap(classify_module, "convert_to_lines", self._phase(CONVERT))
+        self._wrap(classify_module, "analyse", self._phase(ANALYSE))
+
+    def uninstall(self):
+        """restores the original functions and stops tracing"""
+        for owner, name, original in reversed(self.originals):
+            setattr(owner, name, original)
+        self.originals = []
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def _document(self, original, pdf_file, *args, **kwargs):
+        self.current = DocumentMemory(pdf_file)
+        self.held = {}
+        reset_peak_rss()
+        self.start_snapshot = tracemalloc.take_snapshot()
+        try:
+            return original(pdf_file, *args, **kwargs)
+        finally:
+            self.current.peak_rss = peak_rss()
+            self.documents.append(self.current)
+            self.current = None
+            self.start_snapshot = None
+
+    def _phase(self, phase: str) -> Callable:
+        def measure(original, *args, **kwargs):
+            document = self.current
+            if document is None:
+                return original(*args, **kwargs)
+            started, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                current, peak = tracemalloc.get_traced_memory()
+                document.peaks[phase] = max(
+                    document.peaks.get(phase, 0), peak - started
+                )
+                if current > self.held.get(phase, 0):
+                    self.held[phase] = current
+                    document.sites[phase] = self._sites()
+
+        return measure
+
+    def _sites(self) -> List[Tuple[str, int]]:
+        """where the memory allocated since the document started is, the
+        sites holding most first"""
+        differences = tracemalloc.take_snapshot().compare_to(
+            self.start_snapshot, "lineno"
+        )
+        held = [
+            (str(difference.traceback[0]), difference.size_diff)
+            for difference in differences
+            if difference.size_diff > 0
+        ]
+        return sorted(held, key=lambda site: -site[1])[: self.top]
+
+    def report(self) -> str:
+        """the documents with the highest peak RSS and the sites that held
+        most memory in any document"""
+        heaviest = sorted(self.documents, key=lambda document: -document.peak_rss)
+        lines = ["===== Memory: heaviest documents (peak RSS, peak allocated by phase)"]
+        for document in heaviest[: self.top]:
+            phases = "  ".join(
+                f"{phase} {document.peaks.get(phase, 0) / MB:7.1f} MB"
+                for phase in PHASES
+            )
+            lines.append(f"{document.peak_rss / MB:8.1f} MB  {phases}  {document.path}")
+
+        sites: Dict[Tuple[str, str], int] = {}
+        for document in self.documents:
+            for phase, held in document.sites.items():
+                for site, size in held:
+                    sites[phase, site] = max(sites.get((phase, site), 0), size)
+        lines.append("===== Memory: allocation sites (most held in a document)")
+        ranked = sorted(sites.items(), key=lambda item: -item[1])
+        for (phase, site), size in ranked[: self.top]:
+            lines.append(f"{size / MB:8.1f} MB  {phase:<8} {site}")
+        if heaviest:
+            lines.append(
+                f"===== Memory: {len(heaviest)} documents, the heaviest needed "
+                f"{heaviest[0].peak_rss / MB:.1f} MB"
+            )
+        return "\n".join(lines)
+
+    def save(self, file_name: str):
+        """writes the memory of every document as JSON, the heaviest first"""
+        documents = sorted(self.documents, key=lambda document: -document.peak_rss)
+        with open(file_name, "w") as output:
+            json.dump([asdict(document) for document in documents], output, indent=2)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.uninstall()
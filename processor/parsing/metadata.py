@@ -38,6 +38,14 @@ class DocType(Enum):
     INSURANCE = "seguros"
 
 
+class UnrecognisedDocument(Exception):
+    """ The document belongs to a known bank but none of its templates match """
+
+    def __init__(self, bank: Bank):
+        super().__init__("Documents seems to belong to bank but isn't recognised")
+        self.bank = bank
+
+
 @dataclass
 class DocumentMetadata:
     """ Metadata for a document once classified """
@@ -0,0 +1,97 @@
+"""
+Cache of the lines of text of pages already laid out. Statements end with the
+same terms and conditions or fee explanation pages, byte for byte, so their
+layout is done once: every page is identified by a digest of its content
+streams and the resources they use (fonts, images, forms, compared by value
+and not by object number, which changes from document to document), and a
+page seen before reuses its lines without being interpreted at all.
+"""
+
+import hashlib
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from pdfminer.pdfpage import PDFPage
+from pdfminer.pdftypes import PDFObjRef, PDFStream
+
+# pages kept, a page is a few KB of lines
+DEFAULT_SIZE = 1000
+
+# stands for an object while its own digest is computed, for cycles
+IN_PROGRESS = b"in progress"
+
+
+def object_digest(value, memo: Dict[int, bytes]) -> bytes:
+    """digest of a PDF object by value, following references. Objects are
+    digested once per document, memo keeps them by object number"""
+    if isinstance(value, PDFObjRef):
+        digest = memo.get(value.objid)
+        if digest is None:
+            memo[value.objid] = IN_PROGRESS
+            digest = memo[value.objid] = object_digest(value.resolve(), memo)
+        return digest
+
+    hasher = hashlib.sha1()
+    if isinstance(value, PDFStream):
+        hasher.update(b"stream")
+        hasher.update(object_digest(value.attrs, memo))
+        # streams already decoded (by an earlier page) only have their data
+        raw = value.get_rawdata()
+        hasher.update(b"raw" + raw if raw is not None else b"data" + value.get_data())
+    elif isinstance(value, dict):
+        hasher.update(b"dict")
+        for key in sorted(value, key=str):
+            hasher.update(str(key).encode("utf-8"))
+            hasher.update(object_digest(value[key], memo))
+    elif isinstance(value, (list, tuple)):
+        hasher.update(b"list")
+        for item in value:
+            hasher.update(object_digest(item, memo))
+    else:
+        hasher.update(repr(value).encode("utf-8"))
+    return hasher.digest()
+
+
+def page_digest(page: PDFPage, memo: Dict[int, bytes], settings: str = "") -> str:
+    """identifies the layout of a page: its contents, the resources they use,
+    its boxes and rotation, and the settings of the layout analysis"""
+    hasher = hashlib.sha1(settings.encode("utf-8"))
+    hasher.update(object_digest(page.contents, memo))
+    hasher.update(object_digest(page.resources, memo))
+    hasher.update(repr((page.mediabox, page.cropbox, page.rotate)).encode("utf-8"))
+    return hasher.hexdigest()
+
+
+class PageCache:
+    """Lines of the pages laid out, by page digest, the least recently used
+    are dropped. Counts hits and misses"""
+
+    def __init__(self, size: int = DEFAULT_SIZE):
+        self.size = size
+        self.pages: "OrderedDict[str, List[str]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, digest: str) -> Optional[List[str]]:
+        """ the lines of a page seen before, None if it wasn't """
+        lines = self.pages.get(digest)
+        if lines is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.pages.move_to_end(digest)
+        return lines
+
+    def put(self, digest: str, lines: List[str]):
+        """ keeps the lines of a page just laid out """
+        if not self.size:
+            return
+        self.pages[digest] = lines
+        if len(self.pages) > self.size:
+            self.pages.popitem(last=False)
+
+
+def report(hits: int, pages: int) -> str:
+    """ how many pages were reused """
+    share = hits / pages * 100 if pages else 0.0
+    return f"===== Page cache: {hits} of {pages} pages reused ({share:.1f}%)"
@@ -0,0 +1,105 @@
+"""
+Layout profiles: the settings of pdfminer's layout analysis used for the
+documents of each bank. The default lays out the text inside figures too
+(all_texts) and orders the text boxes of the page (boxes_flow), which is what
+costs most; banks whose documents classify the same without them can use a
+cheaper profile, found with the tuning harness (benchmarks.profiles).
+
+The bank of a document isn't known before its text is, so pages are laid out
+with the default profile until the lines found so far contain one of the
+markers of a bank (see banks.registry), and the rest with the profile of that
+bank.
+"""
+
+import json
+from dataclasses import asdict, dataclass, fields, replace
+from typing import Dict, List, Optional
+
+from pdfminer.layout import LAParams
+
+from banks.registry import BankPlugin
+from parsing.metadata import Bank
+
+
+@dataclass(frozen=True)
+class LayoutProfile:
+    """ Settings of the layout analysis, see pdfminer's LAParams """
+
+    line_overlap: float = 0.5
+    char_margin: float = 2.0
+    line_margin: float = 1.5
+    word_margin: float = 0.1
+    boxes_flow: Optional[float] = 0.5
+    detect_vertical: bool = False
+    all_texts: bool = True
+
+    def params(self) -> LAParams:
+        """ the LAParams of the profile """
+        return LAParams(**asdict(self))
+
+    def key(self) -> str:
+        """identifies the profile, for the page cache (LAParams' own repr
+        leaves some of the settings out)"""
+        return repr(self)
+
+    def changes(self) -> dict:
+        """ the settings that are not the default ones """
+        default = asdict(DEFAULT_PROFILE)
+        return {
+            name: value
+            for name, value in asdict(self).items()
+            if default[name] != value
+        }
+
+
+# what every document was laid out with before profiles
+DEFAULT_PROFILE = LayoutProfile()
+
+SETTINGS = [field.name for field in fields(LayoutProfile)]
+
+
+class LayoutProfiles:
+    """The profile of every bank that has one, the rest use the default"""
+
+    def __init__(self, profiles: Dict[Bank, LayoutProfile] = None):
+        self.profiles = dict(profiles or {})
+
+    def __bool__(self):
+        return bool(self.profiles)
+
+    def for_bank(self, bank: Optional[Bank]) -> LayoutProfile:
+        """ the profile of a bank """
+        return self.profiles.get(bank, DEFAULT_PROFILE)
+
+    @classmethod
+    def load(cls, path: str) -> "LayoutProfiles":
+        """profiles in a JSON file: an object with the settings that change for
+        every bank, by bank name, like {"db": {"all_texts": false}}"""
+        with open(path, encoding="utf-8") as profiles_file:
+            entries = json.load(profiles_file)
+        profiles = {}
+        for bank_name, changes in entries.items():
+            unknown = set(changes) - set(SETTINGS)
+            if unknown:
+                raise Exception(f"unknown settings {sorted(unknown)} in {path}")
+            profiles[Bank(bank_name)] = replace(DEFAULT_PROFILE, **changes)
+        return cls(profiles)
+
+    def save(self, path: str):
+        """ writes the profiles in the format load reads """
+        entries = {
+            bank.value: profile.changes()
+            for bank, profile in sorted(self.profiles.items(), key=lambda i: i[0].value)
+        }
+        with open(path, "w", encoding="utf-8") as profiles_file:
+            json.dump(entries, profiles_file, indent=4)
+            profiles_file.write("\n")
+
+
+def detect_bank(lines: List[str], plugins: List[BankPlugin]) -> Optional[Bank]:
+    """the first of the banks that claims a document with these lines, None if
+    none does. Their parsers are not needed"""
+    for plugin in plugins:
+        if plugin.claims(lines):
+            return plugin.bank
+    return None
@@ -0,0 +1,211 @@
+"""
+Streaming pipelines: items from a source go through a list of stages and end
+in a sink, every stage working on several items at the same time and each one
+with its own kind of concurrency: inline (in the event loop thread, for quick
+work and objects tied to a thread, like SQLite connections), threads (for
+blocking I/O) or processes (for CPU work). Stages are connected by bounded
+queues, so a fast source or stage waits for the slower ones downstream instead
+of piling up items in memory.
+
+    pipeline = Pipeline(
+        find_pdfs(folder),
+        [Stage("hash", hash_document, "thread", 4),
+         Stage("extract", extract_document, "process", 8)],
+        print,
+    )
+    pipeline.run()
+"""
+
+import asyncio
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Iterable, List, Optional, Tuple
+
+INLINE = "inline"
+THREAD = "thread"
+PROCESS = "process"
+KINDS = [INLINE, THREAD, PROCESS]
+
+# items waiting between two stages
+QUEUE_SIZE = 16
+
+# marks the end of the items in a queue
+DONE = None
+
+
+@dataclass
+class Stage:
+    """A step of a pipeline: function is applied to every item and returns the
+    item for the next stage, or None to drop it. Items for which applies() is
+    false go on unchanged. Process stages need functions and items that can be
+    pickled, and can prepare every process with initializer(*initargs)"""
+
+    name: str
+    function: Callable
+    kind: str = INLINE
+    workers: int = 1
+    applies: Optional[Callable] = None
+    initializer: Optional[Callable] = None
+    initargs: Tuple = ()
+
+    def executor(self) -> Optional[Executor]:
+        """ where the function runs, None for inline stages """
+        if self.kind not in KINDS:
+            raise Exception(f"unknown stage kind {self.kind}, use one of {KINDS}")
+        if self.kind == THREAD:
+            return ThreadPoolExecutor(
+                self.workers, self.name, self.initializer, self.initargs
+            )
+        if self.kind == PROCESS:
+            return ProcessPoolExecutor(
+                self.workers, None, self.initializer, self.initargs
+            )
+        return None
+
+
+@dataclass
+class StageStats:
+    """ Items that went in and out of a stage and the time spent on them """
+
+    name: str
+    items_in: int = 0
+    items_out: int = 0
+    seconds: float = 0.0
+    longest_queue: int = 0
+
+
+@dataclass
+class _Running:
+    stage: Stage
+    executor: Optional[Executor]
+    queue: asyncio.Queue
+    stats: StageStats
+    workers_left: int
+    # where the results go and how many workers read from there
+    output: Optional[asyncio.Queue] = None
+    readers: int = 1
+
+
+class Pipeline:
+    """A source, stages and a sink, run with Pipeline.run(). The sink is
+    called in the thread that runs the pipeline"""
+
+    def __init__(
+        self,
+        source: Iterable,
+        stages: List[Stage],
+        sink: Callable,
+        queue_size: int = QUEUE_SIZE,
+    ):
+        self.source = source
+        self.stages = stages
+        self.sink = sink
+        self.queue_size = queue_size
+        self.stats = [StageStats(stage.name) for stage in stages]
+
+    def run(self) -> List[StageStats]:
+        """runs until the source is exhausted and every item reached the sink.
+        An exception in any stage stops the pipeline and is raised here"""
+        asyncio.run(self._run())
+        return self.stats
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        running = [
+            _Running(
+                stage,
+                stage.executor(),
+                asyncio.Queue(self.queue_size),
+                stats,
+                stage.workers,
+            )
+            for stage, stats in zip(self.stages, self.stats)
+        ]
+        sink_queue: asyncio.Queue = asyncio.Queue(self.queue_size)
+        for step, following in zip(running, running[1:] + [None]):
+            step.output = following.queue if following else sink_queue
+            step.readers = following.stage.workers if following else 1
+        first_queue = running[0].queue if running else sink_queue
+        first_readers = running[0].stage.workers if running else 1
+
+        # the source is read in a thread of its own, it can block (walking folders)
+        source_reader = ThreadPoolExecutor(1, "source")
+        tasks = [
+            loop.create_task(
+                self._feed(loop, source_reader, first_queue, first_readers)
+            )
+        ]
+        for step in running:
+            for _ in range(step.stage.workers):
+                tasks.append(loop.create_task(self._work(loop, step)))
+        tasks.append(loop.create_task(self._drain(sink_queue)))
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        finally:
+            source_reader.shutdown(wait=False)
+            for step in running:
+                if step.executor:
+                    step.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _feed(self, loop, reader: Executor, queue: asyncio.Queue, readers: int):
+        iterator = iter(self.source)
+        while True:
+            item = await loop.run_in_executor(reader, next, iterator, DONE)
+            if item is DONE:
+                break
+            # waits here while the first stage is behind
+            await queue.put(item)
+        for _ in range(readers):
+            await queue.put(DONE)
+
+    async def _work(self, loop, step: _Running):
+        stage = step.stage
+        stats = step.stats
+        while True:
+            stats.longest_queue = max(stats.longest_queue, step.queue.qsize())
+            item = await step.queue.get()
+            if item is DONE:
+                break
+            stats.items_in += 1
+            if stage.applies is None or stage.applies(item):
+                start = time.perf_counter()
+                if step.executor:
+                    item = await loop.run_in_executor(
+                        step.executor, stage.function, item
+                    )
+                else:
+                    item = stage.function(item)
+                stats.seconds += time.perf_counter() - start
+            if item is not None:
+                stats.items_out += 1
+                # waits here while the next stage is behind
+                await step.output.put(item)
+        # the last worker of a stage tells the next one there is nothing else
+        step.workers_left -= 1
+        if not step.workers_left:
+            for _ in range(step.readers):
+                await step.output.put(DONE)
+
+    async def _drain(self, queue: asyncio.Queue):
+        while True:
+            item = await queue.get()
+            if item is DONE:
+                break
+            self.sink(item)
+
+
+def report(stats: List[StageStats], elapsed: float) -> str:
+    """ what every stage did """
+    lines = [f"===== Pipeline: {elapsed:.1f}s"]
+    for stage in stats:
+        lines.append(
+            f"{stage.name:<10} {stage.items_in:6} in {stage.items_out:6} out "
+            f"{stage.seconds:8.1f}s busy, up to {stage.longest_queue} waiting"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,387 @@
+"""
+Classification service for scanners and mail hooks: a pool of worker processes
+that have already imported the parsers, built the rules and loaded the
+dateparser languages, behind a small HTTP API on a Unix socket or on loopback.
+Documents are classified in about the time it takes to parse them, without the
+cold start of running classify.py for each one.
+
+    python -m service.server --socket /tmp/classify.sock
+    curl --unix-socket /tmp/classify.sock http://localhost/classify \\
+        -d '{"paths": ["/home/me/scans/statement.pdf"]}'
+    curl --unix-socket /tmp/classify.sock http://localhost/classify \\
+        -H "Content-Type: application/pdf" --data-binary @statement.pdf
+
+POST /classify accepts a PDF body (application/pdf) or JSON with "path",
+"paths" or "documents" (a list of {"name", "content"} with the content in
+base64). GET /health reports the workers and the queue. When the queue is full
+requests are answered with 503 and Retry-After, instead of piling up, and
+batches bigger than the whole queue or bodies over MAX_BODY with 413. When a worker dies (out of
+memory on a huge document, for instance) the pool is started again and the
+batch it was in is answered with 503.
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import os
+import signal
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+from typing import List, Optional, Tuple
+
+import dateparser
+
+from classify import (
+    analyse,
+    bank_parsers,
+    extract_lines,
+    layout_profiles,
+    page_cache,
+    target_file_name,
+)
+from storage.common import date_to_text, file_hash
+
+# parsed once in every worker so the languages are loaded before the first request
+WARM_UP_DATES = [
+    ("5 April 2019", ["en"]),
+    ("1 de enero de 2018", ["es"]),
+    ("31 Desembre de 2017", ["ca"]),
+]
+
+# results kept by content hash, scanners often send the same document twice
+CACHE_SIZE = 10000
+
+# bytes of the largest request body read, bigger ones are answered with 413
+MAX_BODY = 256 * 1024 * 1024
+
+# name, path and content of a document, only one of path and content is given
+Document = Tuple[str, Optional[str], Optional[bytes]]
+
+
+class Busy(Exception):
+    """ The queue is full, the request should be tried again later """
+
+
+class TooBig(Exception):
+    """ The batch or its body would never fit, it has to be split """
+
+
+def warm_up():
+    """runs once when every worker starts"""
+    bank_parsers()
+    for text, languages in WARM_UP_DATES:
+        dateparser.parse(text, languages=languages)
+
+
+def ready() -> int:
+    """ trivial task to start the workers """
+    return os.getpid()
+
+
+def classify_document(name: str, path: Optional[str], content: Optional[bytes]):
+    """classifies a document in a worker, from its path or its contents"""
+    result = {"name": name, "error": None}
+    try:
+        if content is not None:
+            with tempfile.NamedTemporaryFile(suffix=".pdf") as pdf_file:
+                pdf_file.write(content)
+                pdf_file.flush()
+                lines = extract_lines(pdf_file.name, page_cache, layout_profiles)
+                metadata = analyse(name, None, lines)
+        else:
+            metadata = analyse(
+                path, None, extract_lines(path, page_cache, layout_profiles)
+            )
+    except Exception as exc:  # noqa: E0602
+        result["error"] = f"{type(exc).__name__}: {exc}"
+        return result
+    if metadata:
+        result.update(
+            {
+                "bank": metadata.bank.value,
+                "classification": metadata.classification.value,
+                "entity": metadata.entity,
+                "extra_info": metadata.extra_info,
+                "period_start_date": date_to_text(metadata.period_start_date),
+                "period_end_date": date_to_text(metadata.period_end_date),
+                "file_name": target_file_name(metadata),
+            }
+        )
+    else:
+        result["bank"] = None
+    return result
+
+
+class ClassificationService:
+    """The pool of warm workers, with a bounded number of documents waiting or
+    being classified, and the results of the last documents seen"""
+
+    def __init__(self, workers: int, queue_size: int):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.executor = ProcessPoolExecutor(workers, initializer=warm_up)
+        self.restarts = 0
+        self.slots = threading.BoundedSemaphore(queue_size)
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.cache: "OrderedDict[str, dict]" = OrderedDict()
+
+    def start(self):
+        """starts all the workers, so the first requests don't pay for it"""
+        for started in [self.executor.submit(ready) for _ in range(self.workers)]:
+            started.result()
+
+    def _restart(self, broken: ProcessPoolExecutor):
+        """a new pool in place of one with a dead worker, once even if many
+        requests find it broken"""
+        with self.lock:
+            if self.executor is not broken:
+                return
+            self.executor = ProcessPoolExecutor(self.workers, initializer=warm_up)
+            self.restarts += 1
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def _reserve(self, count: int):
+        if count > self.queue_size:
+            raise TooBig(f"{count} documents, send at most {self.queue_size} at once")
+        acquired = 0
+        while acquired < count and self.slots.acquire(blocking=False):
+            acquired += 1
+        if acquired < count:
+            for _ in range(acquired):
+                self.slots.release()
+            raise Busy(f"{self.pending} documents queued, {count} more don't fit")
+        with self.lock:
+            self.pending += count
+
+    def _release(self, count: int):
+        with self.lock:
+            self.pending -= count
+        for _ in range(count):
+            self.slots.release()
+
+    def _cached(self, content_hash: str) -> Optional[dict]:
+        with self.lock:
+            if content_hash in self.cache:
+                self.cache.move_to_end(content_hash)
+                return self.cache[content_hash]
+        return None
+
+    def _remember(self, content_hash: str, result: dict):
+        if result["error"]:
+            return
+        with self.lock:
+            self.cache[content_hash] = result
+            if len(self.cache) > CACHE_SIZE:
+                self.cache.popitem(last=False)
+
+    def classify(self, documents: List[Document]) -> List[dict]:
+        """classifies a batch of documents, in parallel, raises Busy if they
+        don't fit in the queue right now, TooBig if they never will and
+        BrokenProcessPool if a worker died while classifying them"""
+        results: List[Optional[dict]] = [None] * len(documents)
+        to_classify = []
+        for position, (name, path, content) in enumerate(documents):
+            try:
+                if content is not None:
+                    content_hash = hashlib.sha256(content).hexdigest()
+                else:
+                    content_hash = file_hash(path)
+            except (OSError, TypeError) as exc:
+                results[position] = {"name": name, "error": str(exc)}
+                continue
+            cached = self._cached(content_hash)
+            if cached:
+                results[position] = dict(cached, name=name, hash=content_hash)
+            else:
+                to_classify.append((position, content_hash, name, path, content))
+
+        self._reserve(len(to_classify))
+        executor = self.executor
+        futures = []
+        try:
+            for position, content_hash, *job in to_classify:
+                future = executor.submit(classify_document, *job)
+                futures.append((position, content_hash, future))
+            for position, content_hash, future in futures:
+                result = future.result()
+                result["hash"] = content_hash
+                self._remember(content_hash, result)
+                results[position] = result
+        except BrokenProcessPool:
+            for _, _, future in futures:
+                future.cancel()
+            self._restart(executor)
+            raise
+        finally:
+            self._release(len(to_classify))
+        return results
+
+    def health(self) -> dict:
+        """ state of the service """
+        with self.lock:
+            return {
+                "workers": self.workers,
+                "queued": self.pending,
+                "capacity": self.queue_size,
+                "cached": len(self.cache),
+                "restarts": self.restarts,
+            }
+
+    def close(self):
+        """ stops the workers """
+        self.executor.shutdown()
+
+
+class ClassifyHandler(BaseHTTPRequestHandler):
+    """ HTTP API of the service """
+
+    server_version = "ClassificationService/1.0"
+
+    def address_string(self):
+        # clients of a Unix socket don't have an address
+        if isinstance(self.client_address, tuple):
+            return super().address_string()
+        return "local"
+
+    def _reply(self, status: int, body: dict, headers: dict = None):
+        payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _documents(self) -> List[Document]:
+        length = int(self.headers.get("Content-Length", 0))
+        if length < 0:
+            raise ValueError(f"invalid Content-Length {length}")
+        if length > MAX_BODY:
+            raise TooBig(f"{length} bytes, send at most {MAX_BODY} at once")
+        body = self.rfile.read(length)
+        if self.headers.get("Content-Type", "").startswith("application/pdf"):
+            return [(self.headers.get("X-File-Name", "document.pdf"), None, body)]
+        request = json.loads(body or b"{}")
+        if not isinstance(request, dict):
+            raise ValueError("the body must be a JSON object")
+        paths = request.get("paths", [])
+        if not isinstance(paths, list):
+            raise ValueError('"paths" must be a list')
+        if "path" in request:
+            paths = [request["path"]] + paths
+        if not all(isinstance(path, str) for path in paths):
+            raise ValueError("paths must be strings")
+        documents = [(path, path, None) for path in paths]
+        sent = request.get("documents", [])
+        if not isinstance(sent, list):
+            raise ValueError('"documents" must be a list')
+        for document in sent:
+            if not isinstance(document, dict) or not isinstance(
+                document.get("content"), str
+            ):
+                raise ValueError('documents must be objects with a base64 "content"')
+            name = document.get("name", "document.pdf")
+            if not isinstance(name, str):
+                raise ValueError("document names must be strings")
+            documents.append((name, None, base64.b64decode(document["content"])))
+        return documents
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """ GET /health """
+        if self.path != "/health":
+            self._reply(404, {"error": f"unknown path {self.path}"})
+            return
+        self._reply(200, self.server.service.health())
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """ POST /classify """
+        if self.path != "/classify":
+            self._reply(404, {"error": f"unknown path {self.path}"})
+            return
+        try:
+            documents = self._documents()
+        except (ValueError, KeyError, TypeError) as exc:
+            self._reply(400, {"error": f"invalid request: {exc}"})
+            return
+        except TooBig as exc:
+            # the body is not read, the connection can't be reused
+            self.close_connection = True
+            self._reply(413, {"error": str(exc)})
+            return
+        try:
+            results = self.server.service.classify(documents)
+        except Busy as exc:
+            self._reply(503, {"error": str(exc)}, {"Retry-After": "1"})
+            return
+        except TooBig as exc:
+            self._reply(413, {"error": str(exc)})
+            return
+        except BrokenProcessPool:
+            error = "a worker died classifying the batch, they were started again"
+            self._reply(503, {"error": error}, {"Retry-After": "1"})
+            return
+        self._reply(200, {"results": results})
+
+
+class UnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    """ HTTP on a Unix socket, only reachable from this machine """
+
+    daemon_threads = True
+
+
+def create_server(service: ClassificationService, socket_path=None, port=None):
+    """the HTTP server, on the Unix socket if given, otherwise on loopback"""
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = UnixHTTPServer(socket_path, ClassifyHandler)
+    else:
+        server = ThreadingHTTPServer(("127.0.0.1", port), ClassifyHandler)
+    server.service = service
+    return server
+
+
+def get_arguments():
+    """ parse provided command line arguments """
+    parser = argparse.ArgumentParser(description="classification service")
+    where = parser.add_mutually_exclusive_group(required=True)
+    where.add_argument("--socket", help="Unix socket to listen on")
+    where.add_argument("--port", type=int, help="loopback TCP port to listen on")
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count(), help="worker processes"
+    )
+    parser.add_argument(
+        "--queue",
+        type=int,
+        help="documents waiting or being classified before new requests are "
+        "rejected (4 per worker by default)",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_arguments()
+    classification = ClassificationService(args.workers, args.queue or 4 * args.workers)
+    classification.start()
+    http_server = create_server(classification, args.socket, args.port)
+    # stopped as a system service, clean up like with Ctrl+C
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    print(f"listening on {args.socket or f'127.0.0.1:{args.port}'}")
+    try:
+        http_server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        http_server.server_close()
+        classification.close()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
@@ -0,0 +1,250 @@
+"""
+SQLite catalog of classified documents. Every run can optionally record the
+metadata of each document so later questions ("all the Deutsche Bank mortgage
+documents from 2018") are answered with an indexed query instead of parsing
+all the PDFs again.
+"""
+
+import os
+import sqlite3
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Iterator, List, Optional, Tuple
+
+from parsing.metadata import Bank, DocType, DocumentMetadata
+from storage.common import date_to_text
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS documents (
+        path TEXT PRIMARY KEY,
+        hash TEXT NOT NULL,
+        bank TEXT NOT NULL,
+        classification TEXT NOT NULL,
+        entity TEXT,
+        extra_info TEXT,
+        period_start_date TEXT,
+        period_end_date TEXT,
+        year INTEGER,
+        simhash INTEGER
+    )
+    """,
+    # the typical lookups are by bank, by year and by type, in that order of selectivity
+    "CREATE INDEX IF NOT EXISTS documents_bank ON documents (bank, year, classification)",
+    "CREATE INDEX IF NOT EXISTS documents_year ON documents (year, classification)",
+    "CREATE INDEX IF NOT EXISTS documents_type ON documents (classification, year)",
+    "CREATE INDEX IF NOT EXISTS documents_hash ON documents (hash)",
+]
+
+COLUMNS = [
+    "path",
+    "hash",
+    "bank",
+    "classification",
+    "entity",
+    "extra_info",
+    "period_start_date",
+    "period_end_date",
+    "year",
+    "simhash",
+]
+
+# columns added after the first version of the schema, added to older catalogs
+# when they are opened
+MIGRATIONS = {"simhash": "ALTER TABLE documents ADD COLUMN simhash INTEGER"}
+
+
+@dataclass
+class CatalogEntry:
+    """ A document as recorded in the catalog """
+
+    path: str
+    hash: str
+    metadata: DocumentMetadata
+    fingerprint: Optional[int] = None
+
+
+def _to_signed(value: Optional[int]) -> Optional[int]:
+    """SQLite integers are signed 64 bit, fingerprints are unsigned"""
+    if value is None or value < 1 << 63:
+        return value
+    return value - (1 << 64)
+
+
+def _to_unsigned(value: Optional[int]) -> Optional[int]:
+    """back from the signed value stored in SQLite"""
+    if value is None or value >= 0:
+        return value
+    return value + (1 << 64)
+
+
+def _to_row(
+    path: str,
+    content_hash: str,
+    metadata: Optional[DocumentMetadata],
+    fingerprint: Optional[int] = None,
+):
+    """flattens a document into the values of a row, unknown documents are kept too
+    so they can be found later"""
+    if not metadata:
+        metadata = DocumentMetadata(
+            period_start_date=None,
+            bank=Bank.UNKNOWN,
+            classification=DocType.UNKNOWN,
+            entity="",
+            extra_info="",
+        )
+    start = metadata.period_start_date
+    return (
+        path,
+        content_hash,
+        metadata.bank.value,
+        metadata.classification.value,
+        metadata.entity,
+        metadata.extra_info,
+        date_to_text(start),
+        date_to_text(metadata.period_end_date),
+        start.year if start else None,
+        _to_signed(fingerprint),
+    )
+
+
+def _to_entry(row) -> CatalogEntry:
+    """builds back the metadata from a row"""
+
+    def to_date(text):
+        return datetime.strptime(text, "%Y-%m-%d") if text else None
+
+    return CatalogEntry(
+        path=row[0],
+        hash=row[1],
+        metadata=DocumentMetadata(
+            bank=Bank(row[2]),
+            classification=DocType(row[3]),
+            entity=row[4],
+            extra_info=row[5],
+            period_start_date=to_date(row[6]),
+            period_end_date=to_date(row[7]),
+        ),
+        fingerprint=_to_unsigned(row[9]),
+    )
+
+
+class Catalog:
+    """Local SQLite database with one row per classified document. Writes are
+    buffered and committed in batches, one transaction per batch"""
+
+    def __init__(self, path: str, batch_size: int = 500):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.connection:
+            for statement in SCHEMA:
+                self.connection.execute(statement)
+            existing = {
+                row[1]
+                for row in self.connection.execute("PRAGMA table_info(documents)")
+            }
+            for column, statement in MIGRATIONS.items():
+                if column not in existing:
+                    self.connection.execute(statement)
+        self.batch_size = batch_size
+        self.pending: List[tuple] = []
+
+    def add(
+        self,
+        path: str,
+        content_hash: str,
+        metadata: Optional[DocumentMetadata],
+        fingerprint: Optional[int] = None,
+    ):
+        """records a document, replacing any previous record for the same path"""
+        self.pending.append(
+            _to_row(os.path.abspath(path), content_hash, metadata, fingerprint)
+        )
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """writes all the pending documents in a single transaction"""
+        if not self.pending:
+            return
+        placeholders = ", ".join("?" for _ in COLUMNS)
+        with self.connection:
+            self.connection.executemany(
+                f"INSERT OR REPLACE INTO documents ({', '.join(COLUMNS)}) "
+                f"VALUES ({placeholders})",
+                self.pending,
+            )
+        self.pending = []
+
+    def query(
+        self,
+        bank: Bank = None,
+        year: int = None,
+        classification: DocType = None,
+        entity: str = None,
+    ) -> Iterator[CatalogEntry]:
+        """returns the documents matching all the given criteria, sorted by date.
+        entity matches if the value is contained in either entity or extra_info"""
+        self.flush()
+        clauses = []
+        values = []
+        if bank:
+            clauses.append("bank = ?")
+            values.append(bank.value)
+        if year:
+            clauses.append("year = ?")
+            values.append(year)
+        if classification:
+            clauses.append("classification = ?")
+            values.append(classification.value)
+        if entity:
+            clauses.append("(entity LIKE ? OR extra_info LIKE ?)")
+            values += [f"%{entity}%", f"%{entity}%"]
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        cursor = self.connection.execute(
+            f"SELECT {', '.join(COLUMNS)} FROM documents {where} "
+            "ORDER BY period_start_date, path",
+            values,
+        )
+        for row in cursor:
+            yield _to_entry(row)
+
+    def move(self, old_path: str, new_path: str):
+        """records that a document was moved"""
+        self.flush()
+        with self.connection:
+            self.connection.execute(
+                "UPDATE documents SET path = ? WHERE path = ?",
+                (os.path.abspath(new_path), os.path.abspath(old_path)),
+            )
+
+    def find_by_hash(self, content_hash: str) -> List[CatalogEntry]:
+        """returns all the documents recorded with the given content"""
+        self.flush()
+        cursor = self.connection.execute(
+            f"SELECT {', '.join(COLUMNS)} FROM documents WHERE hash = ? ORDER BY path",
+            (content_hash,),
+        )
+        return [_to_entry(row) for row in cursor]
+
+    def fingerprints(self) -> Iterator[Tuple[str, int]]:
+        """path and text fingerprint of all the documents that have one"""
+        self.flush()
+        cursor = self.connection.execute(
+            "SELECT path, simhash FROM documents WHERE simhash IS NOT NULL"
+        )
+        for path, fingerprint in cursor:
+            yield path, _to_unsigned(fingerprint)
+
+    def close(self):
+        """writes anything pending and releases the database"""
+        self.flush()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,230 @@
+"""
+Columnar, in-memory store of classification results, for summaries over very
+large archives. Instead of a DocumentMetadata object per document (each with
+its datetimes and its own strings) every field is a typed array: one byte codes
+for bank and type, day ordinals for dates and dictionary encoded strings, so a
+document costs a few tens of bytes.
+"""
+
+import csv
+from array import array
+from collections import Counter
+from datetime import date, datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from parsing.metadata import Bank, DocType, DocumentMetadata
+
+BANKS = list(Bank)
+DOC_TYPES = list(DocType)
+BANK_CODES = {bank: code for code, bank in enumerate(BANKS)}
+DOC_TYPE_CODES = {doc_type: code for code, doc_type in enumerate(DOC_TYPES)}
+
+# day ordinals start at 1, 0 is used for documents without a date
+NO_DATE = 0
+
+GROUP_KEYS = ["year", "bank", "type", "entity", "extra_info"]
+
+
+class StringColumn:
+    """Dictionary encoded strings: every distinct value is kept once and the
+    column holds the code of the value of every row"""
+
+    def __init__(self, values: List[Optional[str]] = None):
+        self.values: List[Optional[str]] = values if values is not None else []
+        self.codes_of: Dict[Optional[str], int] = {
+            value: code for code, value in enumerate(self.values)
+        }
+        self.codes = array("I")
+
+    def code(self, value: Optional[str]) -> int:
+        """ the code of a value, adding it to the dictionary if it's new """
+        code = self.codes_of.get(value)
+        if code is None:
+            code = len(self.values)
+            self.values.append(value)
+            self.codes_of[value] = code
+        return code
+
+    def append(self, value: Optional[str]):
+        """ adds a row """
+        self.codes.append(self.code(value))
+
+    def __getitem__(self, row: int) -> Optional[str]:
+        return self.values[self.codes[row]]
+
+    def take(self, rows: Iterable[int]) -> "StringColumn":
+        """ a column with only the given rows, sharing the dictionary """
+        column = StringColumn.__new__(StringColumn)
+        column.values = self.values
+        column.codes_of = self.codes_of
+        column.codes = array("I", (self.codes[row] for row in rows))
+        return column
+
+
+def _ordinal(value: Optional[datetime]) -> int:
+    return value.toordinal() if value else NO_DATE
+
+
+def _date(ordinal: int) -> Optional[datetime]:
+    return datetime.fromordinal(ordinal) if ordinal != NO_DATE else None
+
+
+class ResultColumns:
+    """Classification results, one row per document"""
+
+    def __init__(self):
+        self.paths = StringColumn()
+        self.banks = array("B")
+        self.classifications = array("B")
+        self.start_dates = array("i")
+        self.end_dates = array("i")
+        self.entities = StringColumn()
+        self.extra_infos = StringColumn()
+        # documents usually share a handful of dates, years are looked up once
+        self.years: Dict[int, Optional[int]] = {NO_DATE: None}
+
+    def __len__(self):
+        return len(self.banks)
+
+    def append(self, metadata: Optional[DocumentMetadata], path: str = ""):
+        """adds the result of a document, None if it wasn't recognised"""
+        if metadata is None:
+            metadata = DocumentMetadata(None, Bank.UNKNOWN, DocType.UNKNOWN, "", "")
+        self.paths.append(path)
+        self.banks.append(BANK_CODES[metadata.bank])
+        self.classifications.append(DOC_TYPE_CODES[metadata.classification])
+        self.start_dates.append(_ordinal(metadata.period_start_date))
+        self.end_dates.append(_ordinal(metadata.period_end_date))
+        self.entities.append(metadata.entity)
+        self.extra_infos.append(metadata.extra_info)
+
+    def row(self, row: int) -> Tuple[str, DocumentMetadata]:
+        """ the path and metadata of a row """
+        return (
+            self.paths[row],
+            DocumentMetadata(
+                period_start_date=_date(self.start_dates[row]),
+                bank=BANKS[self.banks[row]],
+                classification=DOC_TYPES[self.classifications[row]],
+                entity=self.entities[row],
+                extra_info=self.extra_infos[row],
+                period_end_date=_date(self.end_dates[row]),
+            ),
+        )
+
+    def year(self, row: int) -> Optional[int]:
+        """ year of the period start of a row """
+        return self._year_of(self.start_dates[row])
+
+    def _year_of(self, ordinal: int) -> Optional[int]:
+        if ordinal not in self.years:
+            self.years[ordinal] = date.fromordinal(ordinal).year
+        return self.years[ordinal]
+
+    def filter(
+        self,
+        bank: Bank = None,
+        year: int = None,
+        classification: DocType = None,
+        entity: str = None,
+    ) -> "ResultColumns":
+        """the rows matching all the given criteria, like Catalog.query. entity
+        matches if the value is contained in either entity or extra_info"""
+        checks = []
+        if bank:
+            code = BANK_CODES[bank]
+            checks.append(lambda row: self.banks[row] == code)
+        if classification:
+            code_type = DOC_TYPE_CODES[classification]
+            checks.append(lambda row: self.classifications[row] == code_type)
+        if year:
+            first = date(year, 1, 1).toordinal()
+            last = date(year, 12, 31).toordinal()
+            checks.append(lambda row: first <= self.start_dates[row] <= last)
+        if entity:
+            # the text is looked for once per distinct value, not once per row
+            entities = {
+                code
+                for code, value in enumerate(self.entities.values)
+                if value and entity in value
+            }
+            extra_infos = {
+                code
+                for code, value in enumerate(self.extra_infos.values)
+                if value and entity in value
+            }
+            checks.append(
+                lambda row: self.entities.codes[row] in entities
+                or self.extra_infos.codes[row] in extra_infos
+            )
+        return self.take(
+            row for row in range(len(self)) if all(check(row) for check in checks)
+        )
+
+    def take(self, rows: Iterable[int]) -> "ResultColumns":
+        """ a store with only the given rows """
+        rows = list(rows)
+        result = ResultColumns()
+        result.paths = self.paths.take(rows)
+        result.banks = array("B", (self.banks[row] for row in rows))
+        result.classifications = array("B", (self.classifications[row] for row in rows))
+        result.start_dates = array("i", (self.start_dates[row] for row in rows))
+        result.end_dates = array("i", (self.end_dates[row] for row in rows))
+        result.entities = self.entities.take(rows)
+        result.extra_infos = self.extra_infos.take(rows)
+        result.years = self.years
+        return result
+
+    def _column(self, name: str):
+        """the codes of a column and how to turn a code into its value"""
+        if name == "year":
+            return self.start_dates, self._year_of
+        if name == "bank":
+            return self.banks, lambda code: BANKS[code].value
+        if name == "type":
+            return self.classifications, lambda code: DOC_TYPES[code].value
+        if name == "entity":
+            return self.entities.codes, self.entities.values.__getitem__
+        if name == "extra_info":
+            return self.extra_infos.codes, self.extra_infos.values.__getitem__
+        raise Exception(f"can't group by {name}, only by {', '.join(GROUP_KEYS)}")
+
+    def group_by(self, *names: str) -> Dict[tuple, int]:
+        """number of documents for every combination of values of the given
+        columns (year, bank, type, entity, extra_info)"""
+        columns = [self._column(name) for name in names]
+        # rows are counted by their codes, values are only looked up per group
+        counts: Dict[tuple, int] = {}
+        for codes, count in Counter(zip(*(codes for codes, _ in columns))).items():
+            group = tuple(value(code) for code, (_, value) in zip(codes, columns))
+            counts[group] = counts.get(group, 0) + count
+        return counts
+
+    def to_csv(self, path: str):
+        """ writes all the rows to a CSV file """
+        with open(path, "w", newline="", encoding="utf-8") as output:
+            writer = csv.writer(output)
+            writer.writerow(
+                [
+                    "path",
+                    "bank",
+                    "classification",
+                    "entity",
+                    "extra_info",
+                    "period_start_date",
+                    "period_end_date",
+                ]
+            )
+            for row in range(len(self)):
+                start, end = self.start_dates[row], self.end_dates[row]
+                writer.writerow(
+                    [
+                        self.paths[row],
+                        BANKS[self.banks[row]].value,
+                        DOC_TYPES[self.classifications[row]].value,
+                        self.entities[row],
+                        self.extra_infos[row],
+                        date.fromordinal(start).isoformat() if start else "",
+                        date.fromordinal(end).isoformat() if end else "",
+                    ]
+                )
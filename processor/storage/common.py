@@ -0,0 +1,27 @@
+"""
+Helpers shared by the different stores that keep track of processed documents
+"""
+
+import hashlib
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def file_hash(file_name: str) -> str:
+    """returns the sha256 of the contents of the given file as an hex string,
+    reading it in blocks so big documents don't need to fit in memory
+    """
+    digest = hashlib.sha256()
+    with open(file_name, "rb") as source:
+        block = source.read(HASH_BLOCK_SIZE)
+        while block:
+            digest.update(block)
+            block = source.read(HASH_BLOCK_SIZE)
+    return digest.hexdigest()
+
+
+def date_to_text(date):
+    """dates are stored as ISO yyyy-mm-dd strings so they sort and compare in SQL"""
+    if not date:
+        return None
+    return date.strftime("%Y-%m-%d")
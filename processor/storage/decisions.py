@@ -0,0 +1,136 @@
+"""
+Record of how every document was classified: which bank and which of its
+rules decided it, and which rule patterns were found in its text. Together
+with a snapshot of the rules in use, this tells which documents can change
+when the rules are edited, so only those are evaluated again.
+"""
+
+import json
+import sqlite3
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Tuple
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS decisions (
+        hash TEXT PRIMARY KEY,
+        bank TEXT,
+        rule INTEGER,
+        hits TEXT NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS rulesets (
+        bank TEXT PRIMARY KEY,
+        position INTEGER NOT NULL,
+        definition TEXT NOT NULL
+    )
+    """,
+]
+
+
+@dataclass
+class Decision:
+    """How a document was classified. bank is None if no bank claimed it and
+    rule is None when the bank didn't decide it with one of its simple_mappings"""
+
+    hash: str
+    bank: Optional[str]
+    rule: Optional[int]
+    hits: List[Tuple[str, ...]]
+
+
+class DecisionStore:
+    """Decisions and rule snapshots, kept in the catalog database"""
+
+    def __init__(self, path: str, batch_size: int = 500):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.connection:
+            for statement in SCHEMA:
+                self.connection.execute(statement)
+        self.batch_size = batch_size
+        self.pending: List[tuple] = []
+
+    def add(self, decision: Decision):
+        """records how a document was classified, replacing the previous record"""
+        self.pending.append(
+            (
+                decision.hash,
+                decision.bank,
+                decision.rule,
+                json.dumps([list(pattern) for pattern in decision.hits]),
+            )
+        )
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """writes all pending decisions in a single transaction"""
+        if not self.pending:
+            return
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO decisions (hash, bank, rule, hits) "
+                "VALUES (?, ?, ?, ?)",
+                self.pending,
+            )
+        self.pending = []
+
+    def forget(self, hashes: List[str]):
+        """removes the decisions of some documents, they are evaluated again
+        the next time whatever the rules changed"""
+        self.flush()
+        with self.connection:
+            self.connection.executemany(
+                "DELETE FROM decisions WHERE hash = ?",
+                [(content_hash,) for content_hash in hashes],
+            )
+
+    def decisions(self) -> Iterator[Decision]:
+        """ all the decisions recorded """
+        self.flush()
+        cursor = self.connection.execute("SELECT hash, bank, rule, hits FROM decisions")
+        for content_hash, bank, rule, hits in cursor:
+            yield Decision(
+                content_hash,
+                bank,
+                rule,
+                [tuple(pattern) for pattern in json.loads(hits)],
+            )
+
+    def rulesets(self) -> Dict[str, Tuple[int, dict]]:
+        """snapshot of the rules the decisions were made with: for each bank
+        its position in the order banks are tried, and its rules"""
+        cursor = self.connection.execute(
+            "SELECT bank, position, definition FROM rulesets"
+        )
+        return {
+            bank: (position, json.loads(definition))
+            for bank, position, definition in cursor
+        }
+
+    def save_rulesets(self, rulesets: Dict[str, Tuple[int, dict]]):
+        """replaces the snapshot of the rules"""
+        self.flush()
+        with self.connection:
+            self.connection.execute("DELETE FROM rulesets")
+            self.connection.executemany(
+                "INSERT INTO rulesets (bank, position, definition) VALUES (?, ?, ?)",
+                [
+                    (bank, position, json.dumps(definition, ensure_ascii=False))
+                    for bank, (position, definition) in rulesets.items()
+                ],
+            )
+
+    def close(self):
+        """writes anything pending and releases the database"""
+        self.flush()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
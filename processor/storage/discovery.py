@@ -0,0 +1,197 @@
+"""
+Discovery of the PDF documents under the folders given. Directories are read
+with os.scandir by a few threads at the same time, which matters on network
+mounted archives, and the type of every entry comes from the directory listing
+itself, without a stat per file. Documents are recognised by the %PDF- header
+and not by their extension, so "STATEMENT.PDF" downloads and attachments
+saved without extension are found too. Documents are yielded one folder at a
+time and always in the same order, like a sorted os.walk: the documents of a
+folder by name, then its subfolders by name. The next folders are read while
+the documents of the current one are processed. At most SCAN_AHEAD folders are
+read ahead, so the walk waits when the documents are not taken fast enough.
+
+Exclude patterns follow the .gitignore syntax: "*" and "?" don't match "/",
+"**" matches any number of directories, a pattern with a "/" is relative to
+the folder given, a trailing "/" only matches directories, "!" includes again
+what an earlier pattern excluded and lines starting with "#" are comments.
+Patterns are also read from a .classifyignore file in the folder given.
+"""
+
+import os
+import re
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+PDF_MAGIC = b"%PDF-"
+# the header doesn't have to be at the very beginning of the file
+SNIFF_BYTES = 1024
+
+IGNORE_FILE = ".classifyignore"
+
+# folders read and not yet walked, the walk waits when there are more
+SCAN_AHEAD = 16
+
+
+def translate(pattern: str) -> Optional[Tuple[re.Pattern, bool, bool]]:
+    """a gitignore pattern as a regex over paths relative to the root with "/"
+    separators, whether it includes again and whether it's only for directories.
+    None for blank lines and comments"""
+    pattern = pattern.rstrip("\n").rstrip()
+    if not pattern or pattern.startswith("#"):
+        return None
+    negate = pattern.startswith("!")
+    if negate:
+        pattern = pattern[1:]
+    directories_only = pattern.endswith("/")
+    pattern = pattern.rstrip("/")
+    anchored = "/" in pattern
+    pattern = pattern.lstrip("/")
+
+    body = ""
+    position = 0
+    while position < len(pattern):
+        if pattern.startswith("**/", position):
+            body += "(?:.*/)?"
+            position += 3
+        elif pattern.startswith("**", position):
+            body += ".*"
+            position += 2
+        elif pattern[position] == "*":
+            body += "[^/]*"
+            position += 1
+        elif pattern[position] == "?":
+            body += "[^/]"
+            position += 1
+        elif pattern[position] == "[" and "]" in pattern[position + 1 :]:
+            end = pattern.index("]", position + 1)
+            characters = pattern[position + 1 : end].replace("\\", "\\\\")
+            if characters.startswith("!"):
+                characters = "^" + characters[1:]
+            body += f"[{characters}]"
+            position = end + 1
+        else:
+            body += re.escape(pattern[position])
+            position += 1
+    prefix = "^" if anchored else "^(?:.*/)?"
+    return re.compile(f"{prefix}{body}$"), negate, directories_only
+
+
+def read_patterns(path: str) -> List[str]:
+    """ the patterns in an ignore file """
+    with open(path, encoding="utf-8") as patterns:
+        return patterns.readlines()
+
+
+class IgnoreRules:
+    """Exclude patterns, the last one that matches a path decides"""
+
+    def __init__(self, patterns: List[str] = None):
+        self.rules = [
+            rule for rule in (translate(pattern) for pattern in patterns or []) if rule
+        ]
+
+    def ignored(self, relative_path: str, is_directory: bool) -> bool:
+        """ true if the path is excluded """
+        ignored = False
+        for regex, negate, directories_only in self.rules:
+            if directories_only and not is_directory:
+                continue
+            if regex.match(relative_path):
+                ignored = not negate
+        return ignored
+
+
+def is_pdf(path: str) -> bool:
+    """ true if the file starts like a PDF document """
+    try:
+        with open(path, "rb") as document:
+            return PDF_MAGIC in document.read(SNIFF_BYTES)
+    except OSError:
+        return False
+
+
+class Discovery:
+    """Finds the PDF documents under a folder. With trust_extension files are
+    taken by their name (.pdf in any case) and not opened"""
+
+    def __init__(
+        self,
+        excludes: List[str] = None,
+        trust_extension: bool = False,
+        threads: int = 4,
+    ):
+        self.excludes = list(excludes or [])
+        self.trust_extension = trust_extension
+        self.threads = max(1, threads)
+
+    def _accepts(self, path: str) -> bool:
+        if self.trust_extension:
+            return path.lower().endswith(".pdf")
+        return is_pdf(path)
+
+    def find(self, root: str) -> Iterator[str]:
+        """the documents in the folder, or the file itself if it's a document"""
+        if os.path.isfile(root):
+            if self._accepts(root):
+                yield root
+            return
+        if not os.path.isdir(root):
+            return
+
+        patterns = list(self.excludes)
+        if os.path.isfile(os.path.join(root, IGNORE_FILE)):
+            patterns = read_patterns(os.path.join(root, IGNORE_FILE)) + patterns
+        rules = IgnoreRules(patterns)
+
+        stop = threading.Event()
+        executor = ThreadPoolExecutor(self.threads)
+        scans: Dict[str, Future] = {}
+        # the folders still to walk, the next one last
+        pending = [root]
+
+        def scan(directory: str) -> Tuple[List[str], List[str]]:
+            # the documents and the subfolders to walk, by name
+            documents: List[str] = []
+            directories: List[str] = []
+            try:
+                with os.scandir(directory) as listing:
+                    entries = sorted(listing, key=lambda entry: entry.name)
+                for entry in entries:
+                    if stop.is_set():
+                        break
+                    relative = os.path.relpath(entry.path, root).replace(os.sep, "/")
+                    # the type comes from the listing, no stat unless it's a link
+                    if entry.is_dir(follow_symlinks=False):
+                        if not rules.ignored(relative, True):
+                            directories.append(entry.path)
+                    elif entry.is_file() and entry.name != IGNORE_FILE:
+                        if not rules.ignored(relative, False) and self._accepts(
+                            entry.path
+                        ):
+                            documents.append(entry.path)
+            except OSError:
+                # like os.walk, directories that can't be read are skipped
+                pass
+            return documents, directories
+
+        def scan_ahead():
+            for directory in reversed(pending):
+                if len(scans) >= SCAN_AHEAD:
+                    break
+                if directory not in scans:
+                    scans[directory] = executor.submit(scan, directory)
+
+        try:
+            while pending:
+                scan_ahead()
+                directory = pending.pop()
+                future = scans.pop(directory, None) or executor.submit(scan, directory)
+                documents, directories = future.result()
+                pending.extend(reversed(directories))
+                # the next folders are read while these documents are processed
+                scan_ahead()
+                yield from documents
+        finally:
+            stop.set()
+            executor.shutdown(wait=False, cancel_futures=True)
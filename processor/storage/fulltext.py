@@ -0,0 +1,130 @@
+"""
+Full text index over the lines extracted from the documents, using SQLite FTS5.
+The text is stored once per document hash, so copies of the same PDF don't add
+anything, and it's updated incrementally as new documents are classified.
+"""
+
+import sqlite3
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS document_texts (
+        id INTEGER PRIMARY KEY,
+        hash TEXT NOT NULL UNIQUE
+    )
+    """,
+    # remove_diacritics so that "prestec" also finds "PRÉSTEC"
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS texts USING fts5(
+        body, tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """,
+]
+
+# lines can contain new lines themselves, so they are joined with a control
+# character that pdfminer never produces and the tokenizer treats as a separator
+LINE_SEPARATOR = "\x1e"
+
+
+@dataclass
+class SearchResult:
+    """ A document matching a full text search """
+
+    hash: str
+    snippet: str
+    rank: float
+
+
+def quote_terms(text: str) -> str:
+    """turns free text into an FTS5 query where every word must appear, so
+    punctuation like in "S.L." or "A−80017403" isn't taken as query syntax"""
+    return " ".join('"' + term.replace('"', '""') + '"' for term in text.split())
+
+
+class FullTextIndex:
+    """Text of the documents, indexed for ranked full text search"""
+
+    def __init__(self, path: str, batch_size: int = 100):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.connection:
+            for statement in SCHEMA:
+                self.connection.execute(statement)
+        self.batch_size = batch_size
+        self.pending: Dict[str, List[str]] = {}
+
+    def contains(self, content_hash: str) -> bool:
+        """true if the text for the document is already indexed"""
+        if content_hash in self.pending:
+            return True
+        row = self.connection.execute(
+            "SELECT 1 FROM document_texts WHERE hash = ?", (content_hash,)
+        ).fetchone()
+        return row is not None
+
+    def add(self, content_hash: str, lines: List[str]):
+        """indexes the lines of a document unless a document with the same
+        hash has been indexed already"""
+        if self.contains(content_hash):
+            return
+        self.pending[content_hash] = lines
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """writes all pending texts in a single transaction"""
+        if not self.pending:
+            return
+        with self.connection:
+            for content_hash, lines in self.pending.items():
+                cursor = self.connection.execute(
+                    "INSERT OR IGNORE INTO document_texts (hash) VALUES (?)",
+                    (content_hash,),
+                )
+                if cursor.rowcount:
+                    self.connection.execute(
+                        "INSERT INTO texts (rowid, body) VALUES (?, ?)",
+                        (cursor.lastrowid, LINE_SEPARATOR.join(lines)),
+                    )
+        self.pending = {}
+
+    def lines(self, content_hash: str) -> Optional[List[str]]:
+        """returns the lines stored for a document, None if it's not indexed"""
+        if content_hash in self.pending:
+            return self.pending[content_hash]
+        row = self.connection.execute(
+            "SELECT texts.body FROM document_texts "
+            "JOIN texts ON texts.rowid = document_texts.id "
+            "WHERE document_texts.hash = ?",
+            (content_hash,),
+        ).fetchone()
+        return row[0].split(LINE_SEPARATOR) if row else None
+
+    def search(self, query: str, limit: int = 20) -> Iterator[SearchResult]:
+        """ranked search (bm25) using the FTS5 query syntax, returns the best
+        matches first with the matching terms highlighted in [brackets]"""
+        self.flush()
+        cursor = self.connection.execute(
+            "SELECT document_texts.hash, "
+            "snippet(texts, 0, '[', ']', '...', 12), texts.rank "
+            "FROM texts JOIN document_texts ON document_texts.id = texts.rowid "
+            "WHERE texts MATCH ? ORDER BY texts.rank LIMIT ?",
+            (query, limit),
+        )
+        for content_hash, snippet, rank in cursor:
+            snippet = " ".join(snippet.replace(LINE_SEPARATOR, " ").split())
+            yield SearchResult(hash=content_hash, snippet=snippet, rank=rank)
+
+    def close(self):
+        """writes anything pending and releases the database"""
+        self.flush()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,272 @@
+"""
+Sharded runs: the PDFs found are split between N runs (in different machines
+or processes) by a hash of their path or their contents, so every document
+belongs to exactly one shard and shards get about the same number of
+documents. Every shard writes the results to its own manifest, a JSON lines
+file, and the manifests are merged into a single result set afterwards.
+Documents are recorded by the name of the folder given and their path
+relative to it, so the shards can run in machines that mount the documents in
+different places, and documents with the same path in two folders are told
+apart.
+"""
+
+import hashlib
+import json
+import os
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from parsing.metadata import DocumentMetadata
+from storage.common import date_to_text, file_hash
+
+SHARD_BY = ["path", "content"]
+
+# fields of a document in a manifest that must agree between shards
+RESULT_FIELDS = [
+    "bank",
+    "classification",
+    "entity",
+    "extra_info",
+    "period_start_date",
+    "period_end_date",
+    "file_name",
+]
+
+
+def relative_path(pdf_file: str, root: str) -> str:
+    """the path of a document relative to the folder it was found in, its
+    name if it was given directly"""
+    if os.path.isdir(root):
+        return os.path.relpath(pdf_file, root).replace(os.sep, "/")
+    return os.path.basename(pdf_file)
+
+
+@dataclass
+class Shard:
+    """Shard number index (from 1) of count"""
+
+    index: int
+    count: int
+    by: str = "path"
+    # contents hashes of the documents of the shard, until the run takes them
+    hashes: Dict[str, str] = field(default_factory=dict, repr=False, compare=False)
+
+    @classmethod
+    def parse(cls, text: str, by: str = "path") -> "Shard":
+        """ from the i/N notation """
+        try:
+            index, count = (int(part) for part in text.split("/"))
+        except ValueError:
+            raise Exception(f"shards are given as i/N, like 1/4, not {text}")
+        if not 1 <= index <= count:
+            raise Exception(f"shard {index} doesn't exist, there are {count}")
+        if by not in SHARD_BY:
+            raise Exception(f"shards are split by {' or '.join(SHARD_BY)}, not {by}")
+        return cls(index, count, by)
+
+    def __str__(self):
+        return f"{self.index}/{self.count}"
+
+    def key(self, pdf_file: str, root: str) -> str:
+        """what is hashed to choose the shard of a document: its contents or
+        its path relative to the folder given, so machines can mount the
+        documents in different places"""
+        if self.by == "content":
+            return file_hash(pdf_file)
+        return relative_path(pdf_file, root)
+
+    def contains(self, pdf_file: str, root: str) -> bool:
+        """ true if the document belongs to this shard """
+        key = self.key(pdf_file, root)
+        digest = hashlib.sha1(key.encode("utf-8")).digest()
+        belongs = int.from_bytes(digest[:8], "big") % self.count == self.index - 1
+        if belongs and self.by == "content":
+            self.hashes[pdf_file] = key
+        return belongs
+
+    def content_hash(self, pdf_file: str) -> str:
+        """the contents hash of a document of the shard, the one computed to
+        choose the shard if it was split by contents"""
+        return self.hashes.pop(pdf_file, None) or file_hash(pdf_file)
+
+
+class ManifestWriter:
+    """Writes the result of every document of a run as soon as it is known,
+    so a run that is interrupted keeps what was done"""
+
+    def __init__(
+        self, path: str, shard: Optional[Shard] = None, roots: List[str] = None
+    ):
+        self.roots = list(roots or [])
+        # the folders given by name, numbered when two have the same name
+        self.names: Dict[str, str] = {}
+        for root in self.roots:
+            name = ""
+            if os.path.isdir(root):
+                name = os.path.basename(os.path.abspath(root))
+            number = 1
+            named = name
+            while named in self.names.values():
+                number += 1
+                named = f"{name} ({number})"
+            self.names[root] = named
+        self.output = open(path, "w", encoding="utf-8")
+        header = {
+            "shard": str(shard) if shard else "1/1",
+            "by": shard.by if shard else "path",
+        }
+        self._write(header)
+
+    def key(self, pdf_file: str) -> Tuple[str, str]:
+        """the name of the first of the folders given that has the document
+        and its path relative to it, as the shards are chosen. Documents given
+        directly have no folder name"""
+        absolute = os.path.abspath(pdf_file)
+        for root in self.roots:
+            full_root = os.path.abspath(root)
+            if absolute == full_root or (
+                os.path.isdir(full_root)
+                and absolute.startswith(full_root.rstrip(os.sep) + os.sep)
+            ):
+                return self.names[root], relative_path(absolute, full_root)
+        return "", pdf_file
+
+    def _write(self, record: dict):
+        self.output.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.output.flush()
+
+    def add(
+        self,
+        path: str,
+        content_hash: str,
+        metadata: Optional[DocumentMetadata],
+        file_name: Optional[str],
+    ):
+        """ records the result of a document """
+        root, relative = self.key(path)
+        record = {"root": root, "path": relative, "hash": content_hash, "bank": None}
+        if metadata:
+            record.update(
+                {
+                    "bank": metadata.bank.value,
+                    "classification": metadata.classification.value,
+                    "entity": metadata.entity,
+                    "extra_info": metadata.extra_info,
+                    "period_start_date": date_to_text(metadata.period_start_date),
+                    "period_end_date": date_to_text(metadata.period_end_date),
+                    "file_name": file_name,
+                }
+            )
+        self._write(record)
+
+    def close(self):
+        """ finishes the manifest """
+        self.output.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_manifest(path: str) -> Tuple[dict, List[dict]]:
+    """ header and documents of a manifest """
+    with open(path, encoding="utf-8") as manifest:
+        records = [json.loads(line) for line in manifest if line.strip()]
+    if not records or "shard" not in records[0]:
+        raise Exception(f"{path} is not a manifest")
+    return records[0], records[1:]
+
+
+def _result(document: dict) -> tuple:
+    return tuple(document.get(field) for field in RESULT_FIELDS)
+
+
+def _key(document: dict) -> Tuple[str, str]:
+    return document.get("root", ""), document["path"]
+
+
+def _shown(key: Tuple[str, str]) -> str:
+    root, path = key
+    return f"{root}/{path}" if root else path
+
+
+@dataclass
+class MergedManifests:
+    """Documents of all the shards sorted by folder and path, and the problems found:
+    shards missing, documents in more than one shard, and documents with the
+    same contents but different results"""
+
+    documents: List[dict]
+    missing_shards: List[str]
+    overlaps: List[str]
+    conflicts: List[str]
+
+
+def merge_manifests(paths: List[str]) -> MergedManifests:
+    """ merges the manifests of the shards of a run """
+    counts = set()
+    splits = set()
+    seen_shards = set()
+    by_key: Dict[Tuple[str, str], dict] = {}
+    shard_of: Dict[Tuple[str, str], str] = {}
+    overlaps = []
+    conflicts = []
+    for path in sorted(paths):
+        header, documents = read_manifest(path)
+        index, count = (int(part) for part in header["shard"].split("/"))
+        counts.add(count)
+        splits.add(header.get("by", "path"))
+        seen_shards.add(index)
+        for document in documents:
+            key = _key(document)
+            previous = by_key.get(key)
+            if previous is None:
+                by_key[key] = document
+                shard_of[key] = header["shard"]
+                continue
+            first_shard = shard_of[key]
+            overlaps.append(
+                f"{_shown(key)} is in shards {first_shard} and {header['shard']}"
+            )
+            if _result(previous) != _result(document):
+                conflicts.append(
+                    f"{_shown(key)}: {_result(previous)} in shard "
+                    f"{first_shard}, {_result(document)} in {header['shard']}"
+                )
+
+    if len(counts) > 1:
+        raise Exception(f"manifests of runs with different shard counts {counts}")
+    if len(splits) > 1:
+        raise Exception(f"manifests of runs split in different ways {splits}")
+    missing = [
+        f"{index}/{count}"
+        for count in counts
+        for index in range(1, count + 1)
+        if index not in seen_shards
+    ]
+
+    documents = [by_key[key] for key in sorted(by_key)]
+    # the same document classified differently in different places
+    results_by_hash: Dict[str, Tuple[tuple, str]] = {}
+    for document in documents:
+        result = _result(document)
+        first = results_by_hash.setdefault(
+            document["hash"], (result, _shown(_key(document)))
+        )
+        if first[0] != result:
+            conflicts.append(
+                f"{_shown(_key(document))} has the same contents as {first[1]} but "
+                f"{result} instead of {first[0]}"
+            )
+    return MergedManifests(documents, missing, overlaps, conflicts)
+
+
+def write_merged(merged: MergedManifests, path: str):
+    """ writes the merged documents as a single manifest """
+    with open(path, "w", encoding="utf-8") as output:
+        output.write(json.dumps({"shard": "1/1", "by": "path"}) + "\n")
+        for document in merged.documents:
+            output.write(json.dumps(document, ensure_ascii=False) + "\n")
+
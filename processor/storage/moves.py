@@ -0,0 +1,197 @@
+"""
+Moving the classified documents into a <year>/<bank>/<classification> tree.
+The moves are planned once all the documents are classified, grouped by target
+directory and with name collisions resolved, and then done with os.replace
+when source and target are in the same filesystem (a rename, no copying).
+
+Every move is written to a journal before it's done, so a run can be undone,
+also if it was interrupted: undoing moves back every file that is at its
+target and not at its source, in reverse order.
+"""
+
+import json
+import os
+import shutil
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from parsing.metadata import DocumentMetadata
+from storage.common import file_hash
+
+
+@dataclass
+class Move:
+    """ A document and where it goes """
+
+    source: str
+    target: str
+
+
+def target_directory(root: str, metadata: DocumentMetadata) -> str:
+    """ folder of a document in the organised tree """
+    return os.path.join(
+        root,
+        str(metadata.period_start_date.year),
+        metadata.bank.value,
+        metadata.classification.value,
+    )
+
+
+def _same_contents(first: str, second: str) -> bool:
+    if os.path.getsize(first) != os.path.getsize(second):
+        return False
+    return file_hash(first) == file_hash(second)
+
+
+def _numbered(file_name: str, number: int) -> str:
+    base, extension = os.path.splitext(file_name)
+    return f"{base} ({number}){extension}"
+
+
+class MovePlan:
+    """Collects the documents classified during a run and plans their moves"""
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        self.documents: List[Tuple[str, str, str]] = []
+
+    def add(self, path: str, metadata: Optional[DocumentMetadata], file_name: str):
+        """a classified document, unknown ones (no metadata) stay where they are"""
+        if not metadata or not metadata.period_start_date or not file_name:
+            return
+        self.documents.append(
+            (
+                os.path.abspath(path),
+                target_directory(self.root, metadata),
+                file_name,
+            )
+        )
+
+    def plan(self) -> Tuple[List[Move], List[str], List[Move]]:
+        """the moves grouped by target directory, the documents already at
+        their target and the ones with an identical file at their target,
+        which are left where they are. Names already taken get a number:
+        "name (2).pdf" """
+        moves = []
+        in_place = []
+        duplicates = []
+        taken = set()
+        by_directory: Dict[str, List[Tuple[str, str]]] = {}
+        for source, directory, file_name in self.documents:
+            by_directory.setdefault(directory, []).append((source, file_name))
+
+        for directory in sorted(by_directory):
+            for source, file_name in sorted(by_directory[directory]):
+                target = os.path.join(directory, file_name)
+                number = 1
+                while target != source and (
+                    target in taken
+                    or (os.path.exists(target) and not _same_contents(source, target))
+                ):
+                    number += 1
+                    target = os.path.join(directory, _numbered(file_name, number))
+                taken.add(target)
+                if target == source:
+                    in_place.append(source)
+                elif os.path.exists(target):
+                    # the same document is there, this copy is not moved
+                    duplicates.append(Move(source, target))
+                else:
+                    moves.append(Move(source, target))
+        return moves, in_place, duplicates
+
+
+def _move(source: str, target: str):
+    """a rename when possible, a copy and delete across filesystems"""
+    if os.stat(source).st_dev == os.stat(os.path.dirname(target)).st_dev:
+        os.replace(source, target)
+    else:
+        shutil.move(source, target)
+
+
+class Journal:
+    """JSON lines file with every move, written before doing it"""
+
+    def __init__(self, path: str, root: str):
+        self.path = path
+        self.output = open(path, "a", encoding="utf-8")
+        self._write(
+            {
+                "started": datetime.now().isoformat(timespec="seconds"),
+                "root": os.path.abspath(root),
+            }
+        )
+
+    def _write(self, record: dict):
+        self.output.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def add(self, move: Move):
+        """ records a move that is about to happen """
+        self._write({"source": move.source, "target": move.target})
+
+    def sync(self):
+        """ makes sure the moves recorded so far are on disk """
+        self.output.flush()
+        os.fsync(self.output.fileno())
+
+    def close(self):
+        """ finishes the journal """
+        self.sync()
+        self.output.close()
+
+
+def apply_moves(moves: List[Move], journal: Journal, catalog=None) -> int:
+    """does the moves, a directory at a time: the directory is created, its
+    moves are journaled and synced, and then done. Returns the moves done"""
+    done = 0
+    by_directory: Dict[str, List[Move]] = {}
+    for move in moves:
+        by_directory.setdefault(os.path.dirname(move.target), []).append(move)
+    for directory, directory_moves in by_directory.items():
+        os.makedirs(directory, exist_ok=True)
+        for move in directory_moves:
+            journal.add(move)
+        journal.sync()
+        for move in directory_moves:
+            _move(move.source, move.target)
+            if catalog:
+                catalog.move(move.source, move.target)
+            done += 1
+    return done
+
+
+def undo_moves(journal_path: str, catalog=None) -> Tuple[int, List[str]]:
+    """moves back the documents of a journal, the last move first. Returns the
+    moves undone and the ones that couldn't be (changed since)"""
+    with open(journal_path, encoding="utf-8") as journal:
+        records = [json.loads(line) for line in journal if line.strip()]
+    roots = [record["root"] for record in records if "root" in record]
+    moves = [
+        Move(record["source"], record["target"])
+        for record in records
+        if "source" in record
+    ]
+
+    undone = 0
+    skipped = []
+    for move in reversed(moves):
+        if os.path.exists(move.source):
+            if os.path.exists(move.target):
+                skipped.append(f"{move.source} and {move.target} both exist")
+            # else: never moved, the run was interrupted before it
+            continue
+        if not os.path.exists(move.target):
+            skipped.append(f"{move.target} is gone")
+            continue
+        os.makedirs(os.path.dirname(move.source), exist_ok=True)
+        _move(move.target, move.source)
+        if catalog:
+            catalog.move(move.target, move.source)
+        undone += 1
+        # folders created by the moves are removed when they end up empty
+        directory = os.path.dirname(move.target)
+        while directory not in roots and not os.listdir(directory):
+            os.rmdir(directory)
+            directory = os.path.dirname(directory)
+    return undone, skipped